@@ -1,56 +1,139 @@
 from libs.agent import Agent
-from libs.common import ToolCall, ToolsetDetails, Message
+from libs.common import ToolCall, ToolsetDetails, Message, ollama_client_pool, DEFAULT_CHAT_MODEL
+from libs.backend_pool import BackendPool
+from libs.agent_database import get_agent_database_writer
 from libs.app_manager import AppManager
-from typing import List, Callable
+from libs.metrics import metrics, start_metrics_server
+from typing import List, Callable, Union
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
 
 import os
 import shutil
 import traceback
 import sys
-#supress unclosed socket warnings
-import warnings
+import threading
 import io
 
-warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
+tool_call_seconds = metrics.histogram("polis_tool_call_seconds", "Seconds per tool call, waiting for a shared toolset excluded", ["toolset", "tool"])
+tool_call_errors = metrics.counter("polis_tool_call_errors_total", "Tool calls that raised", ["toolset", "tool"])
 
 
 class AgentOrchestrator:
-    def __init__(self, server_url: str, model: str):
+    def __init__(self, server_url: Union[str, BackendPool], model: str, max_workers: int = 1, write_behind: bool = True, durability: str = "normal"):
         self.agents = []
         self.server_url = server_url
         self.model = model
         self.running = True
+        # number of agent passes that may run at the same time, 1 keeps the sequential round-robin loop
+        self.max_workers = max_workers
+        # optional callable(agent), called after every completed pass, e.g. to collect agent.latest_pass_timings
+        self.on_pass_complete = None
+        # (toolset_id, tool name) pairs without side effects, an agent runs consecutive calls to these concurrently
+        self.read_only_tools = set()
+        # passes are saved by a writer thread per agent database, see AgentDatabaseWriter for durability
+        self.write_behind = write_behind
+        self.durability = durability
+        self.database_writers = []
 
         self.tool_schemas = []
 
     def add_agent(self, agent: Agent):
         self.agents.append(agent)
+        if self.write_behind:
+            agent.database_writer = get_agent_database_writer(agent.database_path, durability=self.durability)
+            if agent.database_writer not in self.database_writers:
+                self.database_writers.append(agent.database_writer)
+
+    def flush(self):
+        """Blocks until every saved pass is written to the agent database"""
+        for database_writer in self.database_writers:
+            database_writer.flush()
+
+    def add_read_only_tools(self, toolset_id: str, tool_names: List[str]):
+        for tool_name in tool_names:
+            self.read_only_tools.add((toolset_id, tool_name))
+
+    def run_agent_pass(self, agent_index: int, agent: Agent, tool_callback: Callable, post_system_tool_calls: List[ToolCall]):
+        print("~"*100)
+        print("###AGENT RUN STARTING###")
+        print(f"###{agent_index}###")
+        print(f"Running agent: {agent.name} \n")
+
+        post_system_messages = []
+        print(f"Post system tool calls:")
+        # the pass trace starts here so it covers the post-system tool calls as well
+        agent.start_trace()
+        with agent.trace_span("post_system_tool_calls"):
+            for tool_call_result in agent.run_tool_calls(post_system_tool_calls, tool_callback, self.read_only_tools):
+                post_system_messages.append(Message(role="tool", content=tool_call_result))
+
+        agent.run(self.server_url, self.model, post_system_messages, tool_callback, self.read_only_tools)
+        if self.on_pass_complete is not None:
+            self.on_pass_complete(agent)
+        print("###AGENT RUN COMPLETE###")
+        print(f"###{agent_index}###")
 
     def run(self, tool_callback: Callable, post_system_tool_calls: List[ToolCall]):
-        while self.running:
-            for agent_index, agent in enumerate(self.agents):
-                print("~"*100)
-                print("###AGENT RUN STARTING###")
-                print(f"###{agent_index}###")
-                print(f"Running agent: {agent.name} \n")
-
-                post_system_messages = []
-                print(f"Post system tool calls:")
-                for tool_call in post_system_tool_calls:
-                    tool_call_result = tool_callback(agent, tool_call)
-                    post_system_messages.append(Message(role="tool", content=tool_call_result))
+        try:
+            if self.max_workers > 1:
+                self.run_concurrent(tool_callback, post_system_tool_calls)
+            else:
+                self.run_sequential(tool_callback, post_system_tool_calls)
+        finally:
+            self.wait_for_agents()
+            self.flush()
 
-                agent.run(self.server_url, self.model, post_system_messages, tool_callback)
-                print("###AGENT RUN COMPLETE###")
-                print(f"###{agent_index}###")
+    def wait_for_agents(self):
+        # passes whose summary runs in the background are only saved once it completes
+        for agent in self.agents:
+            agent.wait_for_pending_summary()
 
+    def run_sequential(self, tool_callback: Callable, post_system_tool_calls: List[ToolCall]):
+        while self.running:
+            for agent_index, agent in enumerate(self.agents):
+                self.run_agent_pass(agent_index, agent, tool_callback, post_system_tool_calls)
             
             # if all agents are complete, stop
             if all(not agent.running for agent in self.agents):
                 self.running = False
                 break
+
+    def run_concurrent(self, tool_callback: Callable, post_system_tool_calls: List[ToolCall]):
+        """
+        Runs agent passes on a pool of max_workers threads. Every agent has at most one pass in flight,
+        so its passes still run in order, while independent agents overlap their LLM calls.
+        tool_callback is called from several worker threads at once and must be thread safe.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="agent") as executor:
+            pending = {}
+            for agent_index, agent in enumerate(self.agents):
+                if agent.running:
+                    future = executor.submit(self.run_agent_pass, agent_index, agent, tool_callback, post_system_tool_calls)
+                    pending[future] = (agent_index, agent)
+
+            while len(pending) > 0:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    agent_index, agent = pending.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        # stop scheduling, let in-flight passes finish, then surface the error like the sequential loop
+                        self.running = False
+                        wait(pending)
+                        raise
+                    # queue the agent's next pass as soon as its previous one is complete
+                    if self.running and agent.running:
+                        future = executor.submit(self.run_agent_pass, agent_index, agent, tool_callback, post_system_tool_calls)
+                        pending[future] = (agent_index, agent)
+
+        self.running = False
+
     def stop(self):
         self.running = False
+        # passes still in flight are flushed when run returns
+        self.flush()
 
     def start(self):
         self.running = True
@@ -82,38 +165,20 @@ class AgentOrchestrator:
             "stopped": self.get_stopped_agent_count()
         }
 
-def main():
+def build_world(server_url: Union[str, BackendPool] = "http://localhost:5000", model: str = DEFAULT_CHAT_MODEL, agent_count: int = 2, max_workers: int = 2, summary_mode: str = "inline", write_behind: bool = True, buffer_eviction: int = 1):
+    """
+    Creates the toolsets, agents and orchestrator in the current working directory.
+    Returns the orchestrator, the tool callback and the post system tool calls to pass to orchestrator.run
+    server_url is a url or a BackendPool of several Ollama servers
+    """
     from tools.forum import Directory
     from tools.code_isolation import SafeCodeExecutor
     from tools.quest_manager import QuestManager
     from tools.wikisearch import WikiSearch
-    from libs.common import MultiWriter
     from tools.file_manager import FileManager
     from tools.persona import PersonaManager
     from tools.notes import NotesManager
     from tools.user_directory import UserDirectory
-    # delete out files if they exist
-    if os.path.exists("std_out.txt"):
-        os.remove("std_out.txt")
-    if os.path.exists("std_err.txt"):
-        os.remove("std_err.txt")
-
-    # Open the files
-    std_out_file = open("std_out.txt", "w", encoding="utf-8")
-    std_err_file = open("std_err.txt", "w", encoding="utf-8")
-
-    # Create writers that write to both console and file
-    stdout_writer = MultiWriter(sys.stdout, std_out_file)
-    stderr_writer = MultiWriter(sys.stderr, std_err_file)
-
-    # Save original stdout/stderr for restoration if needed
-    original_stdout = sys.stdout
-    original_stderr = sys.stderr
-
-    # Redirect stdout and stderr
-    sys.stdout = stdout_writer
-    sys.stderr = stderr_writer
-
 
     forum_directory = Directory("forum.db")
     code_environments = {}
@@ -121,34 +186,49 @@ def main():
     persona_managers = {}
     app_managers = {}
     notes_managers = {}
-    orchestrator = AgentOrchestrator(server_url="http://localhost:5000", model="Qwen2.5-14B-Instruct-1M-GGUF")
+    orchestrator = AgentOrchestrator(server_url=server_url, model=model, max_workers=max_workers, write_behind=write_behind)
     wiki_search = WikiSearch()
     user_directory = UserDirectory()
+    # enough keep-alive connections for every worker to have an LLM call and a tool-side call in flight
+    ollama_client_pool.configure(pool_size=orchestrator.max_workers * 2)
+    if isinstance(server_url, BackendPool):
+        server_url.start_health_checks()
+
+    # agent passes can run on several threads, per-agent toolsets are only used by their own agent,
+    # the forum keeps a connection per thread and the messages toolset opens one per call, but the shared code runner
+    # swaps sys.stdout while executing and the file manager keeps shared metadata, so those are serialized
+    shared_toolset_locks = {
+        "code_runner": threading.Lock(),
+        "file_manager": threading.Lock()
+    }
+
     def tool_callback(agent: Agent, tool_call: ToolCall):
         tool_results = None
         print(f"  - {tool_call.toolset_id} - Tool call: {tool_call}")
         try:
-            if tool_call.toolset_id == "forum_toolset":
-                tool_results = forum_directory.agent_tool_callback(agent, tool_call)
-            elif tool_call.toolset_id == "code_runner":
-                tool_results = shared_code_runner.agent_tool_callback(agent, tool_call)
-            elif tool_call.toolset_id == "wiki_toolset":
-                tool_results = wiki_search.agent_tool_callback(agent, tool_call)
-            elif tool_call.toolset_id == "quest_manager":
-                tool_results = quest_managers[agent.id].agent_tool_callback(agent, tool_call)
-            elif tool_call.toolset_id == "app_manager":
-                tool_results = app_managers[agent.id].agent_tool_callback(agent, tool_call)
-            elif tool_call.toolset_id == "file_manager":
-                tool_results = file_manager.agent_tool_callback(agent, tool_call)
-            elif tool_call.toolset_id == "persona":
-                tool_results = persona_managers[agent.id].agent_tool_callback(agent, tool_call)
-            elif tool_call.toolset_id == "notes_manager":
-                tool_results = notes_managers[agent.id].agent_tool_callback(agent, tool_call)
-            elif tool_call.toolset_id == "messages":
-                tool_results = user_directory.agent_tool_callback(agent, tool_call)
-            else:
-                print(f"APP NOT FOUND - toolset_id: {tool_call.toolset_id} not found")
+            with shared_toolset_locks.get(tool_call.toolset_id, nullcontext()), tool_call_seconds.labels(tool_call.toolset_id, tool_call.name).time():
+                if tool_call.toolset_id == "forum_toolset":
+                    tool_results = forum_directory.agent_tool_callback(agent, tool_call)
+                elif tool_call.toolset_id == "code_runner":
+                    tool_results = shared_code_runner.agent_tool_callback(agent, tool_call)
+                elif tool_call.toolset_id == "wiki_toolset":
+                    tool_results = wiki_search.agent_tool_callback(agent, tool_call)
+                elif tool_call.toolset_id == "quest_manager":
+                    tool_results = quest_managers[agent.id].agent_tool_callback(agent, tool_call)
+                elif tool_call.toolset_id == "app_manager":
+                    tool_results = app_managers[agent.id].agent_tool_callback(agent, tool_call)
+                elif tool_call.toolset_id == "file_manager":
+                    tool_results = file_manager.agent_tool_callback(agent, tool_call)
+                elif tool_call.toolset_id == "persona":
+                    tool_results = persona_managers[agent.id].agent_tool_callback(agent, tool_call)
+                elif tool_call.toolset_id == "notes_manager":
+                    tool_results = notes_managers[agent.id].agent_tool_callback(agent, tool_call)
+                elif tool_call.toolset_id == "messages":
+                    tool_results = user_directory.agent_tool_callback(agent, tool_call)
+                else:
+                    print(f"APP NOT FOUND - toolset_id: {tool_call.toolset_id} not found")
         except Exception as e:
+            tool_call_errors.labels(tool_call.toolset_id, tool_call.name).inc()
             print("########################ERROR CALLING TOOL########################")
             print(f"Error calling tool {tool_call.name}: {e}")
             print(f"Tool call: {tool_call}")
@@ -202,7 +282,7 @@ def main():
     file_manager = FileManager(shared_file_directory)
 
    
-    for i in range(2): 
+    for i in range(agent_count): 
         
         standing_tool_calls = [
             ToolCall(
@@ -233,7 +313,9 @@ def main():
                         private_key=f"{i}asdasdasdasd", 
                         initial_instructions="This is the beginning of your journey. You can use any tools available to you.", 
                         initial_notes=[],
-                        standing_tool_calls=standing_tool_calls)
+                        standing_tool_calls=standing_tool_calls,
+                        summary_mode=summary_mode,
+                        buffer_eviction=buffer_eviction)
         
         app_manager = AppManager()
 
@@ -263,6 +345,12 @@ def main():
         app_managers[agent.id] = app_manager
         orchestrator.add_agent(agent)
 
+        for toolset in [app_manager, persona_manager, notes_manager, quest_manager, shared_code_runner, wiki_search, forum_directory, file_manager, user_directory]:
+            orchestrator.add_read_only_tools(toolset.get_toolset_details().toolset_id, toolset.get_read_only_tools())
+
+    # every agent's forum user in one transaction, rather than a check on each of their forum calls
+    forum_directory.provision_users([(agent.id, agent.name) for agent in orchestrator.agents])
+
     post_system_tool_calls = [
         ToolCall(
             toolset_id="app_manager",
@@ -281,7 +369,59 @@ def main():
         )
     ]
 
-    orchestrator.run(tool_callback=tool_callback, post_system_tool_calls=post_system_tool_calls)
+    return orchestrator, tool_callback, post_system_tool_calls
+
+def main():
+    from libs.common import MultiWriter, install_thread_output_capture
+    # delete out files if they exist
+    if os.path.exists("std_out.txt"):
+        os.remove("std_out.txt")
+    if os.path.exists("std_err.txt"):
+        os.remove("std_err.txt")
+
+    # Open the files
+    std_out_file = open("std_out.txt", "w", encoding="utf-8")
+    std_err_file = open("std_err.txt", "w", encoding="utf-8")
+
+    # Create writers that write to both console and file
+    stdout_writer = MultiWriter(sys.stdout, std_out_file)
+    stderr_writer = MultiWriter(sys.stderr, std_err_file)
+
+    # Save original stdout/stderr for restoration if needed
+    original_stdout = sys.stdout
+    original_stderr = sys.stderr
+
+    # Redirect stdout and stderr
+    sys.stdout = stdout_writer
+    sys.stderr = stderr_writer
+    # code_runner captures the output of its own thread only, agent threads printing meanwhile still reach std_out.txt
+    install_thread_output_capture()
+
+    # cheap call sites can be routed to a smaller model with libs.common.model_router, e.g.
+    # model_router.set_route("summary", "llama3.1:8b")
+    # model_router.set_route("quest_generation", "llama3.1:8b", "http://localhost:5001")
+    # several Ollama servers, each agent stays on one while it is healthy:
+    # server_url = BackendPool(["http://localhost:5000", "http://localhost:5001"], max_concurrency=4)
+    server_url = "http://localhost:5000"
+    orchestrator, tool_callback, post_system_tool_calls = build_world(server_url=server_url)
+    # Prometheus metrics of the passes, LLM calls and tools on http://localhost:9108/metrics, 0 turns it off.
+    # POLIS_METRICS_HOST=0.0.0.0 lets a scraper on another machine reach it
+    metrics_port = int(os.environ.get("POLIS_METRICS_PORT", 9108))
+    metrics_host = os.environ.get("POLIS_METRICS_HOST", "127.0.0.1")
+    if metrics_port != 0:
+        try:
+            start_metrics_server(metrics_port, host=metrics_host)
+            print(f"Metrics on http://{metrics_host}:{metrics_port}/metrics")
+        except OSError as e:
+            # e.g. another orchestrator holds the port, the agents run without metrics
+            print(f"Warning: metrics server not started on {metrics_host}:{metrics_port}: {e}")
+
+    try:
+        orchestrator.run(tool_callback=tool_callback, post_system_tool_calls=post_system_tool_calls)
+    finally:
+        if isinstance(server_url, BackendPool):
+            server_url.close()
+        ollama_client_pool.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,67 @@
+"""
+Per-call latency of a new ollama.Client per request versus the pooled keep-alive clients, against the local stub.
+
+    python -m benchmarks.client_pool --calls 500
+"""
+from ollama import Client
+import argparse
+import httpx
+import statistics
+import time
+
+from libs.common import call_ollama_chat, embed_with_ollama, ollama_client_pool, Message
+from benchmarks.ollama_stub import OllamaStubServer
+
+
+def time_calls(label, calls, fn):
+    durations = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    mean = statistics.mean(durations) * 1000
+    p50 = durations[len(durations) // 2] * 1000
+    p95 = durations[int(len(durations) * 0.95) - 1] * 1000
+    print(f"{label:<28} mean {mean:7.3f} ms   p50 {p50:7.3f} ms   p95 {p95:7.3f} ms")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ollama client pool micro-benchmark")
+    parser.add_argument("--calls", type=int, default=500)
+    args = parser.parse_args()
+
+    # the unpooled calls send no num_ctx, reloads would be charged to whichever case switches first
+    server = OllamaStubServer(reload_seconds=0.0)
+    url = server.start()
+    messages = [Message(role="user", content="ping")]
+
+    def new_client_chat():
+        # what call_ollama_chat used to do on every call, closed here so the run does not leak sockets
+        with httpx.HTTPTransport() as transport:
+            client = Client(host=url, transport=transport)
+            client.chat(model="stub", stream=False, messages=[m.chat_ml() for m in messages])
+
+    def new_client_embed():
+        with httpx.HTTPTransport() as transport:
+            client = Client(host=url, transport=transport)
+            client.embed(model="stub", input="ping")
+
+    # warm up both paths
+    new_client_chat()
+    call_ollama_chat(url, "stub", messages)
+
+    print(f"{args.calls} calls per case against {url}")
+    chat_before = time_calls("chat, new client per call", args.calls, new_client_chat)
+    chat_after = time_calls("chat, pooled client", args.calls, lambda: call_ollama_chat(url, "stub", messages))
+    embed_before = time_calls("embed, new client per call", args.calls, new_client_embed)
+    embed_after = time_calls("embed, pooled client", args.calls, lambda: embed_with_ollama(url, "ping", "stub"))
+
+    print(f"chat saved {chat_before - chat_after:.3f} ms per call, embed saved {embed_before - embed_after:.3f} ms per call")
+
+    ollama_client_pool.close()
+    server.stop()
+
+if __name__ == "__main__":
+    main()
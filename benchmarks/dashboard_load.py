@@ -0,0 +1,169 @@
+"""
+Dashboard API load test: requests/sec and latency of the server.py endpoints while an orchestrator writes to the
+same databases.
+
+Runs a throughput world against the stub in a temporary directory, starts `server.py --serve` on it in another
+process, then has N clients request the pages' endpoints as fast as they can for a fixed duration.
+
+    python -m benchmarks.dashboard_load --clients 32 --duration 15
+"""
+import argparse
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from agent_orchestrator import build_world
+from libs.common import ollama_client_pool
+from benchmarks.ollama_stub import OllamaStubServer
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(base_url, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py exited with {process.returncode}")
+        try:
+            if httpx.get(base_url + "/api/list_agents").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server.py did not start")
+
+
+def client_loop(base_url, stop_event, latencies, errors, lock):
+    """Requests what an open dashboard does: the agent list, run result pages, quests, users and messages"""
+    with httpx.Client(base_url=base_url, timeout=30.0) as client:
+        agent_ids = [agent["agent_id"] for agent in client.get("/api/list_agents").json()]
+        index = 0
+        while not stop_event.is_set():
+            agent_id = agent_ids[index % len(agent_ids)] if agent_ids else "none"
+            index += 1
+            requests = [
+                ("list_agents", "/api/list_agents", {}),
+                ("run_results", "/api/get_agent_run_results", {"agent_id": agent_id, "limit": 10}),
+                ("run_results_fields", "/api/get_agent_run_results", {"agent_id": agent_id, "limit": 10, "fields": "model,agent_output,summary_output"}),
+                ("agent_quests", "/api/get_agent_quests", {"agent_id": agent_id}),
+                ("users", "/api/get_users", {}),
+                ("messages", "/api/get_messages", {"limit": 10}),
+            ]
+            for name, path, params in requests:
+                start = time.perf_counter()
+                try:
+                    response = client.get(path, params=params)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                seconds = time.perf_counter() - start
+                with lock:
+                    latencies.setdefault(name, []).append(seconds)
+                    if not ok:
+                        errors[name] = errors.get(name, 0) + 1
+                if name == "run_results" and ok and "X-Next-Cursor" in response.headers:
+                    # the next page, as scrolling the terminal does
+                    params = dict(params, cursor=response.headers["X-Next-Cursor"])
+                    start = time.perf_counter()
+                    response = client.get(path, params=params)
+                    with lock:
+                        latencies.setdefault("run_results_next", []).append(time.perf_counter() - start)
+                        if response.status_code != 200:
+                            errors["run_results_next"] = errors.get("run_results_next", 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="dashboard API load test")
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=4, help="orchestrator max_workers")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent dashboard clients")
+    parser.add_argument("--threads", type=int, default=16, help="server worker threads")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds the world runs before the load starts")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of load")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency per chat request in seconds")
+    args = parser.parse_args()
+
+    stub = OllamaStubServer(latency=args.latency)
+    stub_url = stub.start()
+    working_directory = os.getcwd()
+    report = sys.stdout
+
+    with tempfile.TemporaryDirectory(prefix="polis_bench_") as world_directory:
+        os.chdir(world_directory)
+        server_process = None
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                orchestrator, tool_callback, post_system_tool_calls = build_world(server_url=stub_url, agent_count=args.agents, max_workers=args.workers)
+                world_thread = threading.Thread(target=orchestrator.run, kwargs={"tool_callback": tool_callback, "post_system_tool_calls": post_system_tool_calls})
+                world_thread.start()
+
+                port = free_port()
+                base_url = f"http://127.0.0.1:{port}"
+                environment = dict(os.environ, POLIS_DATA_DIR=world_directory, POLIS_READ_POOL_SIZE=str(args.threads))
+                server_process = subprocess.Popen(
+                    [sys.executable, SERVER_PATH, "--serve", "--port", str(port), "--threads", str(args.threads)],
+                    cwd=os.path.dirname(SERVER_PATH), env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+                wait_for_server(base_url, server_process)
+                time.sleep(args.warmup)
+
+                passes_before = httpx.get(base_url + "/api/list_agents").json()
+                print(f"{args.clients} clients, {args.threads} server threads, {args.agents} agents writing, running for {args.duration}s", file=report)
+                latencies = {}
+                errors = {}
+                lock = threading.Lock()
+                stop_event = threading.Event()
+                clients = [threading.Thread(target=client_loop, args=(base_url, stop_event, latencies, errors, lock)) for _ in range(args.clients)]
+                start = time.perf_counter()
+                for client in clients:
+                    client.start()
+                time.sleep(args.duration)
+                stop_event.set()
+                for client in clients:
+                    client.join()
+                elapsed = time.perf_counter() - start
+
+                passes_after = httpx.get(base_url + "/api/list_agents").json()
+                server_stats = httpx.get(base_url + "/api/server_stats").json()
+                orchestrator.stop()
+                world_thread.join()
+        finally:
+            if server_process is not None:
+                server_process.terminate()
+                server_process.wait()
+            os.chdir(working_directory)
+            ollama_client_pool.close()
+            stub.stop()
+
+    total = sum(len(values) for values in latencies.values())
+    passes_written = sum(agent["pass_number"] for agent in passes_after) - sum(agent["pass_number"] for agent in passes_before)
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.0f} requests/sec, {sum(errors.values())} errors, {passes_written} passes saved meanwhile")
+    print(f"{'endpoint':<22}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, values in latencies.items():
+        values = [value * 1000 for value in values]
+        print(f"{name:<22}{len(values):>10}{percentile(values, 0.5):>10.1f}{percentile(values, 0.95):>10.1f}{percentile(values, 0.99):>10.1f}{errors.get(name, 0):>8}")
+    cache = server_stats["response_cache"]
+    print(f"response cache: {cache['hits']} hits, {cache['misses']} misses")
+    for pool in server_stats["read_pools"]:
+        print(f"read pool {os.path.basename(pool['database'])}: {pool['opened']} connections, waited {pool['waits']} times")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Forum operations per second from several agent threads at once, with the Directory's per-thread WAL connections
+and with a connection opened for every method call on a rollback journal, as the Directory used to.
+The mix is mostly feed and forum reads with some posts, replies and joins, like the forum tool calls of a pass.
+
+    python -m benchmarks.forum_ops --threads 8 --duration 10
+"""
+import argparse
+import contextlib
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from tools.forum import Directory
+
+# operation -> weight
+MIX = {
+    "get_current_posts": 30,
+    "get_posts_by_forum": 20,
+    "get_user_by_id": 15,
+    "get_forum_by_id": 10,
+    "create_post": 15,
+    "reply_to_post": 5,
+    "join_forum": 5,
+}
+
+
+class ConnectPerCallDirectory(Directory):
+    """Every method opens its own connection with sqlite3's implicit transactions, nested calls open another"""
+    @contextlib.contextmanager
+    def _read(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    _transaction = _read
+
+
+def populate(directory, users, forums, posts, rng):
+    user_ids = [f"user-{index}" for index in range(users)]
+    for user_id in user_ids:
+        directory.create_user(user_id, user_id, "")
+    forum_ids = [directory.create_forum(rng.choice(user_ids), f"forum {index}", "", []).forum_id for index in range(forums)]
+    for user_id in user_ids:
+        for forum_id in rng.sample(forum_ids, 3):
+            directory.join_forum(user_id, forum_id)
+    post_ids = []
+    with directory._transaction():
+        for index in range(posts):
+            post_ids.append(directory.create_post(rng.choice(forum_ids), rng.choice(user_ids), f"post {index} " + "words " * 40, f"title {index}").post_id)
+    return user_ids, forum_ids, post_ids
+
+
+def run_mix(directory, user_ids, forum_ids, post_ids, threads, duration, seed):
+    operations = list(MIX)
+    weights = list(MIX.values())
+    counts = [0] * threads
+    errors = [0] * threads
+    stop = threading.Event()
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        user_id = user_ids[index % len(user_ids)]
+        while not stop.is_set():
+            operation = rng.choices(operations, weights)[0]
+            try:
+                if operation == "get_current_posts":
+                    directory.get_current_posts(user_id, 10, 0)
+                elif operation == "get_posts_by_forum":
+                    directory.get_posts_by_forum(rng.choice(forum_ids), 10, 0)
+                elif operation == "get_user_by_id":
+                    directory.get_user_by_id(rng.choice(user_ids))
+                elif operation == "get_forum_by_id":
+                    directory.get_forum_by_id(rng.choice(forum_ids), include_posts=False)
+                elif operation == "create_post":
+                    directory.create_post(rng.choice(forum_ids), user_id, "benchmark post " + "words " * 40, "benchmark")
+                elif operation == "reply_to_post":
+                    directory.reply_to_post(user_id, rng.choice(post_ids), "benchmark reply")
+                elif operation == "join_forum":
+                    directory.join_forum(user_id, rng.choice(forum_ids))
+                counts[index] += 1
+            except sqlite3.OperationalError:
+                # "database is locked" once the busy timeout runs out
+                errors[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start), sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="forum Directory throughput")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per mode")
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--forums", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=5000, help="posts created before the run")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'connections':<26}{'ops/s':>10}{'errors':>8}")
+    with tempfile.TemporaryDirectory(prefix="polis_bench_") as directory_path:
+        for label, directory_class in [("per call, rollback journal", ConnectPerCallDirectory), ("per thread, WAL", Directory)]:
+            db_path = os.path.join(directory_path, f"{directory_class.__name__}.db")
+            directory = directory_class(db_path)
+            if directory_class is ConnectPerCallDirectory:
+                # _init_db switched the file to WAL on this thread's connection, undo it
+                directory.close()
+                with contextlib.closing(sqlite3.connect(db_path)) as conn:
+                    conn.execute("PRAGMA journal_mode=DELETE")
+            rng = random.Random(args.seed)
+            user_ids, forum_ids, post_ids = populate(directory, args.users, args.forums, args.posts, rng)
+            ops_per_second, errors = run_mix(directory, user_ids, forum_ids, post_ids, args.threads, args.duration, args.seed)
+            directory.close()
+            print(f"{label:<26}{ops_per_second:>10.0f}{errors:>8}")
+
+if __name__ == "__main__":
+    main()
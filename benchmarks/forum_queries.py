@@ -0,0 +1,162 @@
+"""
+Latency of the forum feed and lookup queries on a large forum.db, before and after its migrations. The posts are
+inserted directly into a file at schema version 0, where the queries the Directory ran at that version are timed,
+then a Directory upgrades the file in place as it would at startup and its methods are timed. Users subscribe to
+hundreds of forums, stored as the JSON arrays of version 0 until the migrations move them to their own table.
+Post text is drawn from a Zipf-distributed vocabulary with a rare planted word, searched with LIKE at version 0.
+
+    python -m benchmarks.forum_queries --posts 1000000
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from tools.forum import Directory
+from benchmarks.run_history_search import make_vocabulary
+
+# planted in this fraction of posts
+RARE_WORD = "zanzibar"
+RARE_WORD_RATE = 0.00001
+
+
+class UnmigratedDirectory(Directory):
+    """Opens the file at the schema version it has"""
+    def _migrate(self):
+        pass
+
+
+def populate(directory, users, forums, posts, subscriptions, vocabulary, rng, batch_size=50000):
+    cumulative_weights = list(itertools.accumulate(1.0 / rank for rank in range(1, len(vocabulary) + 1)))
+    def text(word_count):
+        words = rng.choices(vocabulary, cum_weights=cumulative_weights, k=word_count)
+        if rng.random() < RARE_WORD_RATE:
+            words[rng.randrange(word_count)] = RARE_WORD
+        return " ".join(words)
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    forum_ids = [str(uuid.uuid4()) for _ in range(forums)]
+    start = datetime(2025, 1, 1)
+    with directory._transaction() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, name, persona, created_at, subscribed_forums, current_forums) VALUES (?, ?, ?, ?, ?, ?)",
+            [(user_id, f"user {index}", "", start.isoformat(), json.dumps(rng.sample(forum_ids, subscriptions)), json.dumps(rng.sample(forum_ids, 5))) for index, user_id in enumerate(user_ids)]
+        )
+        conn.executemany(
+            "INSERT INTO forums (forum_id, creator_id, title, description, flags) VALUES (?, ?, ?, ?, ?)",
+            [(forum_id, rng.choice(user_ids), f"forum {index}", "", "[]") for index, forum_id in enumerate(forum_ids)]
+        )
+    empty = json.dumps([])
+    for batch_start in range(0, posts, batch_size):
+        rows = []
+        for index in range(batch_start, min(posts, batch_start + batch_size)):
+            created_at = (start + timedelta(seconds=index)).isoformat()
+            rows.append((str(uuid.uuid4()), rng.choice(forum_ids), rng.choice(user_ids), text(30), created_at, text(4), None, empty, empty))
+        with directory._transaction() as conn:
+            conn.executemany("INSERT INTO posts (post_id, forum_id, author_id, content, created_at, title, parent_id, files, flags) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        print(f"\r{batch_start + len(rows)} posts", end="", flush=True)
+    print()
+    return user_ids, forum_ids
+
+
+def version_0_queries(conn, user_ids, forum_ids, vocabulary, rng):
+    """The SQL of the Directory methods at schema version 0, which the current methods cannot run against"""
+    def query(sql, *args):
+        return lambda: conn.execute(sql, [arg() if callable(arg) else arg for arg in args]).fetchall()
+    def user_id():
+        return rng.choice(user_ids)
+    def forum_id():
+        return rng.choice(forum_ids)
+    # get_subscribed_posts failed at version 0, this is the json_each form get_current_posts used
+    feed = "SELECT * FROM posts WHERE forum_id IN (SELECT json_each.value FROM users, json_each(users.{}) WHERE users.user_id = ?) ORDER BY created_at DESC LIMIT ? OFFSET ?"
+    return [
+        ("get_posts_by_forum", query("SELECT * FROM posts WHERE forum_id = ? ORDER BY created_at LIMIT ? OFFSET ?", forum_id, 10, 0)),
+        ("get_posts_by_forum offset 500", query("SELECT * FROM posts WHERE forum_id = ? ORDER BY created_at LIMIT ? OFFSET ?", forum_id, 10, 500)),
+        ("get_posts_by_author", query("SELECT * FROM posts WHERE author_id = ? ORDER BY created_at LIMIT ? OFFSET ?", user_id, 10, 0)),
+        ("get_current_posts", query(feed.format("current_forums"), user_id, 10, 0)),
+        ("get_subscribed_posts", query(feed.format("subscribed_forums"), user_id, 10, 0)),
+        ("get_subscribed_posts offset 100", query(feed.format("subscribed_forums"), user_id, 10, 100)),
+        ("get_user_by_name", query("SELECT * FROM users WHERE name = ?", lambda: f"user {rng.randrange(len(user_ids))}")),
+        ("get_forum_by_title", query("SELECT * FROM forums WHERE title = ?", lambda: f"forum {rng.randrange(len(forum_ids))}")),
+        ("search_forums", query("SELECT * FROM forums WHERE title LIKE ?", lambda: f"%forum {rng.randrange(len(forum_ids))}%")),
+        ("search_users", query("SELECT * FROM users WHERE name LIKE ? LIMIT ?", lambda: f"%user {rng.randrange(len(user_ids))}%", 20)),
+        # posts were not searchable, a LIKE scan is the nearest equivalent
+        ("search_posts rare word", query("SELECT * FROM posts WHERE content LIKE ? LIMIT ?", f"%{RARE_WORD}%", 10)),
+        ("search_posts common word", query("SELECT * FROM posts WHERE content LIKE ? LIMIT ?", f"%{vocabulary[0]}%", 10)),
+        ("search_posts two words", query("SELECT * FROM posts WHERE content LIKE ? AND content LIKE ? LIMIT ?", f"%{vocabulary[1]}%", f"%{vocabulary[50]}%", 10)),
+        ("search_posts prefix", query("SELECT * FROM posts WHERE content LIKE ? LIMIT ?", f"%{vocabulary[5][:3]}%", 10)),
+        ("search_posts common word, forum", query("SELECT * FROM posts WHERE forum_id = ? AND content LIKE ? LIMIT ?", forum_id, f"%{vocabulary[0]}%", 10)),
+    ]
+
+
+def directory_queries(directory, user_ids, forum_ids, vocabulary, rng):
+    return [
+        ("get_posts_by_forum", lambda: directory.get_posts_by_forum(rng.choice(forum_ids), 10, 0)),
+        ("get_posts_by_forum offset 500", lambda: directory.get_posts_by_forum(rng.choice(forum_ids), 10, 500)),
+        ("get_posts_by_author", lambda: directory.get_posts_by_author(rng.choice(user_ids), 10, 0)),
+        ("get_current_posts", lambda: directory.get_current_posts(rng.choice(user_ids), 10, 0)),
+        ("get_subscribed_posts", lambda: directory.get_subscribed_posts(rng.choice(user_ids), 10, 0)),
+        ("get_subscribed_posts offset 100", lambda: directory.get_subscribed_posts(rng.choice(user_ids), 10, 100)),
+        ("get_user_by_name", lambda: directory.get_user_by_name(f"user {rng.randrange(len(user_ids))}")),
+        ("get_forum_by_title", lambda: directory.get_forum_by_title(f"forum {rng.randrange(len(forum_ids))}")),
+        ("search_forums", lambda: directory.search_forums(f"forum {rng.randrange(len(forum_ids))}")),
+        ("search_users", lambda: directory.search_users(f"user {rng.randrange(len(user_ids))}")),
+        ("search_posts rare word", lambda: directory.search_posts(RARE_WORD)),
+        ("search_posts common word", lambda: directory.search_posts(vocabulary[0])),
+        ("search_posts two words", lambda: directory.search_posts(f"{vocabulary[1]} {vocabulary[50]}")),
+        ("search_posts prefix", lambda: directory.search_posts(vocabulary[5][:3] + "*")),
+        ("search_posts common word, forum", lambda: directory.search_posts(vocabulary[0], rng.choice(forum_ids))),
+    ]
+
+
+def time_queries(queries, repeats):
+    """label -> median milliseconds"""
+    results = {}
+    for label, query in queries:
+        durations = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            query()
+            durations.append(time.perf_counter() - start)
+        results[label] = statistics.median(durations) * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="forum.db query latency before and after migrations")
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--forums", type=int, default=500)
+    parser.add_argument("--subscriptions", type=int, default=300, help="forums each user subscribes to")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=5, help="runs per query before migrating, full scans are slow")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="polis_bench_") as directory_path:
+        db_path = os.path.join(directory_path, "forum.db")
+        vocabulary = make_vocabulary(args.vocabulary, random.Random(args.seed))
+        unmigrated = UnmigratedDirectory(db_path)
+        user_ids, forum_ids = populate(unmigrated, args.users, args.forums, args.posts, args.subscriptions, vocabulary, random.Random(args.seed))
+        before = time_queries(version_0_queries(unmigrated.get_connection(), user_ids, forum_ids, vocabulary, random.Random(args.seed)), args.repeats)
+        unmigrated.close()
+
+        start = time.perf_counter()
+        directory = Directory(db_path)
+        migrate_seconds = time.perf_counter() - start
+        after = time_queries(directory_queries(directory, user_ids, forum_ids, vocabulary, random.Random(args.seed)), args.repeats * 20)
+        version = directory.get_connection().execute("PRAGMA user_version").fetchone()[0]
+        directory.close()
+
+        print(f"{args.posts} posts, migrated to version {version} in place in {migrate_seconds:.1f} s, {os.path.getsize(db_path) / 1024 / 1024:.0f} MB")
+        print(f"{'query':<32}{'version 0 ms':>14}{f'version {version} ms':>14}")
+        for label in before:
+            print(f"{label:<32}{before[label]:>14.2f}{after[label]:>14.2f}")
+
+if __name__ == "__main__":
+    main()
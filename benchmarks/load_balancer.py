@@ -0,0 +1,111 @@
+"""
+BackendPool against several local stub servers: one endpoint vs N, sticky vs least-outstanding only,
+and N with one backend failing for the middle third of the run.
+
+Each client is an agent-like loop whose prompt grows by one message per call, so with --prompt-rate
+the stub charges for prompt tokens outside its cache and sticky routing shows up as fewer evaluated
+prompt tokens per request and lower latency.
+
+    python -m benchmarks.load_balancer --backends 3 --clients 12 --duration 10 --latency 0.1 --parallel 2
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import threading
+import time
+
+from libs.backend_pool import BackendPool
+from libs.common import call_ollama_chat, ollama_client_pool, Message
+from benchmarks.ollama_stub import OllamaStubServer
+
+SYSTEM_PROMPT = "You are a benchmark client. " * 200
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_scenario(label, servers, args, sticky, fail_backend=False):
+    pool = BackendPool([server.url for server in servers], max_concurrency=args.max_concurrency, failure_threshold=2, recovery_timeout=1.0, health_check_interval=0.5)
+    pool.start_health_checks()
+    for server in servers:
+        server.cached_prompts = []
+    stop_event = threading.Event()
+    results = []
+    results_lock = threading.Lock()
+
+    def client(client_index):
+        messages = [Message(role="system", content=SYSTEM_PROMPT)]
+        sticky_key = f"client-{client_index}" if sticky else None
+        while not stop_event.is_set():
+            messages.append(Message(role="user", content=f"client {client_index} message {len(messages)} " * 20))
+            if len(messages) > 20:
+                messages = messages[:1] + messages[-10:]
+            usage = {}
+            start = time.perf_counter()
+            response = call_ollama_chat(pool, "stub", messages, usage=usage, sticky_key=sticky_key)
+            seconds = time.perf_counter() - start
+            with results_lock:
+                results.append((seconds, isinstance(response, Exception), usage))
+
+    def fail_middle_third():
+        if stop_event.wait(args.duration / 3):
+            return
+        servers[0].failing = True
+        stop_event.wait(args.duration / 3)
+        servers[0].failing = False
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(args.clients)]
+    if fail_backend:
+        threads.append(threading.Thread(target=fail_middle_third))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    pool.close()
+
+    latencies = [seconds * 1000 for seconds, failed, usage in results if not failed]
+    failures = sum(1 for seconds, failed, usage in results if failed)
+    prompt_eval_counts = [usage["prompt_eval_count"] for seconds, failed, usage in results if not failed]
+    print(f"{label:<34}{len(latencies) / elapsed:>9.1f}{statistics.mean(latencies):>10.1f}{percentile(latencies, 0.95):>10.1f}{failures:>10}{statistics.mean(prompt_eval_counts):>13.0f}")
+    for backend in pool.get_stats():
+        print(f"    {backend['url']:<30}{backend['requests']:>8} requests{backend['failures']:>6} failed{backend['sticky_keys']:>4} sticky keys  circuit {backend['circuit']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM backend pool benchmark")
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=12, help="concurrent agent-like clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--latency", type=float, default=0.1, help="stub latency per chat request in seconds")
+    parser.add_argument("--prompt-rate", type=float, default=20000, help="stub prompt tokens evaluated per second")
+    parser.add_argument("--parallel", type=int, default=2, help="chat requests each stub processes at once")
+    parser.add_argument("--cache-slots", type=int, default=4, help="prompts each stub keeps in its prefix cache")
+    parser.add_argument("--max-concurrency", type=int, default=2, help="BackendPool requests in flight per backend")
+    args = parser.parse_args()
+
+    servers = [OllamaStubServer(latency=args.latency, prompt_rate=args.prompt_rate, parallel=args.parallel, cache_slots=args.cache_slots) for _ in range(args.backends)]
+    for server in servers:
+        server.start()
+
+    print(f"{args.clients} clients, {args.duration}s per scenario, {args.latency}s stub latency, {args.parallel} parallel requests per stub")
+    print(f"{'scenario':<34}{'req/s':>9}{'mean ms':>10}{'p95 ms':>10}{'failed':>10}{'prompt eval':>13}")
+    try:
+        run_scenario("1 backend", servers[:1], args, sticky=True)
+        run_scenario(f"{args.backends} backends, least outstanding", servers, args, sticky=False)
+        run_scenario(f"{args.backends} backends, sticky", servers, args, sticky=True)
+        run_scenario(f"{args.backends} backends, sticky, one failing", servers, args, sticky=True, fail_backend=True)
+    finally:
+        ollama_client_pool.close()
+        for server in servers:
+            server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Cost of the metrics registry: nanoseconds per recorded observation from one and several threads, and the
+observations per pass of a world running against the stub, which gives the share of a pass spent recording.
+The world's metrics are scraped from the sidecar port the orchestrator serves them on.
+
+    python -m benchmarks.metrics_overhead --agents 4 --duration 10
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from agent_orchestrator import build_world
+from libs.common import ollama_client_pool
+from libs.metrics import MetricsRegistry, metrics, start_metrics_server
+from benchmarks.ollama_stub import OllamaStubServer
+from benchmarks.dashboard_load import free_port
+
+
+def time_records(record, threads, count):
+    """Nanoseconds per call of record(index), count calls on each of threads threads"""
+    def loop():
+        for index in range(count):
+            record(index)
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (threads * count) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="metrics registry overhead")
+    parser.add_argument("--records", type=int, default=200000, help="observations per thread in the micro benchmark")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=4, help="orchestrator max_workers")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds the world runs")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency per chat request in seconds")
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "bench", ["kind"])
+    histogram = registry.histogram("bench_seconds", "bench", ["phase"])
+    phases = ["llm", "tools", "summary", "db_write"]
+
+    def timed(index):
+        with histogram.labels(phases[index % 4]).time():
+            pass
+
+    cases = [
+        ("counter inc", lambda index: counter.labels("a").inc()),
+        ("histogram observe", lambda index: histogram.labels(phases[index % 4]).observe(index * 1e-6)),
+        ("histogram time()", timed),
+    ]
+    print(f"{'record':<22}{'1 thread ns':>13}{f'{args.threads} threads ns':>15}")
+    nanoseconds_per_record = 0.0
+    for label, record in cases:
+        single = time_records(record, 1, args.records)
+        contended = time_records(record, args.threads, args.records // args.threads)
+        nanoseconds_per_record = max(nanoseconds_per_record, contended)
+        print(f"{label:<22}{single:>13.0f}{contended:>15.0f}")
+
+    stub = OllamaStubServer(latency=args.latency)
+    stub_url = stub.start()
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="polis_bench_") as world_directory:
+        os.chdir(world_directory)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                orchestrator, tool_callback, post_system_tool_calls = build_world(server_url=stub_url, agent_count=args.agents, max_workers=args.workers)
+                metrics_server = start_metrics_server(free_port(), host="127.0.0.1")
+                world_thread = threading.Thread(target=orchestrator.run, kwargs={"tool_callback": tool_callback, "post_system_tool_calls": post_system_tool_calls})
+                world_thread.start()
+                time.sleep(args.duration)
+                orchestrator.stop()
+                world_thread.join()
+            scrape = httpx.get(f"http://127.0.0.1:{metrics_server.server_address[1]}/metrics").text
+            start = time.perf_counter()
+            metrics.render()
+            render_seconds = time.perf_counter() - start
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        finally:
+            os.chdir(working_directory)
+            ollama_client_pool.close()
+            stub.stop()
+
+    # every observation adds one to a histogram _count, each LLM call also adds to three token counters
+    records = 0
+    passes = 0
+    pass_seconds = 0.0
+    for line in scrape.splitlines():
+        if line.startswith("#"):
+            continue
+        name, value = line.rsplit(" ", 1)
+        if name == 'polis_agent_phase_seconds_count{phase="pass"}':
+            passes = int(float(value))
+        elif name == 'polis_agent_phase_seconds_sum{phase="pass"}':
+            pass_seconds = float(value)
+        if name.startswith("polis_llm_call_seconds_count"):
+            records += 4 * int(float(value))
+        elif "_count" in name or name.startswith("polis_tool_call_errors_total") or name.startswith("polis_llm_errors_total"):
+            records += int(float(value))
+    if passes == 0:
+        print("no passes completed", file=sys.stderr)
+        return
+    records_per_pass = records / passes
+    overhead = records_per_pass * nanoseconds_per_record / 1e9
+    print(f"{passes} passes, {records_per_pass:.0f} observations per pass, ~{overhead * 1e6:.0f} us of a {pass_seconds / passes * 1000:.0f} ms pass ({overhead / (pass_seconds / passes) * 100:.3f}%)")
+    print(f"scrape of {len(scrape.splitlines())} lines, rendered in {render_seconds * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
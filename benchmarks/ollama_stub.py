@@ -0,0 +1,259 @@
+"""
+Ollama compatible stub server, used to run the orchestrator and the benchmarks without a model.
+
+/api/chat answers with JSON that validates against the requested format schema. Agent output
+answers carry tool calls taken in rotation from STUB_TOOL_CALLS, so every toolset gets exercised.
+Like ollama, a few cache slots keep recent prompts and only the characters after the longest cached
+prefix count as evaluated, optionally costing time at --prompt-rate tokens per second. --parallel caps
+the requests processed at once like OLLAMA_NUM_PARALLEL, and setting failing makes every request a 500.
+
+    python -m benchmarks.ollama_stub --port 5000 --latency 0.05
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timezone
+from typing import Optional
+import argparse
+import contextlib
+import itertools
+import os
+import threading
+import json
+import time
+
+# tool calls handed out by AgentOutputSchema answers, everything here works offline
+STUB_TOOL_CALLS = [
+    {"toolset_id": "app_manager", "name": "list_apps", "arguments": {}},
+    {"toolset_id": "forum_toolset", "name": "create_forum", "arguments": {"title": "Stub forum", "description": "A forum created by the stub server"}},
+    {"toolset_id": "forum_toolset", "name": "search_forums", "arguments": {"query": "Stub"}},
+    {"toolset_id": "forum_toolset", "name": "get_forums", "arguments": {"limit": 10, "offset": 0}},
+    {"toolset_id": "messages", "name": "get_users", "arguments": {}},
+    {"toolset_id": "messages", "name": "get_new_messages", "arguments": {}},
+    {"toolset_id": "notes_manager", "name": "add_note", "arguments": {"title": "stub note", "content": "written by the stub server"}},
+    {"toolset_id": "code_runner", "name": "execute", "arguments": {"code": "print(sum(range(1000)))", "code_intent": "benchmark"}},
+    {"toolset_id": "file_manager", "name": "create_file", "arguments": {"file_path": "stub/notes.txt", "file_content": "stub file\n"}},
+    {"toolset_id": "file_manager", "name": "list_files", "arguments": {}},
+    {"toolset_id": "quest_manager", "name": "create_quest", "arguments": {"overall_goal": "benchmark the orchestrator"}},
+    {"toolset_id": "quest_manager", "name": "get_quest_list", "arguments": {}},
+    {"toolset_id": "persona", "name": "create_persona", "arguments": {"description": "a benchmark persona", "name": "stub"}},
+    {"toolset_id": "persona", "name": "get_current_persona", "arguments": {}},
+]
+
+def build_instance(schema: dict, defs: dict, name: str = "value"):
+    """Builds the smallest useful instance of a pydantic generated JSON schema."""
+    if "$ref" in schema:
+        return build_instance(defs[schema["$ref"].split("/")[-1]], defs, name)
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        return build_instance(options[0], defs, name) if len(options) > 0 else None
+    if "default" in schema:
+        return schema["default"]
+
+    schema_type = schema.get("type", "object")
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        return {key: build_instance(value, defs, key) for key, value in properties.items()}
+    if schema_type == "array":
+        # one item, callers such as quest generation index the first element
+        return [build_instance(schema.get("items", {}), defs, name)]
+    if schema_type == "string":
+        return f"stub {name}"
+    if schema_type == "integer":
+        return 0
+    if schema_type == "number":
+        return 0.0
+    if schema_type == "boolean":
+        return True
+    return None
+
+
+class OllamaStubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests, like the real server
+    protocol_version = "HTTP/1.1"
+    # headers and body go out as separate writes, without this delayed ACKs add ~40ms per response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if len(body) == 0:
+            return {}
+        return json.loads(body)
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.server.failing:
+            self._send_json({"error": "stub failing"}, 500)
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-stub"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": []})
+        else:
+            self._send_json({"error": f"{self.path} not found"}, 404)
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.server.failing:
+            self._send_json({"error": "stub failing"}, 500)
+        elif self.path == "/api/chat":
+            with self.server.slots:
+                response = self.server.chat_response(request)
+                # the load, if any, has already been waited for
+                time.sleep((response["total_duration"] - response["load_duration"]) / 1e9)
+            self._send_json(response)
+        elif self.path == "/api/embed":
+            time.sleep(self.server.embed_latency)
+            self._send_json(self.server.embed_response(request))
+        else:
+            self._send_json({"error": f"{self.path} not found"}, 404)
+
+
+class OllamaStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, embed_latency: float = 0.0, embedding_size: int = 768, prompt_rate: float = 0.0, cache_slots: int = 4, parallel: int = 0, reload_seconds: float = 1.0):
+        super().__init__((host, port), OllamaStubHandler)
+        self.latency = latency
+        self.embed_latency = embed_latency
+        self.embedding_size = embedding_size
+        self.tool_calls_per_pass = 3
+        self.tool_call_rotation = itertools.cycle(STUB_TOOL_CALLS)
+        self.rotation_lock = threading.Lock()
+        # prompt evaluation speed in tokens per second, 0 makes prompt evaluation free
+        self.prompt_rate = prompt_rate
+        # most recently used prompt last
+        self.cache_slots = cache_slots
+        self.cached_prompts = []
+        self.cache_lock = threading.Lock()
+        # chat requests processed at once, 0 for no limit
+        self.slots = threading.Semaphore(parallel) if parallel > 0 else contextlib.nullcontext()
+        # like ollama, a request with another num_ctx than the loaded runner reloads the model, dropping the prompt
+        # cache, and requests for the model wait for the reload
+        self.reload_seconds = reload_seconds
+        self.loaded_contexts = {} # model -> num_ctx
+        self.reloads = 0
+        self.model_lock = threading.Lock()
+        self.failing = False
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def chat_content(self, schema: Optional[dict]):
+        if not isinstance(schema, dict):
+            return "stub response"
+        content = build_instance(schema, schema.get("$defs", {}))
+        if schema.get("title") in ["AgentOutputSchema", "AgentCombinedOutputSchema"]:
+            with self.rotation_lock:
+                content["tool_calls"] = [next(self.tool_call_rotation) for _ in range(self.tool_calls_per_pass)]
+        return json.dumps(content)
+
+    def cached_prefix_length(self, prompt: str):
+        """
+        Length of the longest cached prefix of prompt. A prompt that extends a cached prompt takes over its
+        slot, otherwise it goes in the least recently used slot so the partial match is not lost.
+        """
+        with self.cache_lock:
+            best_index, best_length = None, 0
+            for index, cached_prompt in enumerate(self.cached_prompts):
+                length = len(os.path.commonprefix([cached_prompt, prompt]))
+                if length > best_length:
+                    best_index, best_length = index, length
+            if best_index is not None and best_length == len(self.cached_prompts[best_index]):
+                self.cached_prompts.pop(best_index)
+            elif len(self.cached_prompts) >= self.cache_slots:
+                self.cached_prompts.pop(0)
+            self.cached_prompts.append(prompt)
+            return best_length
+
+    def load_model(self, model: str, num_ctx) -> float:
+        """Seconds spent loading model with num_ctx, 0 if it is already loaded that way"""
+        with self.model_lock:
+            if model in self.loaded_contexts and self.loaded_contexts[model] == num_ctx:
+                return 0.0
+            self.loaded_contexts[model] = num_ctx
+            self.reloads += 1
+            with self.cache_lock:
+                self.cached_prompts = []
+            time.sleep(self.reload_seconds)
+            return self.reload_seconds
+
+    def chat_response(self, request: dict):
+        num_ctx = (request.get("options") or {}).get("num_ctx")
+        load_seconds = self.load_model(request.get("model", ""), num_ctx)
+        now = datetime.now(timezone.utc).isoformat()
+        content = self.chat_content(request.get("format"))
+        prompt = "".join(json.dumps(message) for message in request.get("messages", []))
+        prompt_eval_count = (len(prompt) - self.cached_prefix_length(prompt)) // 4
+        # like ollama, a prompt longer than the context is truncated to it
+        if num_ctx:
+            prompt_eval_count = min(prompt_eval_count, num_ctx)
+        prompt_eval_seconds = prompt_eval_count / self.prompt_rate if self.prompt_rate > 0 else 0.0
+        return {
+            "model": request.get("model", ""),
+            "created_at": now,
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((load_seconds + self.latency + prompt_eval_seconds) * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_eval_count,
+            "prompt_eval_duration": int(prompt_eval_seconds * 1e9),
+            "eval_count": len(content) // 4
+        }
+
+    def embed_response(self, request: dict):
+        inputs = request.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return {
+            "model": request.get("model", ""),
+            "embeddings": [[0.0] * self.embedding_size for _ in inputs]
+        }
+
+    def start(self):
+        """Serves in a daemon thread and returns the server url."""
+        self.thread = threading.Thread(target=self.serve_forever, name="ollama-stub", daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering a chat request")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds to wait before answering an embed request")
+    parser.add_argument("--tool-calls", type=int, default=3, help="tool calls per AgentOutputSchema answer")
+    parser.add_argument("--prompt-rate", type=float, default=0.0, help="prompt tokens evaluated per second, 0 for free prompt evaluation")
+    parser.add_argument("--parallel", type=int, default=0, help="chat requests processed at once, 0 for no limit")
+    parser.add_argument("--reload-seconds", type=float, default=1.0, help="seconds to reload the model when a request's num_ctx differs from the loaded one")
+    args = parser.parse_args()
+
+    server = OllamaStubServer(args.host, args.port, args.latency, args.embed_latency, prompt_rate=args.prompt_rate, parallel=args.parallel, reload_seconds=args.reload_seconds)
+    server.tool_calls_per_pass = args.tool_calls
+    print(f"Ollama stub listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
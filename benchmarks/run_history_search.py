@@ -0,0 +1,134 @@
+"""
+Run history full-text search at scale: save cost of the search index, its size, and query latency with
+synthetic passes, so it does not need a world to reach a million passes.
+
+Passes get thoughts, a summary, tool calls and tool results drawn from a Zipf-distributed vocabulary, and a
+few planted needle words at known rates.
+
+    python -m benchmarks.run_history_search --passes 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+from libs.agent_database import AgentDatabase
+from libs.run_history_search import create_run_history_fts, index_run_result
+
+# needle word -> fraction of passes it is planted in
+NEEDLES = {"zanzibar": 0.00001, "quokka": 0.001, "marmalade": 0.05}
+
+
+def make_vocabulary(size, rng):
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "pe", "da", "gu", "xi"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_pass(rng, vocabulary, cumulative_weights, pass_number):
+    def text(word_count):
+        words = rng.choices(vocabulary, cum_weights=cumulative_weights, k=word_count)
+        for needle, rate in NEEDLES.items():
+            if rng.random() < rate:
+                words[rng.randrange(word_count)] = needle
+        return " ".join(words)
+    return {
+        "pass_id": str(uuid.uuid4()),
+        "model": "bench",
+        "run_messages": [],
+        "agent_output": {
+            "thoughts": text(60),
+            "followup_thoughts": text(30),
+            "tool_calls": [{"toolset_id": "forum_toolset", "name": "create_post", "arguments": {"content": text(20)}}],
+            "should_continue": True,
+        },
+        "tool_results": [{"role": "tool", "content": text(300)}],
+        "summary_messages": [],
+        "summary_output": {"thoughts": text(20), "actions_taken": [text(8)], "notes": [], "summary": text(40), "instructions_for_next_pass": ""},
+        "pass_number": pass_number,
+    }
+
+
+def time_query(database, query, agent_id=None, repeats=5):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = database.search_run_history(query, agent_id=agent_id, limit=20)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000, len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run history search benchmark")
+    parser.add_argument("--passes", type=int, default=100000)
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=64, help="passes per transaction, as the write-behind writer batches them")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    cumulative_weights = list(itertools.accumulate(1.0 / rank for rank in range(1, len(vocabulary) + 1)))
+    agent_ids = [f"agent-{index}" for index in range(args.agents)]
+
+    with tempfile.TemporaryDirectory(prefix="polis_bench_") as directory:
+        database = AgentDatabase(os.path.join(directory, "agent_database.db"))
+        conn = database.get_connection()
+        save_seconds = 0.0
+        index_seconds = 0.0
+        pass_numbers = {agent_id: 0 for agent_id in agent_ids}
+        for start in range(0, args.passes, args.batch):
+            batch = []
+            for _ in range(min(args.batch, args.passes - start)):
+                agent_id = rng.choice(agent_ids)
+                pass_numbers[agent_id] += 1
+                agent_run_result = make_pass(rng, vocabulary, cumulative_weights, pass_numbers[agent_id])
+                batch.append((agent_id, agent_id, agent_run_result["pass_id"], pass_numbers[agent_id], agent_run_result, "2025-01-01 00:00:00"))
+            batch_start = time.perf_counter()
+            database.save_passes(batch)
+            save_seconds += time.perf_counter() - batch_start
+            if (start // args.batch) % 200 == 0:
+                print(f"\r{start + len(batch)} passes saved", end="", flush=True)
+        print()
+
+        # the share of save time spent indexing, measured by indexing a sample again into a scratch table
+        sample = [make_pass(rng, vocabulary, cumulative_weights, 0) for _ in range(1000)]
+        create_run_history_fts(conn, "scratch_fts")
+        with conn:
+            start = time.perf_counter()
+            for rowid, agent_run_result in enumerate(sample, start=1):
+                index_run_result(conn, rowid, agent_ids[rowid % len(agent_ids)], agent_run_result, "scratch_fts")
+            index_seconds = (time.perf_counter() - start) / len(sample)
+        conn.execute("DROP TABLE scratch_fts")
+
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        index_bytes = sum(row[0] for row in conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE 'run_history_fts%'"))
+        total_bytes = os.path.getsize(database.database_path)
+        print(f"{args.passes} passes, save {save_seconds / args.passes * 1000:.2f} ms/pass of which indexing ~{index_seconds * 1000:.2f} ms")
+        print(f"index {index_bytes / 1024 / 1024:.1f} MB of {total_bytes / 1024 / 1024:.1f} MB, {index_bytes / args.passes:.0f} bytes/pass")
+
+        print(f"{'query':<34}{'median ms':>10}{'results':>9}")
+        queries = [
+            ("zanzibar (rare)", "zanzibar", None),
+            ("quokka (0.1%)", "quokka", None),
+            ("marmalade (5%)", "marmalade", None),
+            ("common word", vocabulary[0], None),
+            ("two common words", f"{vocabulary[0]} {vocabulary[1]}", None),
+            ("prefix", vocabulary[5][:3] + "*", None),
+            ("marmalade, one agent", "marmalade", agent_ids[0]),
+            ("common word, one agent", vocabulary[0], agent_ids[0]),
+        ]
+        for label, query, agent_id in queries:
+            milliseconds, count = time_query(database, query, agent_id)
+            print(f"{label:<34}{milliseconds:>10.1f}{count:>9}")
+        database.close()
+
+if __name__ == "__main__":
+    main()
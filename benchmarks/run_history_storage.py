@@ -0,0 +1,122 @@
+"""
+Bytes per saved pass of the agent run history, full JSON per row (storage version 1) vs messages
+deduplicated into message_blobs (storage version 2).
+
+Runs the throughput world against the stub to get real run results, then writes the same history to a
+fresh database in each format, migrates a copy of the version 1 database, and checks that every format
+reads back the same JSON.
+
+    python -m benchmarks.run_history_storage --agents 4 --duration 15
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from agent_orchestrator import build_world
+from libs.agent_database import AgentDatabase
+from libs.common import ollama_client_pool
+from benchmarks.ollama_stub import OllamaStubServer
+
+
+def database_bytes(database):
+    # the WAL is folded into the main file first so the file size is the data size
+    conn = database.get_connection()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def read_history(database, agent_ids, page_size=10):
+    """All run results of every agent, read a page at a time like the web UI, and the mean ms per page"""
+    results = {}
+    durations = []
+    for agent_id in agent_ids:
+        offset = 0
+        while True:
+            start = time.perf_counter()
+            rows = database.get_agent_run_results(agent_id, limit=page_size, offset=offset)
+            durations.append(time.perf_counter() - start)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                results[row[0]] = json.loads(row[3])
+            offset += page_size
+    return results, statistics.mean(durations) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run history storage benchmark")
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds to run the world for")
+    parser.add_argument("--latency", type=float, default=0.01, help="stub latency per chat request in seconds")
+    args = parser.parse_args()
+
+    server = OllamaStubServer(latency=args.latency)
+    server_url = server.start()
+    working_directory = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix="polis_bench_") as world_directory:
+        os.chdir(world_directory)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                orchestrator, tool_callback, post_system_tool_calls = build_world(server_url=server_url, agent_count=args.agents)
+                timer = threading.Timer(args.duration, orchestrator.stop)
+                timer.start()
+                orchestrator.run(tool_callback=tool_callback, post_system_tool_calls=post_system_tool_calls)
+                timer.cancel()
+
+            world_database = AgentDatabase("agent_database.db")
+            agent_ids = [row[0] for row in world_database.get_agent_list()]
+            rows = []
+            for agent_id in agent_ids:
+                rows.extend(world_database.get_agent_run_results(agent_id, limit=1000000))
+            # oldest first, the order they were saved in
+            rows.sort(key=lambda row: (row[4], row[2]))
+            print(f"{len(rows)} passes of {len(agent_ids)} agents")
+
+            full_json = AgentDatabase("full_json.db")
+            deduplicated = AgentDatabase("deduplicated.db")
+            timings = {"full JSON": [], "message blobs": []}
+            for pass_id, agent_id, pass_number, agent_run_result, run_date in rows:
+                start = time.perf_counter()
+                full_json.save_agent_run_result(agent_id, pass_id, pass_number, agent_run_result, run_date)
+                timings["full JSON"].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                deduplicated.save_pass(agent_id, "bench", pass_id, pass_number, json.loads(agent_run_result), run_date)
+                timings["message blobs"].append(time.perf_counter() - start)
+
+            full_json.get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            shutil.copy("full_json.db", "migrated.db")
+            migrated = AgentDatabase("migrated.db")
+            start = time.perf_counter()
+            migrated.migrate_run_results()
+            migrate_seconds = time.perf_counter() - start
+            migrated.get_connection().execute("VACUUM")
+
+            expected = {row[0]: json.loads(row[3]) for row in rows}
+            print(f"{'storage':<22}{'bytes/pass':>12}{'total KB':>10}{'save ms':>10}{'page read ms':>14}")
+            for label, database in [("full JSON", full_json), ("message blobs", deduplicated), ("migrated + vacuum", migrated)]:
+                results, read_ms = read_history(database, agent_ids)
+                assert results == expected, f"{label} does not read back the saved run results"
+                total = database_bytes(database)
+                save_ms = f"{statistics.mean(timings[label]) * 1000:>10.2f}" if label in timings else f"{'':>10}"
+                print(f"{label:<22}{total / len(rows):>12.0f}{total / 1024:>10.0f}{save_ms}{read_ms:>14.2f}")
+            blob_count = deduplicated.get_connection().execute("SELECT COUNT(*) FROM message_blobs").fetchone()[0]
+            message_count = sum(len(result.get(field) or []) for result in expected.values() for field in ["run_messages", "tool_results", "summary_messages"])
+            print(f"{message_count} messages stored as {blob_count} blobs, migration took {migrate_seconds:.2f}s")
+            for database in [world_database, full_json, deduplicated, migrated]:
+                database.close()
+        finally:
+            os.chdir(working_directory)
+            ollama_client_pool.close()
+            server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+End-to-end orchestrator throughput against the Ollama stub server.
+
+Builds the same world as agent_orchestrator.main (every toolset, N agents) in a temporary directory,
+runs it for a fixed duration and reports passes/sec, per-phase latency, tokens per pass and peak RSS.
+
+    python -m benchmarks.throughput --agents 8 --workers 4 --duration 30 --latency 0.2
+"""
+import argparse
+import contextlib
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from agent_orchestrator import build_world
+from libs.common import ollama_client_pool
+from benchmarks.ollama_stub import OllamaStubServer
+
+PHASES = ["pass", "summary_wait", "standing_tool_calls", "llm", "tools", "summary", "db_write"]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="orchestrator throughput benchmark")
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=1, help="orchestrator max_workers")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to run before stopping the orchestrator")
+    parser.add_argument("--latency", type=float, default=0.1, help="stub latency per chat request in seconds")
+    parser.add_argument("--prompt-rate", type=float, default=0.0, help="stub prompt tokens evaluated per second, 0 for free prompt evaluation")
+    parser.add_argument("--reload-seconds", type=float, default=1.0, help="stub seconds to reload the model when num_ctx changes")
+    parser.add_argument("--tool-calls", type=int, default=3, help="tool calls per agent pass")
+    parser.add_argument("--summary-mode", default="inline", choices=["inline", "background", "combined"])
+    parser.add_argument("--buffer-eviction", type=int, default=1, help="messages the agents' message buffers drop at once when full")
+    parser.add_argument("--inline-writes", action="store_true", help="save passes on the agent thread instead of the write-behind queue")
+    parser.add_argument("--verbose", action="store_true", help="keep the orchestrator output")
+    args = parser.parse_args()
+
+    server = OllamaStubServer(latency=args.latency, prompt_rate=args.prompt_rate, reload_seconds=args.reload_seconds)
+    server.tool_calls_per_pass = args.tool_calls
+    server_url = server.start()
+
+    working_directory = os.getcwd()
+    report = sys.stdout
+    pass_timings = []
+    # background summaries fill in their token stats after the pass, keep the dicts rather than copies
+    pass_token_stats = []
+    pass_timings_lock = threading.Lock()
+
+    def record_pass(agent):
+        with pass_timings_lock:
+            pass_timings.append(dict(agent.latest_pass_timings))
+            pass_token_stats.append(agent.latest_pass_token_stats)
+
+    with tempfile.TemporaryDirectory(prefix="polis_bench_") as world_directory:
+        os.chdir(world_directory)
+        try:
+            output = open(os.devnull, "w") if not args.verbose else sys.stdout
+            with contextlib.redirect_stdout(output):
+                orchestrator, tool_callback, post_system_tool_calls = build_world(
+                    server_url=server_url,
+                    agent_count=args.agents,
+                    max_workers=args.workers,
+                    summary_mode=args.summary_mode,
+                    write_behind=not args.inline_writes,
+                    buffer_eviction=args.buffer_eviction
+                )
+                orchestrator.on_pass_complete = record_pass
+
+                print(f"{args.agents} agents, {args.workers} workers, {args.summary_mode} summary, {args.latency}s stub latency, running for {args.duration}s", file=report)
+                timer = threading.Timer(args.duration, orchestrator.stop)
+                timer.start()
+                start = time.perf_counter()
+                orchestrator.run(tool_callback=tool_callback, post_system_tool_calls=post_system_tool_calls)
+                elapsed = time.perf_counter() - start
+                timer.cancel()
+                writer_stats = [database_writer.get_stats() for database_writer in orchestrator.database_writers]
+        finally:
+            os.chdir(working_directory)
+            ollama_client_pool.close()
+            server.stop()
+
+    print(f"passes: {len(pass_timings)} in {elapsed:.1f}s, {len(pass_timings) / elapsed:.2f} passes/sec")
+    print(f"{'phase':<22}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for phase in PHASES:
+        values = [timings[phase] * 1000 for timings in pass_timings if phase in timings]
+        if len(values) == 0:
+            continue
+        print(f"{phase:<22}{statistics.mean(values):>10.1f}{percentile(values, 0.5):>10.1f}{percentile(values, 0.95):>10.1f}")
+    print(f"{'tokens per pass':<22}{'prompt est':>12}{'prompt eval':>12}{'cached':>10}{'eval':>10}{'num_ctx':>10}{'eval ms':>10}")
+    for call_site in ["agent_pass", "summary"]:
+        usages = [token_stats[call_site] for token_stats in pass_token_stats if "num_ctx" in token_stats.get(call_site, {})]
+        if len(usages) == 0:
+            continue
+        columns = [statistics.mean(usage[key] or 0 for usage in usages) for key in ["estimated_prompt_tokens", "prompt_eval_count", "estimated_cached_prefix_tokens", "eval_count", "num_ctx", "prompt_eval_seconds"]]
+        print(f"{call_site:<22}{columns[0]:>12.0f}{columns[1]:>12.0f}{columns[2]:>10.0f}{columns[3]:>10.0f}{columns[4]:>10.0f}{columns[5] * 1000:>10.1f}")
+    for stats in writer_stats:
+        print(f"database writer: {stats['written']} passes in {stats['batches']} transactions, {stats['failed']} failed, queue full {stats['queue_full']} times")
+    # ru_maxrss is reported in kilobytes on linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"stub model reloads: {server.reloads}, {server.reloads * server.reload_seconds:.1f}s spent loading")
+    print(f"peak RSS: {peak_rss_mb:.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Wall time of Agent.run_tool_calls for a pass of tool calls with simulated latencies, with and without
+read-only tools running concurrently. Needs no model or stub server.
+
+    python -m benchmarks.tool_calls --repeats 5
+"""
+import argparse
+import statistics
+import tempfile
+import time
+import os
+
+from libs.agent import Agent
+from libs.common import ToolCall
+
+# (toolset_id, name, seconds, read only)
+PASSES = {
+    "reads only": [
+        ("wiki_toolset", "get_wikipedia_text", 0.40, True),
+        ("forum_toolset", "get_current_posts", 0.05, True),
+        ("messages", "get_messages", 0.05, True),
+        ("quest_manager", "get_current_quest", 0.02, True),
+    ],
+    "read, write, reads": [
+        ("wiki_toolset", "get_wikipedia_text", 0.40, True),
+        ("forum_toolset", "create_post", 0.05, False),
+        ("forum_toolset", "get_current_posts", 0.05, True),
+        ("code_runner", "get_file", 0.02, True),
+        ("wiki_toolset", "get_wikipedia_text", 0.30, True),
+    ],
+    "writes only": [
+        ("notes_manager", "add_note", 0.02, False),
+        ("code_runner", "execute", 0.20, False),
+        ("file_manager", "create_file", 0.02, False),
+    ],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parallel tool call benchmark")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="polis_bench_") as directory:
+        agent = Agent("http://127.0.0.1:1", os.path.join(directory, "agent_database.db"), "bench", "bench", "", [])
+
+        def tool_callback(agent, tool_call):
+            time.sleep(tool_call.arguments["seconds"])
+            return f"{tool_call.name} done"
+
+        print(f"{'pass':<22}{'sum of calls ms':>17}{'sequential ms':>15}{'parallel ms':>13}")
+        for label, calls in PASSES.items():
+            tool_calls = [ToolCall(toolset_id=toolset_id, name=name, arguments={"seconds": seconds}) for toolset_id, name, seconds, read_only in calls]
+            read_only_tools = {(toolset_id, name) for toolset_id, name, seconds, read_only in calls if read_only}
+            timings = {}
+            for mode, tools in [("sequential", set()), ("parallel", read_only_tools)]:
+                durations = []
+                for _ in range(args.repeats):
+                    start = time.perf_counter()
+                    results = agent.run_tool_calls(tool_calls, tool_callback, tools)
+                    durations.append(time.perf_counter() - start)
+                    assert results == [f"{tool_call.name} done" for tool_call in tool_calls]
+                timings[mode] = statistics.mean(durations) * 1000
+            total = sum(seconds for toolset_id, name, seconds, read_only in calls) * 1000
+            print(f"{label:<22}{total:>17.0f}{timings['sequential']:>15.0f}{timings['parallel']:>13.0f}")
+
+if __name__ == "__main__":
+    main()
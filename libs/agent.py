@@ -1,20 +1,30 @@
 try:
     from .common import call_ollama_chat, embed_with_ollama, convert_file, chunk_text, Message, ToolCall
-    from .agent_database import AgentDatabase
+    from .agent_database import get_agent_database
+    from .token_estimator import token_estimator
+    from .metrics import metrics
+    from .tracing import PassTrace
 except ImportError:
     from common import call_ollama_chat, embed_with_ollama, convert_file, chunk_text, Message, ToolCall
-    from agent_database import AgentDatabase
+    from agent_database import get_agent_database
+    from token_estimator import token_estimator
+    from metrics import metrics
+    from tracing import PassTrace
 from datetime import datetime
-from typing import List, Optional, Callable
+from typing import List, Optional, Callable, Set, Tuple
 from pydantic import BaseModel, Field
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import json
+import time
 import traceback
-import warnings
-warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
 import sqlite3
 import uuid
 
+# every agent's passes, with the phases of latest_pass_timings
+phase_seconds = metrics.histogram("polis_agent_phase_seconds", "Seconds spent in each phase of agent passes", ["phase"])
+
 class AgentOutputSchema(BaseModel):
     thoughts: str = Field(description="your thoughts. This is part of your chain of thought process.")
     followup_thoughts: str = Field(description="your followup thoughts. This is part of your chain of thought process.")
@@ -28,6 +38,9 @@ class AgentSummarySchema(BaseModel):
     summary: str = Field(description="string of summary. This is a summary of the actions taken, including what was thought and what was done.")
     instructions_for_next_pass: str = Field(description="This is the prompt you will receive in the next pass as a user message.")
 
+class AgentCombinedOutputSchema(AgentOutputSchema):
+    pass_summary: AgentSummarySchema = Field(description="The summary of this pass: the actions you are taking, notes to keep and the instructions for your next pass.")
+
 class AgentRunResult(BaseModel): # TODO: generate and save this for each pass
     pass_id: str = Field(description="The id of the pass.")
     agent_id: str = Field(description="The id of the agent that ran.")
@@ -38,16 +51,21 @@ class AgentRunResult(BaseModel): # TODO: generate and save this for each pass
     tool_results: List[Message]
     summary_messages: List[Message] = Field(description="The messages from the summary pass.")
     summary_output: AgentSummarySchema = Field(description="The output of the summary pass.")
+    token_stats: Optional[dict] = Field(default=None, description="Tokens sent and received by the LLM calls of the pass.")
     
 class Agent:
-    def __init__(self, default_llm_url: str, database_path: str, name: str, private_key: str, initial_instructions: str, initial_notes: List[str], buffer_size: int = 20, running: bool = True, standing_tool_calls: List[ToolCall] = []):
+    def __init__(self, default_llm_url: str, database_path: str, name: str, private_key: str, initial_instructions: str, initial_notes: List[str], buffer_size: int = 20, running: bool = True, standing_tool_calls: List[ToolCall] = [], summary_mode: str = "inline", context_budget: int = 32000, max_tool_result_tokens: int = 4000, max_parallel_tool_calls: int = 5, buffer_eviction: int = 1):
         self.default_llm_url = default_llm_url
-        self.model = "TODO"
+        self.model = None # set by run, tools that call the LLM on behalf of the agent use it
         self.name = name
         self.private_key = private_key
         self.notes = initial_notes
         self.running = running
         self.buffer_size = buffer_size
+        # messages dropped at once when the buffer overflows. 1 keeps a full buffer of working memory but shifts
+        # the buffer every pass, so the backend's cached prefix ends at the system prompt. Larger values keep the
+        # buffer start, and the cache, unchanged for several passes at the cost of a shorter buffer after each eviction
+        self.buffer_eviction = max(1, min(buffer_eviction, buffer_size))
         self.message_buffer = []
         self.standing_tool_calls = standing_tool_calls
         self.latest_summary_messages = []
@@ -60,25 +78,186 @@ class Agent:
         self.tools = []
         self.pass_summaries = []
         self.latest_pass_tool_call_results = []
+        # seconds spent in each phase of the latest pass
+        self.latest_pass_timings = {}
+        # "inline": summary call after the tools, "background": summary call overlaps the next agent's turn,
+        # "combined": the main call returns the summary as well, no second call
+        if summary_mode not in ["inline", "background", "combined"]:
+            raise ValueError(f"Unknown summary mode {summary_mode}")
+        self.summary_mode = summary_mode
+        self.summary_executor = None
+        self.pending_summary = None
+        self.latest_background_timings = {}
+        # prompt tokens allowed per LLM call, older messages and long tool results are trimmed to fit
+        self.context_budget = context_budget
+        self.max_tool_result_tokens = max_tool_result_tokens
+        # tokens sent and received in the latest pass, keyed by call site
+        self.latest_pass_token_stats = {}
+        # system prompts by output schema, rendered once so every pass sends a byte-identical prefix
+        self.system_prompts = {}
+        # indexes of the post system messages that have changed between passes, they go after the message buffer
+        self.volatile_context_indexes = set()
+        self.latest_stable_context = []
+        self.latest_volatile_context = []
+        # runs consecutive read-only tool calls of a pass concurrently
+        self.max_parallel_tool_calls = max_parallel_tool_calls
+        self.tool_executor = None
+        # AgentDatabaseWriter that saves passes in the background, None saves them before the pass returns
+        self.database_writer = None
+        # PassTrace of the pass in progress, saved to pass_traces once the pass and its summary are done
+        self.current_trace = None
+
+    @contextmanager
+    def time_phase(self, phase: str, timings: Optional[dict] = None, trace: Optional[PassTrace] = None, **span_args):
+        """Adds the with block to timings and the metrics, and records it as a span of the pass trace"""
+        if timings is None:
+            timings = self.latest_pass_timings
+        start = time.perf_counter()
+        try:
+            with self.trace_span(phase, trace=trace, **span_args) as args:
+                yield args
+        finally:
+            seconds = time.perf_counter() - start
+            timings[phase] = timings.get(phase, 0.0) + seconds
+            phase_seconds.labels(phase).observe(seconds)
+
+    def start_trace(self) -> PassTrace:
+        """Starts the trace of the next pass, the orchestrator starts it before the post-system tool calls"""
+        self.current_trace = PassTrace(on_complete=self.save_trace)
+        return self.current_trace
+
+    @contextmanager
+    def trace_span(self, name: str, category: str = "phase", trace: Optional[PassTrace] = None, parent: Optional[int] = None, **args):
+        """A span of trace, by default the current pass's, yields its args. Outside a traced pass nothing is recorded"""
+        if trace is None:
+            trace = self.current_trace
+        if trace is None:
+            yield args
+            return
+        with trace.span(name, category, parent, **args) as span_args:
+            yield span_args
+
+    def save_trace(self, trace: PassTrace):
+        if trace.pass_id is None:
+            # the pass failed before it was saved
+            return
+        if self.database_writer is not None:
+            self.database_writer.submit_trace(trace)
+        else:
+            get_agent_database(self.database_path).save_traces([trace])
+
+    def get_output_schema(self):
+        if self.summary_mode == "combined":
+            return AgentCombinedOutputSchema
+        return AgentOutputSchema
+
+    def fit_to_context_budget(self, head: List[Message], buffer: List[Message], tail: List[Message], token_stats: dict):
+        """
+        Returns head + buffer + tail within context_budget tokens. Long tool results in the buffer are
+        truncated first, then the oldest buffer messages are dropped. head and tail are always kept.
+        """
+        max_tool_result_characters = token_estimator.characters_for_tokens(self.max_tool_result_tokens)
+        truncated_tool_results = 0
+        fitted_buffer = []
+        for message in buffer:
+            if message.role == "tool" and message.content is not None and len(message.content) > max_tool_result_characters:
+                removed_characters = len(message.content) - max_tool_result_characters
+                message = Message(role="tool", content=message.content[:max_tool_result_characters] + f"\n...[truncated {removed_characters} characters]")
+                truncated_tool_results += 1
+            fitted_buffer.append(message)
+
+        buffer_tokens = [token_estimator.estimate_message(message) for message in fitted_buffer]
+        total_tokens = token_estimator.estimate_messages(head) + sum(buffer_tokens) + token_estimator.estimate_messages(tail)
+        first_kept = 0
+        while total_tokens > self.context_budget and first_kept < len(fitted_buffer):
+            total_tokens -= buffer_tokens[first_kept]
+            first_kept += 1
+            # tool results are dropped together with the tool call message they answer
+            while first_kept < len(fitted_buffer) and fitted_buffer[first_kept].role == "tool":
+                total_tokens -= buffer_tokens[first_kept]
+                first_kept += 1
+
+        token_stats["truncated_tool_results"] = truncated_tool_results
+        token_stats["dropped_messages"] = first_kept
+        if total_tokens > self.context_budget:
+            print(f"Agent {self.name}: prompt of ~{total_tokens} tokens is over the {self.context_budget} token budget with the message buffer dropped")
+        return head + fitted_buffer[first_kept:] + tail
 
     def add_message(self, message: Message):
         self.message_buffer.append(message)
-        self.message_buffer = self.message_buffer[-self.buffer_size:]
+        if len(self.message_buffer) > self.buffer_size:
+            self.message_buffer = self.message_buffer[-(self.buffer_size + 1 - self.buffer_eviction):]
         
-    def get_system_prompt(self, standing_tool_results: str):
-        return f"""You are an advanced synthetic being. You are in an internal monologue loop, you can only interact with the world through the available apps.
+    def get_system_prompt(self, output_schema=AgentOutputSchema):
+        # only stable content here, the backend reuses the KV cache of an unchanged prompt prefix.
+        # per pass data goes in the trailing context message
+        if output_schema.__name__ not in self.system_prompts:
+            self.system_prompts[output_schema.__name__] = f"""You are an advanced synthetic being. You are in an internal monologue loop, you can only interact with the world through the available apps.
 
-{standing_tool_results}
-* Current local time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+* Your current context and the local time are given in the latest user message.
 * Only tools from loaded apps can be called.
 * You can only call up to 5 tools in one pass.
 * If a tool call fails, ensure you have the appropriate tools to fix the issue.
 
 You must respond in the following JSON format:
-{AgentOutputSchema.model_json_schema()}
+{output_schema.model_json_schema()}
 """
+        return self.system_prompts[output_schema.__name__]
 
-    def call_tools(self, tool_calls: List[ToolCall], tool_callback: Callable):
+    def split_post_system_messages(self, post_system_messages: List[Message]):
+        """
+        (stable, volatile) post system messages. A message goes ahead of the message buffer until its content
+        first changes between passes and after the buffer from then on, so notes or a quest that keep changing
+        do not invalidate the cached buffer every pass, while an app list that never changes stays cached
+        """
+        previous = self.latest_post_system_messages
+        if len(previous) == len(post_system_messages):
+            for index, (previous_message, message) in enumerate(zip(previous, post_system_messages)):
+                if previous_message != message:
+                    self.volatile_context_indexes.add(index)
+        stable = [message for index, message in enumerate(post_system_messages) if index not in self.volatile_context_indexes]
+        volatile = [message for index, message in enumerate(post_system_messages) if index in self.volatile_context_indexes]
+        return stable, volatile
+
+    def get_context_message(self, standing_tool_results: str):
+        return Message(role="user", content=f"""Current context:
+{standing_tool_results}
+* Current local time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+""")
+
+    def run_tool_calls(self, tool_calls: List[ToolCall], tool_callback: Callable, read_only_tools: Optional[Set[Tuple[str, str]]] = None):
+        """
+        Calls the tools and returns their results in call order. read_only_tools holds (toolset_id, name) pairs,
+        consecutive read-only calls run concurrently and any other call waits for everything before it.
+        """
+        if read_only_tools is None:
+            read_only_tools = set()
+        trace = self.current_trace
+        # concurrent calls run on worker threads, their spans nest under the span open on this thread
+        parent = trace.current_span() if trace is not None else None
+
+        def traced_tool_callback(tool_call: ToolCall):
+            with self.trace_span(f"{tool_call.toolset_id}.{tool_call.name}", "tool", trace=trace, parent=parent):
+                return tool_callback(self, tool_call)
+
+        results = []
+        index = 0
+        while index < len(tool_calls):
+            end = index
+            while end < len(tool_calls) and (tool_calls[end].toolset_id, tool_calls[end].name) in read_only_tools:
+                end += 1
+            if end - index > 1:
+                if self.tool_executor is None:
+                    self.tool_executor = ThreadPoolExecutor(max_workers=self.max_parallel_tool_calls, thread_name_prefix=f"{self.name}-tools")
+                futures = [self.tool_executor.submit(traced_tool_callback, tool_call) for tool_call in tool_calls[index:end]]
+                results.extend(future.result() for future in futures)
+                index = end
+            else:
+                results.append(traced_tool_callback(tool_calls[index]))
+                index += 1
+        return results
+
+    def call_tools(self, tool_calls: List[ToolCall], tool_callback: Callable, read_only_tools: Optional[Set[Tuple[str, str]]] = None):
         
         self.latest_pass_tool_call_results = []
 
@@ -90,8 +269,7 @@ You must respond in the following JSON format:
         self.add_message(Message(role="assistant", tool_calls=tool_calls))
         self.latest_pass_tool_call_results.append(Message(role="assistant", tool_calls=tool_calls))
 
-        for tool_call in tool_calls:
-            tool_results = tool_callback(self, tool_call)
+        for tool_call, tool_results in zip(tool_calls, self.run_tool_calls(tool_calls, tool_callback, read_only_tools)):
             if tool_results is not None:
                 if type(tool_results) == str:
                     self.add_message(Message(role="tool", content=tool_results))
@@ -124,7 +302,7 @@ You must respond in the following JSON format:
                     print("~"*100)
                     print("~"*100)
 
-    def call_standing_tool_calls(self, tool_callback: Callable):
+    def call_standing_tool_calls(self, tool_callback: Callable, read_only_tools: Optional[Set[Tuple[str, str]]] = None):
         # calls standing tools and concatenates results as a single string
         result_string = ""
         print("Standing tool calls:")
@@ -132,15 +310,22 @@ You must respond in the following JSON format:
         # create assistant message
         messages.append(Message(role="assistant", tool_calls=self.standing_tool_calls))
         tool_results = []
-        for tool_call in self.standing_tool_calls:
-            tool_result = tool_callback(self, tool_call)            
+        for tool_result in self.run_tool_calls(self.standing_tool_calls, tool_callback, read_only_tools):
             if tool_result is not None:
                 tool_results.append(tool_result)
                 messages.append(Message(role="tool", content=tool_result))
         result_string = "\n".join([str(tool_result) + "\n" for tool_result in tool_results]) + "\n"
         return result_string, messages
 
-    def get_pass_summary(self, llm_url: str, response: AgentOutputSchema, standing_tool_results: str):
+    def wait_for_pending_summary(self):
+        """Blocks until a background summary of the previous pass is saved, re-raising its error if it failed"""
+        if self.pending_summary is None:
+            return
+        pending_summary = self.pending_summary
+        self.pending_summary = None
+        pending_summary.result()
+
+    def get_pass_summary(self, llm_url: str, model: str, response: AgentOutputSchema, standing_tool_results: str, token_stats: dict):
         
         last_pass_summary = ""
         if len(self.pass_summaries) > 0:
@@ -151,12 +336,12 @@ You must respond in the following JSON format:
 
         summary_system_prompt = f"""your task is to list the actions taken, list any notes to save for later and summarize what happened in the most recent pass of the agent, then you need to write an instruction for the next pass of the agent.
 
-Agent Context:
-{standing_tool_results}
-
 What follows is the tool calls and results from the latest pass of the agent.
 """
-        summary_user_prompt = f"""Given the following recent agent pass output, and all available context, summarize the pass in the following JSON format:
+        summary_user_prompt = f"""Agent Context:
+{standing_tool_results}
+
+Given the following recent agent pass output, and all available context, summarize the pass in the following JSON format:
 {last_pass_summary}
 
 Most Recent Pass Output:
@@ -169,15 +354,18 @@ You must respond in the following JSON format:
 {AgentSummarySchema.model_json_schema()}
 """
         
-        messages = [Message(role="system", content=summary_system_prompt)]
-        messages.extend(self.latest_post_system_messages)
-        messages.extend(self.message_buffer[-20:])
-        messages.append(Message(role="user", content=summary_user_prompt))
-
+        summary_token_stats = {}
+        token_stats["summary"] = summary_token_stats
+        messages = self.fit_to_context_budget(
+            [Message(role="system", content=summary_system_prompt)] + self.latest_stable_context,
+            self.message_buffer[-20:],
+            self.latest_volatile_context + [Message(role="user", content=summary_user_prompt)],
+            summary_token_stats
+        )
 
         try:    
             self.latest_summary_messages = messages
-            summary_response = call_ollama_chat(llm_url, "llama3.1:8b", messages, AgentSummarySchema.model_json_schema())
+            summary_response = call_ollama_chat(llm_url, model, messages, AgentSummarySchema.model_json_schema(), call_site="summary", usage=summary_token_stats, sticky_key=self.id)
             return AgentSummarySchema.model_validate_json(summary_response)
         except Exception as e:
             print("######################### Summary Messages #########################")
@@ -192,26 +380,57 @@ You must respond in the following JSON format:
             print(f"Stack trace: {traceback.format_exc()}")
             raise e
 
-    def run(self, llm_url: str, model: str, post_system_messages: List[Message], tool_callback: Callable):
+    def run(self, llm_url: str, model: str, post_system_messages: List[Message], tool_callback: Callable, read_only_tools: Optional[Set[Tuple[str, str]]] = None):
         if not self.running:
             print(f"Agent {self.name} is not running")
             return
-        
+        self.model = model
+        self.latest_pass_timings = {}
+        trace = self.current_trace or self.start_trace()
+        try:
+            with self.time_phase("pass"):
+                # the next pass needs the previous summary and notes
+                with self.time_phase("summary_wait"):
+                    self.wait_for_pending_summary()
+                self.latest_pass_timings.update(self.latest_background_timings)
+                self.latest_background_timings = {}
+                self._run_pass(llm_url, model, post_system_messages, tool_callback, read_only_tools)
+        finally:
+            self.current_trace = None
+            trace.release()
+
+    def _run_pass(self, llm_url: str, model: str, post_system_messages: List[Message], tool_callback: Callable, read_only_tools: Optional[Set[Tuple[str, str]]] = None):
         # perform standing tool calls
-        standing_tool_results, standing_tool_messages = self.call_standing_tool_calls(tool_callback)
+        with self.time_phase("standing_tool_calls"):
+            standing_tool_results, standing_tool_messages = self.call_standing_tool_calls(tool_callback, read_only_tools)
 
-        system_prompt = self.get_system_prompt(standing_tool_results)
+        output_schema = self.get_output_schema()
+        system_prompt = self.get_system_prompt(output_schema)
 
-        messages = [Message(role="system", content=system_prompt)]
+        stable_context, volatile_context = self.split_post_system_messages(post_system_messages)
         self.latest_post_system_messages = post_system_messages
-        messages.extend(post_system_messages)
-        messages.extend(self.message_buffer[-20:])
+        self.latest_stable_context = stable_context
+        self.latest_volatile_context = volatile_context
         # messages.extend(standing_tool_messages)
         
+        # stable system prompt and post system messages that have not changed so far, then the message buffer
+        # which only grows at the end between evictions, then everything that changes between passes
+        tail = volatile_context + [self.get_context_message(standing_tool_results)]
         if len(self.pass_summaries) > 0:
             prev_summary = self.pass_summaries[-1]
             prev_summary_string = "Summary of the last pass: " + prev_summary.summary + "\n\n" + "Instructions: " + prev_summary.instructions_for_next_pass
-            messages.append(Message(role="user", content=prev_summary_string))
+            tail.append(Message(role="user", content=prev_summary_string))
+
+        token_stats = {}
+        self.latest_pass_token_stats = token_stats
+        pass_token_stats = {}
+        token_stats["agent_pass"] = pass_token_stats
+        messages = self.fit_to_context_budget(
+            [Message(role="system", content=system_prompt)] + stable_context,
+            self.message_buffer[-20:],
+            tail,
+            pass_token_stats
+        )
         
         """
         print("######################### Message Buffer #########################")
@@ -225,11 +444,15 @@ You must respond in the following JSON format:
 
         retry_count = 0
         while retry_count < 3:
-            response = call_ollama_chat(llm_url, model, messages, AgentOutputSchema.model_json_schema())
+            with self.time_phase("llm", attempt=retry_count + 1) as span_args:
+                response = call_ollama_chat(llm_url, model, messages, output_schema.model_json_schema(), call_site="agent_pass", usage=pass_token_stats, sticky_key=self.id)
+            span_args["prompt_eval_count"] = pass_token_stats.get("prompt_eval_count")
+            span_args["eval_count"] = pass_token_stats.get("eval_count")
             try:
-                response = AgentOutputSchema.model_validate_json(response)
+                response = output_schema.model_validate_json(response)
                 break
             except Exception as e:
+                span_args["error"] = "invalid response"
                 retry_count += 1
                 if retry_count == 3:
                     print(f"Error validating response: {e}")
@@ -244,14 +467,53 @@ You must respond in the following JSON format:
         if not response.should_continue:    
             self.running = False
 
-        self.call_tools(response.tool_calls, tool_callback)
+        with self.time_phase("tools"):
+            self.call_tools(response.tool_calls, tool_callback, read_only_tools)
         
         print("\n\nFull System Prompt:")
         print(system_prompt)
-        summary = self.get_pass_summary(llm_url, response, standing_tool_results)
+
+        if self.summary_mode == "combined":
+            summary = response.pass_summary
+            response = AgentOutputSchema(
+                thoughts=response.thoughts,
+                followup_thoughts=response.followup_thoughts,
+                tool_calls=response.tool_calls,
+                should_continue=response.should_continue
+            )
+            self.latest_summary_messages = []
+            print("\n\nFull Summary:")
+            print(summary.model_dump_json(indent=4))
+            self.save_pass(model, messages, response, summary, self.latest_pass_timings, token_stats, self.current_trace)
+        elif self.summary_mode == "background":
+            if self.summary_executor is None:
+                self.summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{self.name}-summary")
+            timings = {}
+            self.latest_background_timings = timings
+            # the trace is saved once the summary is, after the pass itself returned
+            trace = self.current_trace
+            if trace is not None:
+                trace.hold()
+
+            def summarize_in_background():
+                try:
+                    self.summarize_and_save_pass(llm_url, model, messages, response, standing_tool_results, timings, token_stats, trace)
+                finally:
+                    if trace is not None:
+                        trace.release()
+
+            self.pending_summary = self.summary_executor.submit(summarize_in_background)
+        else:
+            self.summarize_and_save_pass(llm_url, model, messages, response, standing_tool_results, self.latest_pass_timings, token_stats, self.current_trace)
+
+    def summarize_and_save_pass(self, llm_url: str, model: str, messages: List[Message], response: AgentOutputSchema, standing_tool_results: str, timings: dict, token_stats: dict, trace: Optional[PassTrace] = None):
+        with self.time_phase("summary", timings, trace):
+            summary = self.get_pass_summary(llm_url, model, response, standing_tool_results, token_stats)
         print("\n\nFull Summary:")
         print(summary.model_dump_json(indent=4))
+        self.save_pass(model, messages, response, summary, timings, token_stats, trace)
 
+    def save_pass(self, model: str, messages: List[Message], response: AgentOutputSchema, summary: AgentSummarySchema, timings: dict, token_stats: dict, trace: Optional[PassTrace] = None):
         self.pass_number += 1
         self.pass_summaries.append(summary)
         self.notes.extend(summary.notes)
@@ -265,16 +527,20 @@ You must respond in the following JSON format:
             agent_output=response,
             tool_results=self.latest_pass_tool_call_results,
             summary_messages=self.latest_summary_messages,
-            summary_output=summary
+            summary_output=summary,
+            token_stats=token_stats
         )
 
+        if trace is not None:
+            trace.pass_id = agent_run_result.pass_id
+            trace.agent_id = self.id
+            trace.pass_number = agent_run_result.pass_number
+
         # save the agent run result to database
         date_string = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        agent_database = AgentDatabase(self.database_path)
-        agent_database.save_agent(self.id, self.name, self.pass_number, date_string)
-        agent_database.save_agent_run_result(self.id, agent_run_result.pass_id, agent_run_result.pass_number, agent_run_result.model_dump_json(), date_string)
-
-
-        
-        
-        
\ No newline at end of file
+        with self.time_phase("db_write", timings, trace):
+            if self.database_writer is not None:
+                self.database_writer.submit(self.id, self.name, agent_run_result.pass_id, agent_run_result.pass_number, agent_run_result, date_string)
+            else:
+                agent_database = get_agent_database(self.database_path)
+                agent_database.save_pass(self.id, self.name, agent_run_result.pass_id, agent_run_result.pass_number, agent_run_result.model_dump(mode="json"), date_string)
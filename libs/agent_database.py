@@ -1,5 +1,52 @@
+try:
+    from .change_events import create_change_events_table, record_change_event
+    from .run_history_search import create_run_history_fts, index_run_result, extract_search_text, parse_search_terms, to_match_query, make_snippet, MAX_SEARCH_CANDIDATES
+    from .sqlite_pool import sqlite_seconds
+    from .tracing import PassTrace, spans_from_blob
+except ImportError:
+    from change_events import create_change_events_table, record_change_event
+    from run_history_search import create_run_history_fts, index_run_result, extract_search_text, parse_search_terms, to_match_query, make_snippet, MAX_SEARCH_CANDIDATES
+    from sqlite_pool import sqlite_seconds
+    from tracing import PassTrace, spans_from_blob
+from contextlib import contextmanager
 from pydantic import BaseModel
+import traceback
+import threading
+import hashlib
+import atexit
+import queue
 import sqlite3
+import json
+import zlib
+import os
+
+# run result fields holding lists of messages, stored as message blob ids from storage version 2
+MESSAGE_LIST_FIELDS = ["run_messages", "tool_results", "summary_messages"]
+# storage_version 1: agent_run_result is the full JSON. 2: message lists are blob ids into message_blobs
+STORAGE_VERSION = 2
+# blobs at least this large are zlib compressed
+COMPRESS_MIN_BYTES = 512
+# run_id is an explicit rowid alias: a VACUUM may renumber the implicit rowids of a table without one, and the
+# search index and the page cursors refer to rows by rowid
+RUN_RESULTS_COLUMNS = "run_id INTEGER PRIMARY KEY, pass_id TEXT, agent_id TEXT, pass_number INTEGER, agent_run_result TEXT, run_date TEXT, storage_version INTEGER DEFAULT 1"
+
+def project(value, paths):
+    """Keeps the dotted paths (e.g. "agent_output.tool_calls") of a JSON value, lists are projected item by item"""
+    if isinstance(value, list):
+        return [project(item, paths) for item in value]
+    if not isinstance(value, dict):
+        return value
+    children = {}
+    for path in paths:
+        key, _, rest = path.partition(".")
+        children.setdefault(key, []).append(rest)
+    # an empty rest means the whole value under key was asked for
+    return {key: value[key] if "" in children[key] else project(value[key], children[key]) for key in value if key in children}
+
+def parse_cursor(cursor: str):
+    """A page cursor is "pass_number:rowid" of the last row of the previous page"""
+    pass_number, rowid = cursor.split(":")
+    return int(pass_number), int(rowid)
 
 class AgentRunResultsTable(BaseModel):
     pass_id: str
@@ -13,79 +60,594 @@ class AgentTable(BaseModel):
     agent_name: str
     pass_number: int
     last_run_date: str
-    
+
 class AgentDatabase:
+    """
+    Long-lived handle on the agent database, use get_agent_database to share one per file.
+    Each thread gets its own WAL-journaled connection, opened on first use and kept for the life of the thread.
+    """
     def __init__(self, database_path):
         self.database_path = database_path
-        conn = sqlite3.connect(database_path)
-        # create table from AgentRunResultsTable schema
-        # create table
-        conn.execute("CREATE TABLE IF NOT EXISTS agent_run_results (pass_id TEXT, agent_id TEXT, pass_number INTEGER, agent_run_result TEXT, run_date TEXT)")
-        
-        # Create agents table if it doesn't exist
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS agents (
-                agent_id TEXT UNIQUE, 
-                agent_name TEXT, 
-                pass_number INTEGER, 
-                last_run_date TEXT
-            )
-        """)
-
-        # create index on agent_id on both tables
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_agent_id ON agent_run_results (agent_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_agent_id ON agents (agent_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_pass_number ON agents (pass_number)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_run_date ON agent_run_results (run_date)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_last_run_date ON agents (last_run_date)")
-        conn.commit()
-        conn.close()
-
-    def get_agent_run_results(self, agent_id, limit=100, offset=0):
-        conn = sqlite3.connect(self.database_path)
-        cursor = conn.cursor()
-        cursor.execute("""SELECT * FROM agent_run_results 
-                        WHERE agent_run_results.agent_id = ? 
-                        ORDER BY agent_run_results.pass_number DESC
-                        LIMIT ? OFFSET ?""", (agent_id, limit, offset))
-        results = cursor.fetchall()
-        conn.close()
+        self.read_seconds = sqlite_seconds.labels(os.path.basename(database_path), "read")
+        self.write_seconds = sqlite_seconds.labels(os.path.basename(database_path), "write")
+        self.local = threading.local()
+        # thread ident -> connection, so connections of finished threads can be closed
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+        # blob ids known to be committed, saves re-compressing messages that are already stored
+        self.known_blob_ids = {}
+        self.max_known_blob_ids = 10000
+        # ReadOnlyConnectionPool for the read methods, set by the web server
+        self.read_pool = None
+
+        conn = self.get_connection()
+        # WAL lets readers (the web server) run while an agent writes, the setting is stored in the file
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            # create table from AgentRunResultsTable schema
+            # create table
+            conn.execute(f"CREATE TABLE IF NOT EXISTS agent_run_results ({RUN_RESULTS_COLUMNS})")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(agent_run_results)")]
+            if "storage_version" not in columns:
+                conn.execute("ALTER TABLE agent_run_results ADD COLUMN storage_version INTEGER DEFAULT 1")
+        self.add_run_ids(conn)
+        with conn:
+            # messages keyed by the sha256 of their JSON, the sliding message buffer repeats them every pass
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS message_blobs (
+                    blob_id TEXT PRIMARY KEY,
+                    compressed INTEGER,
+                    data BLOB
+                )
+            """)
+
+            # saved passes, for live dashboards
+            create_change_events_table(conn)
+            # full-text index of each pass's thoughts, summary, tool calls and tool results, keyed by rowid
+            create_run_history_fts(conn)
+
+            # spans of each pass as zlib compressed JSON, see libs/tracing.py, duration finds the slowest passes
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pass_traces (
+                    pass_id TEXT PRIMARY KEY,
+                    agent_id TEXT,
+                    pass_number INTEGER,
+                    started_at REAL,
+                    duration REAL,
+                    trace BLOB
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pass_traces_agent_pass ON pass_traces (agent_id, pass_number DESC)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pass_traces_duration ON pass_traces (duration)")
+
+            # Create agents table if it doesn't exist, the UNIQUE constraint indexes agent_id
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS agents (
+                    agent_id TEXT UNIQUE,
+                    agent_name TEXT,
+                    pass_number INTEGER,
+                    last_run_date TEXT
+                )
+            """)
+
+            # idx_agent_id used to be created on both tables, only the agent_run_results one ever existed
+            # and the composite index below covers it
+            conn.execute("DROP INDEX IF EXISTS idx_agent_id")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_agent_run_results_agent_pass ON agent_run_results (agent_id, pass_number DESC)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pass_number ON agents (pass_number)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_run_date ON agent_run_results (run_date)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_agent_run_results_pass_id ON agent_run_results (pass_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_last_run_date ON agents (last_run_date)")
+
+    def add_run_ids(self, conn):
+        """
+        Rebuilds an agent_run_results table from before run_id with the current rowids as run ids, so they
+        can no longer change. The indexes are dropped with the old table and recreated by __init__
+        """
+        if "run_id" in [row[1] for row in conn.execute("PRAGMA table_info(agent_run_results)")]:
+            return
+        # the server and the orchestrator may open the file at once, the check is repeated under the write lock
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            if "run_id" in [row[1] for row in conn.execute("PRAGMA table_info(agent_run_results)")]:
+                return
+            print(f"Adding run ids to agent_run_results of {self.database_path}")
+            conn.execute(f"CREATE TABLE agent_run_results_with_run_id ({RUN_RESULTS_COLUMNS})")
+            conn.execute("""
+                INSERT INTO agent_run_results_with_run_id (run_id, pass_id, agent_id, pass_number, agent_run_result, run_date, storage_version)
+                SELECT rowid, pass_id, agent_id, pass_number, agent_run_result, run_date, storage_version FROM agent_run_results
+            """)
+            conn.execute("DROP TABLE agent_run_results")
+            conn.execute("ALTER TABLE agent_run_results_with_run_id RENAME TO agent_run_results")
+
+    def get_connection(self):
+        conn = getattr(self.local, "connection", None)
+        if conn is not None:
+            return conn
+        # only ever used by this thread, check_same_thread is off so close() can close it from another thread
+        conn = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+        # with WAL, NORMAL only syncs at checkpoints, a power loss can lose the last passes but not corrupt the file
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self.local.connection = conn
+        with self.connections_lock:
+            live_threads = {thread.ident for thread in threading.enumerate()}
+            for thread_ident in [ident for ident in self.connections if ident not in live_threads]:
+                self.connections.pop(thread_ident).close()
+            self.connections[threading.get_ident()] = conn
+        return conn
+
+    @contextmanager
+    def read_connection(self):
+        if self.read_pool is not None:
+            with self.read_pool.connection() as conn:
+                yield conn
+        else:
+            with self.read_seconds.time():
+                yield self.get_connection()
+
+    def close(self):
+        with self.connections_lock:
+            for conn in self.connections.values():
+                conn.close()
+            self.connections = {}
+        self.local = threading.local()
+
+    def get_agent_run_results(self, agent_id, limit=100, offset=0, fields=None):
+        """Rows of (pass_id, agent_id, pass_number, agent_run_result JSON, run_date), newest pass first. fields projects every agent_run_result, see project"""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""SELECT pass_id, agent_id, pass_number, agent_run_result, run_date, storage_version FROM agent_run_results
+                            WHERE agent_run_results.agent_id = ?
+                            ORDER BY agent_run_results.pass_number DESC
+                            LIMIT ? OFFSET ?""", (agent_id, limit, offset))
+            return self.rebuild_rows(conn, cursor.fetchall(), fields)
+
+    def get_agent_run_results_page(self, agent_id, limit=10, cursor=None, fields=None):
+        """
+        Keyset paginated get_agent_run_results, newest pass first. cursor is the next cursor returned with
+        the previous page, None for the first page. fields projects every agent_run_result, see project.
+        Returns the rows and the cursor of the next page, None on the last page
+        """
+        query = "SELECT pass_id, agent_id, pass_number, agent_run_result, run_date, storage_version, rowid FROM agent_run_results WHERE agent_id = ?"
+        params = [agent_id]
+        if cursor is not None:
+            # rowid breaks ties, pass numbers restart when an agent is recreated with the same key
+            query += " AND (pass_number, rowid) < (?, ?)"
+            params.extend(parse_cursor(cursor))
+        query += " ORDER BY pass_number DESC, rowid DESC LIMIT ?"
+        # one row more than the page, a next page exists only if it is there
+        params.append(limit + 1)
+        with self.read_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+            has_next_page = len(rows) > limit
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1][2]}:{rows[-1][6]}" if has_next_page and rows else None
+            return self.rebuild_rows(conn, [row[:6] for row in rows], fields), next_cursor
+
+    def get_agent_run_result(self, pass_id, fields=None):
+        """The row of one pass, or None"""
+        with self.read_connection() as conn:
+            rows = conn.execute("SELECT pass_id, agent_id, pass_number, agent_run_result, run_date, storage_version FROM agent_run_results WHERE pass_id = ?", (pass_id,)).fetchall()
+            rows = self.rebuild_rows(conn, rows, fields)
+        return rows[0] if len(rows) > 0 else None
+
+    def rebuild_rows(self, conn, rows, fields=None):
+        """Drops the trailing storage_version column, rebuilding the full agent_run_result JSON of version 2 rows"""
+        if fields is not None:
+            return self.project_rows(conn, rows, fields)
+        skeletons = {}
+        blob_ids = set()
+        for index, row in enumerate(rows):
+            if row[5] == STORAGE_VERSION:
+                skeleton = json.loads(row[3])
+                skeletons[index] = skeleton
+                for field in MESSAGE_LIST_FIELDS:
+                    blob_ids.update(skeleton.get(field) or [])
+        messages = self.get_messages(conn, blob_ids)
+
+        results = []
+        for index, row in enumerate(rows):
+            agent_run_result = row[3]
+            if index in skeletons:
+                # the stored message JSON is spliced in as text, re-encoding every message dominated reads
+                parts = []
+                for key, value in skeletons[index].items():
+                    if key in MESSAGE_LIST_FIELDS and value is not None:
+                        value_json = "[" + ",".join(messages[blob_id] for blob_id in value) + "]"
+                    else:
+                        value_json = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+                    parts.append(json.dumps(key) + ":" + value_json)
+                agent_run_result = "{" + ",".join(parts) + "}"
+            results.append((row[0], row[1], row[2], agent_run_result, row[4]))
         return results
-    
+
+    def project_rows(self, conn, rows, fields):
+        # only the message lists that are asked for are loaded
+        message_fields = [field for field in MESSAGE_LIST_FIELDS if any(path.partition(".")[0] == field for path in fields)]
+        results = [json.loads(row[3]) for row in rows]
+        blob_ids = set()
+        for row, result in zip(rows, results):
+            if row[5] == STORAGE_VERSION:
+                for field in message_fields:
+                    blob_ids.update(result.get(field) or [])
+        messages = self.get_messages(conn, blob_ids)
+
+        projected_rows = []
+        for row, result in zip(rows, results):
+            if row[5] == STORAGE_VERSION:
+                for field in message_fields:
+                    if result.get(field) is not None:
+                        result[field] = [json.loads(messages[blob_id]) for blob_id in result[field]]
+            projected = json.dumps(project(result, fields), separators=(",", ":"), ensure_ascii=False)
+            projected_rows.append((row[0], row[1], row[2], projected, row[4]))
+        return projected_rows
+
+    def get_messages(self, conn, blob_ids):
+        """blob id -> message JSON text"""
+        blob_ids = list(blob_ids)
+        messages = {}
+        # stay under SQLite's bound parameter limit
+        for start in range(0, len(blob_ids), 500):
+            chunk = blob_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for blob_id, compressed, data in conn.execute(f"SELECT blob_id, compressed, data FROM message_blobs WHERE blob_id IN ({placeholders})", chunk):
+                if compressed:
+                    data = zlib.decompress(data)
+                messages[blob_id] = data.decode("utf-8")
+        return messages
+
+    def put_messages(self, conn, messages):
+        """Stores message dicts that are not stored yet and returns their blob ids in order"""
+        blob_ids = []
+        new_blobs = []
+        for message in messages:
+            data = json.dumps(message, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+            blob_id = hashlib.sha256(data).hexdigest()
+            blob_ids.append(blob_id)
+            if blob_id in self.known_blob_ids:
+                continue
+            compressed = len(data) >= COMPRESS_MIN_BYTES
+            new_blobs.append((blob_id, 1 if compressed else 0, zlib.compress(data) if compressed else data))
+        conn.executemany("INSERT OR IGNORE INTO message_blobs (blob_id, compressed, data) VALUES (?, ?, ?)", new_blobs)
+        return blob_ids, [blob[0] for blob in new_blobs]
+
+    def remember_blob_ids(self, blob_ids):
+        # only called after the transaction that stored them committed
+        for blob_id in blob_ids:
+            self.known_blob_ids[blob_id] = True
+        while len(self.known_blob_ids) > self.max_known_blob_ids:
+            self.known_blob_ids.pop(next(iter(self.known_blob_ids)))
+
+    def to_skeleton(self, conn, agent_run_result: dict):
+        """Stores the message lists of a run result and returns the result JSON with blob ids in their place"""
+        skeleton = dict(agent_run_result)
+        stored_blob_ids = []
+        for field in MESSAGE_LIST_FIELDS:
+            if skeleton.get(field) is not None:
+                skeleton[field], new_blob_ids = self.put_messages(conn, skeleton[field])
+                stored_blob_ids.extend(new_blob_ids)
+        return json.dumps(skeleton, separators=(",", ":"), ensure_ascii=False), stored_blob_ids
+
     def get_agent_list(self):
-        conn = sqlite3.connect(self.database_path)
-        cursor = conn.cursor()
-        # Select all agents, ordered by agent_id
-        cursor.execute("""
-            SELECT * FROM agents 
-            ORDER BY agent_id ASC
-        """)
-        results = cursor.fetchall()
-        conn.close()
-        return results
-    
-    def save_agent_run_result(self, agent_id, pass_id, pass_number, agent_run_result, run_date):
-        conn = sqlite3.connect(self.database_path)
-        conn.execute("INSERT INTO agent_run_results (agent_id, pass_id, pass_number, agent_run_result, run_date) VALUES (?, ?, ?, ?, ?)", (agent_id, pass_id, pass_number, agent_run_result, run_date))
-        conn.commit()
-        conn.close()
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            # Select all agents, ordered by agent_id
+            cursor.execute("""
+                SELECT * FROM agents
+                ORDER BY agent_id ASC
+            """)
+            return cursor.fetchall()
 
-    def save_agent(self, agent_id, agent_name, pass_number, last_run_date):
-        conn = sqlite3.connect(self.database_path)
-        cursor = conn.cursor()
-        
+    def get_agent_version(self, agent_id):
+        """(pass_number, last_run_date) of an agent, it changes in the same transaction as any new pass of the agent"""
+        with self.read_connection() as conn:
+            return conn.execute("SELECT pass_number, last_run_date FROM agents WHERE agent_id = ?", (agent_id,)).fetchone()
+
+    def _insert_agent_run_result(self, conn, agent_id, pass_id, pass_number, agent_run_result, run_date):
+        cursor = conn.execute("INSERT INTO agent_run_results (agent_id, pass_id, pass_number, agent_run_result, run_date) VALUES (?, ?, ?, ?, ?)", (agent_id, pass_id, pass_number, agent_run_result, run_date))
+        index_run_result(conn, cursor.lastrowid, agent_id, json.loads(agent_run_result))
+
+    def _upsert_agent(self, conn, agent_id, agent_name, pass_number, last_run_date):
         # Use UPSERT syntax for cleaner handling of inserts/updates
-        cursor.execute("""
+        conn.execute("""
             INSERT INTO agents (agent_id, agent_name, pass_number, last_run_date)
             VALUES (?, ?, ?, ?)
-            ON CONFLICT(agent_id) 
+            ON CONFLICT(agent_id)
             DO UPDATE SET
                 agent_name = excluded.agent_name,
                 pass_number = excluded.pass_number,
                 last_run_date = excluded.last_run_date
         """, (agent_id, agent_name, pass_number, last_run_date))
-        
-        conn.commit()
-        conn.close()
-        
-        
\ No newline at end of file
+
+    def save_agent_run_result(self, agent_id, pass_id, pass_number, agent_run_result, run_date):
+        # the full JSON string, storage version 1
+        conn = self.get_connection()
+        with conn:
+            self._insert_agent_run_result(conn, agent_id, pass_id, pass_number, agent_run_result, run_date)
+
+    def save_agent(self, agent_id, agent_name, pass_number, last_run_date):
+        conn = self.get_connection()
+        with conn:
+            self._upsert_agent(conn, agent_id, agent_name, pass_number, last_run_date)
+
+    def save_pass(self, agent_id, agent_name, pass_id, pass_number, agent_run_result: dict, run_date):
+        """
+        Saves the agent row and its run result in one transaction. agent_run_result is the
+        AgentRunResult as a JSON-mode dict, its messages go to message_blobs
+        """
+        self.save_passes([(agent_id, agent_name, pass_id, pass_number, agent_run_result, run_date)])
+
+    def save_passes(self, passes):
+        """save_pass for a list of (agent_id, agent_name, pass_id, pass_number, agent_run_result, run_date), one transaction for all"""
+        conn = self.get_connection()
+        stored_blob_ids = []
+        with self.write_seconds.time(), conn:
+            for agent_id, agent_name, pass_id, pass_number, agent_run_result, run_date in passes:
+                self._upsert_agent(conn, agent_id, agent_name, pass_number, run_date)
+                skeleton, new_blob_ids = self.to_skeleton(conn, agent_run_result)
+                stored_blob_ids.extend(new_blob_ids)
+                cursor = conn.execute("INSERT INTO agent_run_results (agent_id, pass_id, pass_number, agent_run_result, run_date, storage_version) VALUES (?, ?, ?, ?, ?, ?)", (agent_id, pass_id, pass_number, skeleton, run_date, STORAGE_VERSION))
+                index_run_result(conn, cursor.lastrowid, agent_id, agent_run_result)
+                summary_output = agent_run_result.get("summary_output") or {}
+                record_change_event(conn, "agent_pass", {"agent_id": agent_id, "agent_name": agent_name, "pass_id": pass_id, "pass_number": pass_number, "run_date": run_date, "summary": summary_output.get("summary")})
+        self.remember_blob_ids(stored_blob_ids)
+
+    def save_traces(self, traces):
+        """Saves finished PassTraces, one transaction for all"""
+        conn = self.get_connection()
+        rows = [(trace.pass_id, trace.agent_id, trace.pass_number, trace.started_at, trace.duration(), trace.to_blob()) for trace in traces]
+        with self.write_seconds.time(), conn:
+            conn.executemany("INSERT OR REPLACE INTO pass_traces (pass_id, agent_id, pass_number, started_at, duration, trace) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def get_pass_traces(self, agent_id=None, pass_id=None, order="recent", limit=20):
+        """
+        Stored traces with their spans, of one pass, of an agent's latest passes, or the latest or slowest
+        ("slowest" order) passes of every agent
+        """
+        sql = """SELECT pass_traces.pass_id, pass_traces.agent_id, agents.agent_name, pass_traces.pass_number,
+                        pass_traces.started_at, pass_traces.duration, pass_traces.trace
+                 FROM pass_traces LEFT JOIN agents ON agents.agent_id = pass_traces.agent_id"""
+        if pass_id is not None:
+            sql += " WHERE pass_traces.pass_id = ?"
+            params = [pass_id]
+        elif agent_id is not None:
+            sql += " WHERE pass_traces.agent_id = ?"
+            params = [agent_id]
+        else:
+            params = []
+        if order == "slowest":
+            sql += " ORDER BY pass_traces.duration DESC"
+        elif agent_id is not None:
+            sql += " ORDER BY pass_traces.pass_number DESC"
+        else:
+            sql += " ORDER BY pass_traces.started_at DESC"
+        sql += " LIMIT ?"
+        params.append(limit)
+        with self.read_connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {"pass_id": row[0], "agent_id": row[1], "agent_name": row[2], "pass_number": row[3], "started_at": row[4], "duration": row[5], "spans": spans_from_blob(row[6])}
+            for row in rows
+        ]
+
+    def migrate_run_results(self, batch_size=200):
+        """Converts storage version 1 rows to message blobs, one transaction per batch. Returns the number of rows migrated"""
+        conn = self.get_connection()
+        migrated = 0
+        while True:
+            rows = conn.execute("SELECT rowid, agent_run_result FROM agent_run_results WHERE storage_version IS NULL OR storage_version = 1 LIMIT ?", (batch_size,)).fetchall()
+            if len(rows) == 0:
+                return migrated
+            stored_blob_ids = []
+            with conn:
+                for rowid, agent_run_result in rows:
+                    skeleton, new_blob_ids = self.to_skeleton(conn, json.loads(agent_run_result))
+                    stored_blob_ids.extend(new_blob_ids)
+                    conn.execute("UPDATE agent_run_results SET agent_run_result = ?, storage_version = ? WHERE rowid = ?", (skeleton, STORAGE_VERSION, rowid))
+            self.remember_blob_ids(stored_blob_ids)
+            migrated += len(rows)
+
+    def index_run_history(self, batch_size=500):
+        """Adds passes saved before the search index existed to it, one transaction per batch. Returns the number indexed"""
+        conn = self.get_connection()
+        indexed = 0
+        last_rowid = 0
+        while True:
+            rows = conn.execute("SELECT rowid, pass_id, agent_id, pass_number, agent_run_result, run_date, storage_version FROM agent_run_results WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, batch_size)).fetchall()
+            if len(rows) == 0:
+                return indexed
+            already_indexed = {row[0] for row in conn.execute("SELECT rowid FROM run_history_fts WHERE rowid BETWEEN ? AND ?", (rows[0][0], rows[-1][0]))}
+            missing = [row for row in rows if row[0] not in already_indexed]
+            with conn:
+                rebuilt = self.rebuild_rows(conn, [row[1:] for row in missing])
+                for row, rebuilt_row in zip(missing, rebuilt):
+                    index_run_result(conn, row[0], row[2], json.loads(rebuilt_row[3]))
+            indexed += len(missing)
+            last_rowid = rows[-1][0]
+
+    def search_run_history(self, query, agent_id=None, limit=20):
+        """
+        Passes whose thoughts, summary, tool calls or tool results contain every word of query, best match first.
+        A trailing * makes a word a prefix. Only the newest MAX_SEARCH_CANDIDATES matching passes are ranked.
+        Each result has the pass id, agent id, pass number, run date, the column the snippet is from and an
+        HTML snippet with the matches in <mark>
+        """
+        terms = parse_search_terms(query)
+        if len(terms) == 0:
+            return []
+        match_query = to_match_query(terms, agent_id)
+        # the index matches agent ids as token phrases, the exact id is checked on the row
+        agent_filter = " AND agent_run_results.agent_id = ?" if agent_id is not None else ""
+        agent_params = [agent_id] if agent_id is not None else []
+        with self.read_connection() as conn:
+            # walking the matches newest first stops after the candidates, ranking then only reads their rowid range
+            oldest_candidate = conn.execute(
+                "SELECT rowid FROM run_history_fts WHERE run_history_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (match_query, MAX_SEARCH_CANDIDATES - 1)
+            ).fetchone()
+            rows = conn.execute(f"""SELECT agent_run_results.pass_id, agent_run_results.agent_id, agent_run_results.pass_number,
+                    agent_run_results.agent_run_result, agent_run_results.run_date, agent_run_results.storage_version
+                FROM run_history_fts JOIN agent_run_results ON agent_run_results.rowid = run_history_fts.rowid
+                WHERE run_history_fts MATCH ? AND run_history_fts.rowid >= ?{agent_filter}
+                ORDER BY bm25(run_history_fts, 0.0, 1.0, 1.0, 1.0, 1.0) LIMIT ?""", [match_query, oldest_candidate[0] if oldest_candidate is not None else 0] + agent_params + [limit]).fetchall()
+            # only the returned passes are loaded, to cut their snippets
+            rows = self.project_rows(conn, rows, ["agent_output", "summary_output", "tool_results"])
+        results = []
+        for pass_id, row_agent_id, pass_number, agent_run_result, run_date in rows:
+            field, snippet = make_snippet(extract_search_text(json.loads(agent_run_result)), terms)
+            results.append({"pass_id": pass_id, "agent_id": row_agent_id, "pass_number": pass_number, "run_date": run_date, "field": field, "snippet": snippet})
+        return results
+
+class AgentDatabaseWriter:
+    """
+    Write-behind queue for save_pass. Passes from every agent are queued and written by one writer thread,
+    all passes waiting when it gets to them in one transaction, so agent threads do not wait on SQLite.
+
+    The queue holds at most max_queue_size passes, submit blocks when it is full. Queued passes are lost
+    if the process is killed, flush() waits until everything submitted so far is committed and runs at exit.
+    durability is the synchronous setting of the writer's connection: "normal" can lose the last commits
+    on power loss, "full" syncs every commit to disk.
+    """
+    def __init__(self, agent_database: AgentDatabase, max_queue_size: int = 256, max_batch_size: int = 64, durability: str = "normal"):
+        if durability not in ["normal", "full"]:
+            raise ValueError(f"Unknown durability {durability}")
+        self.agent_database = agent_database
+        self.max_batch_size = max_batch_size
+        self.durability = durability
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"submitted": 0, "written": 0, "failed": 0, "batches": 0, "queue_full": 0}
+        atexit.register(self.stop)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.write_loop, name="agent-database-writer", daemon=True)
+                self.thread.start()
+
+    def submit_trace(self, trace: PassTrace):
+        """Queues a finished PassTrace, saved with the next batch of passes"""
+        self.start()
+        self.queue.put(trace)
+
+    def submit(self, agent_id, agent_name, pass_id, pass_number, agent_run_result, run_date):
+        """Queues a save_pass. agent_run_result is a dict or a pydantic model, dumped on the writer thread"""
+        self.start()
+        item = (agent_id, agent_name, pass_id, pass_number, agent_run_result, run_date)
+        with self.lock:
+            self.stats["submitted"] += 1
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.stats["queue_full"] += 1
+            print(f"Agent database writer: queue full ({self.queue.maxsize} passes), waiting for the writer")
+            self.queue.put(item)
+
+    def write_loop(self):
+        conn = self.agent_database.get_connection()
+        conn.execute(f"PRAGMA synchronous={self.durability.upper()}")
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            while item is not None and len(batch) < self.max_batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            passes = [entry for entry in batch if entry is not None and not isinstance(entry, PassTrace)]
+            traces = [entry for entry in batch if isinstance(entry, PassTrace)]
+            try:
+                self.write(passes)
+                self.write_traces(traces)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if None in batch:
+                return
+
+    def to_dict(self, entry):
+        agent_id, agent_name, pass_id, pass_number, agent_run_result, run_date = entry
+        if isinstance(agent_run_result, BaseModel):
+            agent_run_result = agent_run_result.model_dump(mode="json")
+        return (agent_id, agent_name, pass_id, pass_number, agent_run_result, run_date)
+
+    def write(self, passes):
+        if len(passes) == 0:
+            return
+        try:
+            self.agent_database.save_passes([self.to_dict(entry) for entry in passes])
+            written, failed = len(passes), 0
+        except Exception as e:
+            # retry one at a time so a single bad pass does not lose the rest of the batch
+            print(f"Agent database writer: batch of {len(passes)} failed: {e}")
+            written, failed = 0, 0
+            for entry in passes:
+                try:
+                    self.agent_database.save_passes([self.to_dict(entry)])
+                    written += 1
+                except Exception:
+                    failed += 1
+                    print(f"Agent database writer: dropping pass {entry[2]} of agent {entry[0]}")
+                    print(f"Stack trace: {traceback.format_exc()}")
+        with self.lock:
+            self.stats["batches"] += 1
+            self.stats["written"] += written
+            self.stats["failed"] += failed
+
+    def write_traces(self, traces):
+        if len(traces) == 0:
+            return
+        try:
+            self.agent_database.save_traces(traces)
+        except Exception as e:
+            # traces are diagnostics, losing one must not stop the passes
+            print(f"Agent database writer: dropping {len(traces)} pass traces: {e}")
+
+    def flush(self):
+        """Blocks until every pass submitted so far is committed"""
+        if self.thread is not None:
+            self.queue.join()
+
+    def stop(self):
+        """Flushes and stops the writer thread, later submits start a new one"""
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is None:
+            return
+        self.queue.put(None)
+        thread.join()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats["queued"] = self.queue.qsize()
+        return stats
+
+agent_databases = {}
+agent_database_writers = {}
+agent_databases_lock = threading.Lock()
+
+def get_agent_database(database_path) -> AgentDatabase:
+    """Returns the process-wide AgentDatabase for database_path, creating it and its schema on first use"""
+    key = os.path.abspath(database_path)
+    with agent_databases_lock:
+        agent_database = agent_databases.get(key)
+        if agent_database is None:
+            agent_database = AgentDatabase(database_path)
+            agent_databases[key] = agent_database
+        return agent_database
+
+def get_agent_database_writer(database_path, **kwargs) -> AgentDatabaseWriter:
+    """Returns the process-wide AgentDatabaseWriter for database_path, kwargs are only used when it is created"""
+    agent_database = get_agent_database(database_path)
+    key = os.path.abspath(database_path)
+    with agent_databases_lock:
+        writer = agent_database_writers.get(key)
+        if writer is None:
+            writer = AgentDatabaseWriter(agent_database, **kwargs)
+            agent_database_writers[key] = writer
+        return writer
@@ -169,6 +169,9 @@ class AppManager:
     def get_tool_schemas(self):
         return [tool_schema.model_dump_json() for tool_schema in self.self_tool_schemas]
     
+    def get_read_only_tools(self):
+        return ["list_apps", "get_loaded_apps", "get_app_tool_list"]
+    
     def agent_tool_callback(self, agent: Agent, tool_call: ToolCall):
         if tool_call.toolset_id != "app_manager":
             return f"Tool {tool_call.name} not found"
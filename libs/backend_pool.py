@@ -0,0 +1,205 @@
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from collections import deque
+import threading
+import httpx
+import time
+
+class BackendUnavailableError(Exception):
+    pass
+
+class Backend:
+    def __init__(self, url: str, max_concurrency: int):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        # circuit breaker: "closed" takes requests, "open" takes none until the recovery timeout,
+        # "half_open" takes a single trial request that decides between the two
+        self.circuit = "closed"
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+
+class BackendPool:
+    """
+    Spreads LLM requests over several Ollama servers. Requests go to the available backend with the
+    fewest outstanding requests, each backend takes at most max_concurrency requests at once and callers
+    wait for a free slot. A sticky key (an agent id) keeps going to the backend it was first given while
+    that backend is available, so the agent's prompt prefix stays in that backend's KV cache.
+
+    Backends that fail failure_threshold requests in a row are taken out for recovery_timeout seconds,
+    then get one trial request. Health probes on /api/version run every health_check_interval seconds
+    once start_health_checks is called.
+    """
+    def __init__(self, urls: List[str], max_concurrency: int = 4, failure_threshold: int = 3, recovery_timeout: float = 30.0, health_check_interval: float = 10.0, acquire_timeout: float = 300.0):
+        if len(urls) == 0:
+            raise ValueError("BackendPool needs at least one url")
+        self.backends = [Backend(url.rstrip("/"), max_concurrency) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.sticky_backends: Dict[str, Backend] = {}
+        # callers waiting for a backend, served in arrival order so a releasing caller cannot jump the queue
+        self.waiters = deque()
+        self.condition = threading.Condition()
+        self.health_check_thread = None
+        self.stop_event = threading.Event()
+        self.probe_client = httpx.Client(timeout=5.0)
+
+    def __repr__(self):
+        return f"BackendPool({[backend.url for backend in self.backends]})"
+
+    def is_available(self, backend: Backend):
+        """Whether the backend may take a request, ignoring its concurrency cap"""
+        if not backend.healthy:
+            return False
+        if backend.circuit == "open":
+            if time.monotonic() - backend.opened_at < self.recovery_timeout:
+                return False
+            backend.circuit = "half_open"
+        if backend.circuit == "half_open":
+            return backend.outstanding == 0
+        return True
+
+    def get_sticky_counts(self):
+        sticky_counts = {}
+        for backend in self.sticky_backends.values():
+            sticky_counts[backend.url] = sticky_counts.get(backend.url, 0) + 1
+        return sticky_counts
+
+    def select_backend(self, sticky_key: Optional[str]):
+        sticky_backend = self.sticky_backends.get(sticky_key) if sticky_key is not None else None
+        if sticky_backend is not None and self.is_available(sticky_backend):
+            # keys moved away from a failed backend come back one at a time once it recovers
+            sticky_counts = self.get_sticky_counts()
+            available = [backend for backend in self.backends if self.is_available(backend)]
+            least_sticky = min(available, key=lambda backend: sticky_counts.get(backend.url, 0))
+            if sticky_counts.get(sticky_backend.url, 0) - sticky_counts.get(least_sticky.url, 0) > 1:
+                print(f"Backend pool: rebalancing {sticky_key[:8]} from {sticky_backend.url} to {least_sticky.url}")
+                sticky_backend = least_sticky
+                self.sticky_backends[sticky_key] = sticky_backend
+            # wait for the sticky backend rather than moving the agent away from its cached prompt
+            return sticky_backend if sticky_backend.outstanding < sticky_backend.max_concurrency else None
+
+        candidates = [backend for backend in self.backends if self.is_available(backend) and backend.outstanding < backend.max_concurrency]
+        if len(candidates) == 0:
+            return None
+        sticky_counts = self.get_sticky_counts()
+        # least outstanding requests, ties go to the backend with fewest sticky keys
+        backend = min(candidates, key=lambda candidate: (candidate.outstanding / candidate.max_concurrency, sticky_counts.get(candidate.url, 0)))
+        if sticky_key is not None:
+            if sticky_backend is not None:
+                print(f"Backend pool: moving {sticky_key[:8]} from unavailable {sticky_backend.url} to {backend.url}")
+            self.sticky_backends[sticky_key] = backend
+        return backend
+
+    def dispatch(self):
+        """Hands free backends to waiting callers, oldest first. A caller whose backend is busy does not block later ones"""
+        for waiter in list(self.waiters):
+            backend = self.select_backend(waiter["sticky_key"])
+            if backend is not None:
+                backend.outstanding += 1
+                waiter["backend"] = backend
+                self.waiters.remove(waiter)
+        self.condition.notify_all()
+
+    def acquire(self, sticky_key: Optional[str] = None) -> Backend:
+        deadline = time.monotonic() + self.acquire_timeout
+        waiter = {"sticky_key": sticky_key, "backend": None}
+        with self.condition:
+            self.waiters.append(waiter)
+            self.dispatch()
+            while waiter["backend"] is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.waiters.remove(waiter)
+                    raise BackendUnavailableError(f"No backend available after {self.acquire_timeout}s: {self.get_stats()}")
+                # wake up periodically, open circuits become available without a release
+                if not self.condition.wait(timeout=min(remaining, 1.0)):
+                    self.dispatch()
+            return waiter["backend"]
+
+    def release(self, backend: Backend, success: bool, seconds: float):
+        with self.condition:
+            backend.outstanding -= 1
+            backend.requests += 1
+            backend.total_seconds += seconds
+            if success:
+                backend.consecutive_failures = 0
+                backend.circuit = "closed"
+            else:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.circuit == "half_open" or backend.consecutive_failures >= self.failure_threshold:
+                    if backend.circuit != "open":
+                        print(f"Backend pool: opening circuit for {backend.url} after {backend.consecutive_failures} failures")
+                    backend.circuit = "open"
+                    backend.opened_at = time.monotonic()
+            self.dispatch()
+
+    @contextmanager
+    def lease(self, sticky_key: Optional[str] = None):
+        """Yields the url of a backend for one request, the request fails if the block raises"""
+        backend = self.acquire(sticky_key)
+        start = time.monotonic()
+        success = False
+        try:
+            yield backend.url
+            success = True
+        except Exception as error:
+            # client errors such as an unknown model are not the backend's fault
+            status_code = getattr(error, "status_code", None)
+            success = status_code is not None and status_code < 500
+            raise
+        finally:
+            self.release(backend, success, time.monotonic() - start)
+
+    def check_health(self):
+        for backend in self.backends:
+            try:
+                healthy = self.probe_client.get(backend.url + "/api/version").status_code == 200
+            except httpx.HTTPError:
+                healthy = False
+            with self.condition:
+                if healthy != backend.healthy:
+                    print(f"Backend pool: {backend.url} is {'healthy' if healthy else 'unhealthy'}")
+                backend.healthy = healthy
+                self.dispatch()
+
+    def health_check_loop(self):
+        while not self.stop_event.wait(self.health_check_interval):
+            self.check_health()
+
+    def start_health_checks(self):
+        if self.health_check_thread is not None:
+            return
+        self.stop_event.clear()
+        self.health_check_thread = threading.Thread(target=self.health_check_loop, name="backend-health", daemon=True)
+        self.health_check_thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.health_check_thread is not None:
+            self.health_check_thread.join()
+            self.health_check_thread = None
+        self.probe_client.close()
+
+    def get_stats(self):
+        with self.condition:
+            return [
+                {
+                    "url": backend.url,
+                    "healthy": backend.healthy,
+                    "circuit": backend.circuit,
+                    "outstanding": backend.outstanding,
+                    "requests": backend.requests,
+                    "failures": backend.failures,
+                    "mean_seconds": backend.total_seconds / backend.requests if backend.requests > 0 else 0.0,
+                    "sticky_keys": sum(1 for sticky_backend in self.sticky_backends.values() if sticky_backend is backend)
+                }
+                for backend in self.backends
+            ]
@@ -0,0 +1,135 @@
+from typing import Dict, List, Optional
+import threading
+import sqlite3
+import queue
+import json
+import time
+import os
+
+# events kept per database, older ones are deleted as new ones are written
+MAX_CHANGE_EVENTS = 10000
+
+def create_change_events_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT,
+            payload TEXT,
+            created_at REAL
+        )
+    """)
+
+def record_change_event(conn, topic: str, payload: dict):
+    """Adds an event in the caller's transaction, so readers see it exactly when the change commits"""
+    cursor = conn.execute("INSERT INTO change_events (topic, payload, created_at) VALUES (?, ?, ?)", (topic, json.dumps(payload), time.time()))
+    if cursor.lastrowid % 500 == 0:
+        conn.execute("DELETE FROM change_events WHERE event_id <= ?", (cursor.lastrowid - MAX_CHANGE_EVENTS,))
+
+class ChangeFeed:
+    """
+    Tails the change_events tables of several databases, written by any process, and hands new events to
+    subscribers. One thread checks PRAGMA data_version every poll_interval, which only changes when another
+    connection commits, so the tables are only read when something was written.
+    """
+    def __init__(self, database_paths: Dict[str, str], poll_interval: float = 0.25, max_queue_size: int = 1000):
+        # source name -> database path
+        self.database_paths = database_paths
+        self.poll_interval = poll_interval
+        self.max_queue_size = max_queue_size
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def subscribe(self, topics: Optional[List[str]] = None):
+        """Returns a queue of events, None is put on it when the subscriber fell too far behind and was dropped"""
+        self.start()
+        subscriber = {"queue": queue.Queue(maxsize=self.max_queue_size), "topics": set(topics) if topics else None}
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber["queue"]
+
+    def unsubscribe(self, subscriber_queue):
+        with self.lock:
+            self.subscribers = [subscriber for subscriber in self.subscribers if subscriber["queue"] is not subscriber_queue]
+
+    def publish(self, event: dict):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            if subscriber["topics"] is not None and event["topic"] not in subscriber["topics"]:
+                continue
+            try:
+                subscriber["queue"].put_nowait(event)
+            except queue.Full:
+                # a stalled client reconnects and reloads rather than holding events forever
+                self.unsubscribe(subscriber["queue"])
+                try:
+                    subscriber["queue"].get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber["queue"].put_nowait(None)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.poll_loop, name="change-feed", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            thread.join()
+
+    def poll_loop(self):
+        # source -> {"conn", "inode", "data_version", "last_event_id"}
+        sources = {}
+        while not self.stop_event.is_set():
+            for source, database_path in self.database_paths.items():
+                try:
+                    self.poll_source(sources, source, database_path)
+                except sqlite3.Error as e:
+                    # the database or its change_events table may not exist yet
+                    state = sources.pop(source, None)
+                    if state is not None:
+                        print(f"Change feed: lost {source}: {e}")
+                        state["conn"].close()
+            self.stop_event.wait(self.poll_interval)
+        for state in sources.values():
+            state["conn"].close()
+
+    def poll_source(self, sources, source, database_path):
+        state = sources.get(source)
+        inode = os.stat(database_path).st_ino if os.path.exists(database_path) else None
+        if state is not None and state["inode"] != inode:
+            # the file was deleted or replaced, e.g. by reset.py, the open connection still reads the old one
+            sources.pop(source)["conn"].close()
+            state = None
+        if state is None:
+            if inode is None:
+                return
+            conn = sqlite3.connect(database_path, timeout=5)
+            try:
+                # events written before the feed started are not replayed
+                last_event_id = conn.execute("SELECT COALESCE(MAX(event_id), 0) FROM change_events").fetchone()[0]
+            except sqlite3.Error:
+                conn.close()
+                raise
+            state = {"conn": conn, "inode": inode, "data_version": None, "last_event_id": last_event_id}
+            sources[source] = state
+
+        conn = state["conn"]
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == state["data_version"]:
+            return
+        state["data_version"] = data_version
+        rows = conn.execute("SELECT event_id, topic, payload FROM change_events WHERE event_id > ? ORDER BY event_id", (state["last_event_id"],)).fetchall()
+        for event_id, topic, payload in rows:
+            self.publish({"source": source, "event_id": event_id, "topic": topic, "payload": json.loads(payload)})
+        if len(rows) > 0:
+            state["last_event_id"] = rows[-1][0]
@@ -1,36 +1,210 @@
 from ollama import Client
+import httpx
+import atexit
+import threading
 import random
-from pydantic import BaseModel
+import time
+from pydantic import BaseModel, ConfigDict
+from contextlib import contextmanager
 from markitdown import MarkItDown
 import semchunk
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
+from io import StringIO
 import difflib
+import sys
 import base64
 import re
 import traceback
+try:
+    from .token_estimator import token_estimator, DEFAULT_OUTPUT_TOKENS
+    from .backend_pool import BackendPool
+    from .metrics import metrics
+except ImportError:
+    from token_estimator import token_estimator, DEFAULT_OUTPUT_TOKENS
+    from backend_pool import BackendPool
+    from metrics import metrics
 
-def call_ollama_chat(server_url, model, messages, json_schema=None, temperature=None, tools=None):
+class OllamaClientPool:
+    """
+    Process-wide ollama clients, one per server url. Each client keeps up to pool_size keep-alive
+    HTTP connections to its server, so calls reuse sockets instead of reconnecting every time.
+    The connections belong to an httpx transport the pool creates and closes, ollama.Client has no close()
+    """
+    def __init__(self, pool_size: int = 16, keepalive_expiry: float = 300.0):
+        self.pool_size = pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.clients = {}
+        # server url -> the httpx transport holding the connections of its client
+        self.transports = {}
+        self.lock = threading.Lock()
+
+    def configure(self, pool_size: Optional[int] = None, keepalive_expiry: Optional[float] = None):
+        # existing clients are closed so the next call picks up the new limits
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if keepalive_expiry is not None:
+            self.keepalive_expiry = keepalive_expiry
+        self.close()
+
+    def get_client(self, server_url: str) -> Client:
+        client = self.clients.get(server_url)
+        if client is not None:
+            return client
+        with self.lock:
+            client = self.clients.get(server_url)
+            if client is None:
+                transport = httpx.HTTPTransport(
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                        keepalive_expiry=self.keepalive_expiry
+                    )
+                )
+                # keyword arguments of ollama.Client are passed on to its httpx client
+                client = Client(host=server_url, transport=transport)
+                self.transports[server_url] = transport
+                self.clients[server_url] = client
+            return client
+
+    def close(self):
+        with self.lock:
+            transports = list(self.transports.values())
+            self.clients = {}
+            self.transports = {}
+        for transport in transports:
+            transport.close()
+
+ollama_client_pool = OllamaClientPool()
+atexit.register(ollama_client_pool.close)
+
+DEFAULT_CHAT_MODEL = "huggingface.co/bartowski/Qwen2.5-14B-Instruct-1M-GGUF"
+#DEFAULT_CHAT_MODEL = "huggingface.co/unsloth/DeepSeek-R1-Distill-Qwen-14B-GGUF:Q8_0"
+#DEFAULT_CHAT_MODEL = "MFDoom/deepseek-r1-tool-calling:14b"
+DEFAULT_EMBEDDING_MODEL = "nomic-embed-text"
+# how long ollama keeps a model and its prompt cache loaded after a request, the default 5m unloads it between slow passes
+DEFAULT_KEEP_ALIVE = "1h"
+
+class ModelRoute(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    model: str
+    server_url: Optional[Union[str, BackendPool]] = None # None keeps the server url the caller passed
+
+class ModelRouter:
+    """
+    Maps LLM call sites to a model and server, so cheap calls can go to a small fast model.
+    Call sites: agent_pass, summary, quest_generation, persona_creation, embedding.
+    A routed call site uses its route, otherwise the caller's model, otherwise the default model.
+    """
+    def __init__(self):
+        self.routes: Dict[str, ModelRoute] = {}
+        self.latency_stats = {} # model -> {"calls": int, "total_seconds": float}
+        # call site -> model its latest call went to, a line is printed when it changes
+        self.last_models = {}
+        # prints every call's latency as well, per-call latency is in the polis_llm_call_seconds metric
+        self.debug = False
+        self.lock = threading.Lock()
+
+    def set_route(self, call_site: str, model: str, server_url: Optional[Union[str, BackendPool]] = None):
+        self.routes[call_site] = ModelRoute(model=model, server_url=server_url)
+
+    def remove_route(self, call_site: str):
+        self.routes.pop(call_site, None)
+
+    def resolve(self, call_site: Optional[str], server_url, model: Optional[str], default_model: str = DEFAULT_CHAT_MODEL):
+        route = self.routes.get(call_site) if call_site is not None else None
+        if route is not None:
+            model = route.model
+            if route.server_url is not None:
+                server_url = route.server_url
+        if model is None:
+            model = default_model
+        return server_url, model
+
+    def record_latency(self, call_site: Optional[str], model: str, server_url, seconds: float):
+        with self.lock:
+            stats = self.latency_stats.setdefault(model, {"calls": 0, "total_seconds": 0.0})
+            stats["calls"] += 1
+            stats["total_seconds"] += seconds
+            mean_seconds = stats["total_seconds"] / stats["calls"]
+            route_changed = self.last_models.get(call_site) != model
+            self.last_models[call_site] = model
+        if route_changed or self.debug:
+            print(f"LLM route: {call_site} -> {model} @ {server_url} took {seconds:.2f}s (model mean {mean_seconds:.2f}s over {stats['calls']} calls)")
+
+    def get_latency_stats(self):
+        with self.lock:
+            return {
+                model: {"calls": stats["calls"], "mean_seconds": stats["total_seconds"] / stats["calls"]}
+                for model, stats in self.latency_stats.items()
+            }
+
+model_router = ModelRouter()
+
+llm_call_seconds = metrics.histogram("polis_llm_call_seconds", "Seconds per LLM chat or embedding request, after a backend was leased", ["call_site", "model"])
+llm_tokens = metrics.counter("polis_llm_tokens_total", "Tokens of LLM chat requests, kind is prompt_evaluated, cached_prefix or output", ["call_site", "model", "kind"])
+llm_errors = metrics.counter("polis_llm_errors_total", "LLM chat requests that raised", ["call_site"])
+
+@contextmanager
+def lease_server_url(server_url, sticky_key: Optional[str] = None):
+    """server_url is a url or a BackendPool, yields the url to send one request to"""
+    if isinstance(server_url, BackendPool):
+        with server_url.lease(sticky_key) as url:
+            yield url
+    else:
+        yield server_url
+
+def call_ollama_chat(server_url, model, messages, json_schema=None, temperature=None, tools=None, call_site=None, usage=None, max_output_tokens=DEFAULT_OUTPUT_TOKENS, keep_alive=DEFAULT_KEEP_ALIVE, sticky_key=None):
+    """
+    server_url is a url or a BackendPool, sticky_key (an agent id) keeps a caller on the same pool backend.
+
+    usage, when given a dict, is filled with the response metadata of the call: estimated_prompt_tokens,
+    num_ctx, prompt_eval_count, eval_count, prompt_eval_seconds, load_seconds and estimated_cached_prefix_tokens.
+    ollama only evaluates the prompt tokens after the cached prefix, so the cached prefix is the estimated prompt
+    size minus prompt_eval_count
+    """
     try:
-        client = Client(
-            host=server_url
-        )
-        
-        response = client.chat(
-            #model='huggingface.co/unsloth/DeepSeek-R1-Distill-Qwen-14B-GGUF:Q8_0', 
-            #model='MFDoom/deepseek-r1-tool-calling:14b',
-            model='huggingface.co/bartowski/Qwen2.5-14B-Instruct-1M-GGUF',
-            stream=False,
-            messages=[m.chat_ml() for m in messages],
-            format=json_schema,
-            tools=tools,
-            options={
-                'num_ctx':100000,
-                'seed': random.randint(0, 1000000)
-            })
+        server_url, model = model_router.resolve(call_site, server_url, model)
+
+        estimated_prompt_tokens = token_estimator.estimate_messages(messages)
+
+        with lease_server_url(server_url, sticky_key) as backend_url:
+            # size the context to the prompt, a larger num_ctx makes ollama allocate a larger KV cache. The size
+            # only grows per backend and model, a different num_ctx than the loaded one makes ollama reload
+            context_key = (backend_url, model)
+            num_ctx = token_estimator.context_size(estimated_prompt_tokens, max_output_tokens, context_key)
+            client = ollama_client_pool.get_client(backend_url)
+            start = time.perf_counter()
+            response = client.chat(
+                model=model,
+                stream=False,
+                messages=[m.chat_ml() for m in messages],
+                format=json_schema,
+                tools=tools,
+                keep_alive=keep_alive,
+                options={
+                    'num_ctx': num_ctx,
+                    'seed': random.randint(0, 1000000)
+                })
+        seconds = time.perf_counter() - start
+        model_router.record_latency(call_site, model, backend_url, seconds)
+        token_estimator.calibrate(messages, response.prompt_eval_count, num_ctx, context_key)
+        llm_call_seconds.labels(call_site, model).observe(seconds)
+        llm_tokens.labels(call_site, model, "prompt_evaluated").inc(response.prompt_eval_count or 0)
+        llm_tokens.labels(call_site, model, "cached_prefix").inc(max(0, estimated_prompt_tokens - (response.prompt_eval_count or 0)))
+        llm_tokens.labels(call_site, model, "output").inc(response.eval_count or 0)
+        if usage is not None:
+            usage["estimated_prompt_tokens"] = estimated_prompt_tokens
+            usage["num_ctx"] = num_ctx
+            usage["prompt_eval_count"] = response.prompt_eval_count
+            usage["eval_count"] = response.eval_count
+            usage["prompt_eval_seconds"] = (response.prompt_eval_duration or 0) / 1e9
+            usage["load_seconds"] = (response.load_duration or 0) / 1e9
+            usage["estimated_cached_prefix_tokens"] = max(0, estimated_prompt_tokens - (response.prompt_eval_count or 0))
 
         return response.message.content
 
     except Exception as error:
+        llm_errors.labels(call_site).inc()
         print("~~~~~~~~~~~~~~~~~~~~~~~")
         print("Error")
         print(error)
@@ -39,15 +213,20 @@ def call_ollama_chat(server_url, model, messages, json_schema=None, temperature=
         print("~~~~~~~~~~~~~~~~~~~~~~~")
         return error
     
-def embed_with_ollama(server_url, text, model="nomic-embed-text"):
-    client = Client(
-        host=server_url
-    )
+def embed_with_ollama(server_url, text, model=DEFAULT_EMBEDDING_MODEL, call_site="embedding", sticky_key=None):
+    server_url, model = model_router.resolve(call_site, server_url, model, DEFAULT_EMBEDDING_MODEL)
 
-    results = client.embed(
-        model=model,
-        input=text
-    )
+    with lease_server_url(server_url, sticky_key) as backend_url:
+        client = ollama_client_pool.get_client(backend_url)
+        start = time.perf_counter()
+        results = client.embed(
+            model=model,
+            input=text,
+            keep_alive=DEFAULT_KEEP_ALIVE
+        )
+    seconds = time.perf_counter() - start
+    model_router.record_latency(call_site, model, backend_url, seconds)
+    llm_call_seconds.labels(call_site, model).observe(seconds)
 
     return results["embeddings"][0]
 
@@ -119,6 +298,54 @@ class MultiWriter:
         for file in self.files:
             file.flush()
 
+class ThreadCapturingWriter:
+    """
+    Stands in for sys.stdout or sys.stderr. A thread inside capture_thread_output writes to its own buffer
+    and every other thread to the wrapped stream, so agents running at once keep their prints out of each
+    other's captured code output
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is not None:
+            return buffer.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        # encoding, isatty, fileno... of the wrapped stream
+        return getattr(self.stream, name)
+
+thread_capture_lock = threading.Lock()
+
+def install_thread_output_capture():
+    """Wraps sys.stdout and sys.stderr in ThreadCapturingWriters unless they already are, returns the two writers"""
+    with thread_capture_lock:
+        if not isinstance(sys.stdout, ThreadCapturingWriter):
+            sys.stdout = ThreadCapturingWriter(sys.stdout)
+        if not isinstance(sys.stderr, ThreadCapturingWriter):
+            sys.stderr = ThreadCapturingWriter(sys.stderr)
+        return sys.stdout, sys.stderr
+
+@contextmanager
+def capture_thread_output():
+    """Yields stdout and stderr StringIOs that receive what this thread prints in the with block, other threads are unaffected"""
+    stdout_writer, stderr_writer = install_thread_output_capture()
+    stdout, stderr = StringIO(), StringIO()
+    previous = getattr(stdout_writer.local, "buffer", None), getattr(stderr_writer.local, "buffer", None)
+    stdout_writer.local.buffer = stdout
+    stderr_writer.local.buffer = stderr
+    try:
+        yield stdout, stderr
+    finally:
+        stdout_writer.local.buffer, stderr_writer.local.buffer = previous
+
 def is_base64(string):
     """
     Check if a string is base64 encoded by looking at:
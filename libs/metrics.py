@@ -0,0 +1,227 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, List, Optional, Sequence
+import threading
+import bisect
+import time
+import math
+
+# seconds, from a fast SQLite read to a slow LLM call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# label sets per metric, later ones are counted under "other" so a model inventing tool names cannot grow memory
+MAX_LABEL_SETS = 1000
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+class CounterChild:
+    def __init__(self, lock: threading.Lock):
+        self.lock = lock
+        self.value = 0.0
+        self.function = None
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def set_function(self, function: Callable[[], float]):
+        """The value is read from function() whenever it is scraped, for counts another object already keeps"""
+        self.function = function
+
+    def samples(self, name: str, labels: str):
+        value = self.function() if self.function is not None else self.value
+        return [f"{name}{labels} {format_value(float(value))}"]
+
+class GaugeChild(CounterChild):
+    def set(self, value: float):
+        with self.lock:
+            self.value = value
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+class Timer:
+    """Observes the seconds its with block took, a class rather than a contextmanager generator to stay cheap"""
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class HistogramChild:
+    def __init__(self, lock: threading.Lock, buckets: Sequence[float]):
+        self.lock = lock
+        self.buckets = buckets
+        # observations per bucket, not cumulative, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> Timer:
+        return Timer(self)
+
+    def samples(self, name: str, labels: str):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        # le goes after the other labels
+        prefix = labels[:-1] + "," if labels else "{"
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + [math.inf], counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{prefix}le="{format_value(bound)}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {format_value(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+class Metric:
+    """A named metric with one child per set of label values, see MetricsRegistry"""
+    def __init__(self, metric_type: str, name: str, help_text: str, label_names: Sequence[str], make_child: Callable):
+        self.metric_type = metric_type
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.make_child = make_child
+        # label values tuple -> child, children share the metric's lock
+        self.children = {}
+        # the same children by the values as passed, e.g. a status code int, so labels() skips converting them
+        self.lookup = {}
+        self.lock = threading.Lock()
+        if len(self.label_names) == 0:
+            self.default_child = self.labels()
+
+    def labels(self, *values):
+        child = self.lookup.get(values)
+        if child is not None:
+            return child
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} has labels {self.label_names}, got {values}")
+        label_values = tuple(str(value) for value in values)
+        with self.lock:
+            child = self.children.get(label_values)
+            if child is None:
+                if len(self.children) >= MAX_LABEL_SETS:
+                    return self.children.setdefault(("other",) * len(values), self.make_child(self.lock))
+                child = self.make_child(self.lock)
+                self.children[label_values] = child
+            self.lookup[values] = child
+            return child
+
+    # metrics without labels are used directly
+    def inc(self, amount: float = 1.0):
+        self.default_child.inc(amount)
+
+    def set(self, value: float):
+        self.default_child.set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self.default_child.set_function(function)
+
+    def observe(self, value: float):
+        self.default_child.observe(value)
+
+    def time(self):
+        return self.default_child.time()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        with self.lock:
+            children = list(self.children.items())
+        for values, child in children:
+            labels = ""
+            if len(values) > 0:
+                labels = "{" + ",".join(f'{label_name}="{escape_label_value(value)}"' for label_name, value in zip(self.label_names, values)) + "}"
+            lines.extend(child.samples(self.name, labels))
+        return lines
+
+class MetricsRegistry:
+    """
+    Process-wide counters, gauges and histograms, rendered in the Prometheus text format. Recording is a
+    dict lookup and a short lock per observation, cheap enough to leave on in every pass and request.
+    Getting a metric that exists returns it, so modules define theirs at import time.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get_or_create(self, metric_type: str, name: str, help_text: str, label_names: Sequence[str], make_child: Callable) -> Metric:
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = Metric(metric_type, name, help_text, label_names, make_child)
+                self.metrics[name] = metric
+            elif metric.metric_type != metric_type or metric.label_names != tuple(label_names):
+                raise ValueError(f"{name} is already a {metric.metric_type} with labels {metric.label_names}")
+            return metric
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Metric:
+        return self.get_or_create("counter", name, help_text, label_names, CounterChild)
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Metric:
+        return self.get_or_create("gauge", name, help_text, label_names, GaugeChild)
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Metric:
+        buckets = tuple(sorted(buckets))
+        return self.get_or_create("histogram", name, help_text, label_names, lambda lock: HistogramChild(lock, buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """
+    Serves GET /metrics of registry on a daemon thread, for processes without a web server. Returns the server,
+    shutdown() stops it. Only local scrapers reach the default host, "0.0.0.0" exposes it on every interface.
+    Raises OSError when the port is taken
+    """
+    registry = registry or metrics
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # scrapes every few seconds would fill std_out.txt
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
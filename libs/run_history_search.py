@@ -0,0 +1,102 @@
+from typing import Dict, List, Optional
+import html
+import json
+import re
+
+# indexed text of a pass, in the order of the run_history_fts columns after agent_id
+SEARCH_COLUMNS = ["thoughts", "summary", "tool_calls", "tool_results"]
+# the column a snippet is taken from when several match
+SNIPPET_COLUMN_ORDER = ["summary", "thoughts", "tool_calls", "tool_results"]
+# searches rank the newest this many matching passes, ranking every match of a common word grows with the history
+MAX_SEARCH_CANDIDATES = 10000
+
+def create_run_history_fts(conn, table_name: str = "run_history_fts"):
+    # contentless: the index holds no copy of the text, snippets are cut from the stored pass instead,
+    # tool results are often whole pages and are already stored compressed in message_blobs.
+    # prefix indexes keep short prefix searches ("wiki*") from expanding to every matching term.
+    # agent_id is indexed so a search of one agent intersects doclists instead of ranking every agent's matches
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table_name} USING fts5(
+            agent_id, {", ".join(SEARCH_COLUMNS)},
+            content='',
+            tokenize='porter unicode61',
+            prefix='2 3'
+        )
+    """)
+
+def extract_search_text(agent_run_result: dict) -> Dict[str, str]:
+    """The searchable text of an AgentRunResult JSON-mode dict, column name -> text"""
+    agent_output = agent_run_result.get("agent_output") or {}
+    summary_output = agent_run_result.get("summary_output") or {}
+    tool_calls = []
+    for tool_call in agent_output.get("tool_calls") or []:
+        tool_calls.append(f"{tool_call.get('name', '')} {json.dumps(tool_call.get('arguments') or {}, ensure_ascii=False)}")
+    return {
+        "thoughts": "\n".join(text for text in [agent_output.get("thoughts"), agent_output.get("followup_thoughts"), summary_output.get("thoughts")] if text),
+        "summary": "\n".join([summary_output.get("summary") or ""] + (summary_output.get("actions_taken") or [])),
+        "tool_calls": "\n".join(tool_calls),
+        "tool_results": "\n".join(str(message.get("content") or "") for message in agent_run_result.get("tool_results") or []),
+    }
+
+def index_run_result(conn, rowid: int, agent_id: str, agent_run_result: dict, table_name: str = "run_history_fts"):
+    """Indexes the pass stored at rowid of agent_run_results, in the caller's transaction"""
+    text = extract_search_text(agent_run_result)
+    conn.execute(
+        f"INSERT INTO {table_name} (rowid, agent_id, {', '.join(SEARCH_COLUMNS)}) VALUES (?, ?, {', '.join('?' * len(SEARCH_COLUMNS))})",
+        [rowid, agent_id] + [text[column] for column in SEARCH_COLUMNS]
+    )
+
+def parse_search_terms(query: str) -> List[str]:
+    """Words of a search, a trailing * makes a word a prefix"""
+    return [term for term in re.findall(r"[\w*]+", query) if term.strip("*")]
+
+def quote_terms(terms: List[str], prefix: bool = False) -> str:
+    """Terms as FTS5 strings, all required, so user input is never parsed as FTS5 syntax. prefix makes every term a prefix"""
+    return " ".join(f'"{term.strip("*")}"' + ("*" if prefix or term.endswith("*") else "") for term in terms)
+
+def to_match_query(terms: List[str], agent_id: Optional[str] = None) -> str:
+    """An FTS5 MATCH expression finding passes with every term"""
+    words = quote_terms(terms)
+    if agent_id is None:
+        return "{" + " ".join(SEARCH_COLUMNS) + "} : (" + words + ")"
+    quoted_agent_id = agent_id.replace('"', '""')
+    return f'agent_id : ^"{quoted_agent_id}" AND {{{" ".join(SEARCH_COLUMNS)}}} : ({words})'
+
+def term_pattern(terms: List[str]):
+    # the index stems words, so highlight words starting like the term rather than the exact term
+    prefixes = []
+    for term in terms:
+        term = term.rstrip("*").lower()
+        for suffix in ["ing", "ed", "es", "s"]:
+            if term.endswith(suffix) and len(term) - len(suffix) >= 3:
+                term = term[:-len(suffix)]
+                break
+        prefixes.append(re.escape(term))
+    return re.compile(r"\b(?:" + "|".join(prefixes) + r")\w*", re.IGNORECASE)
+
+def make_snippet(text: Dict[str, str], terms: List[str], width: int = 200):
+    """(column, snippet) around the first match, HTML escaped with matches in <mark>"""
+    pattern = term_pattern(terms)
+    for column in SNIPPET_COLUMN_ORDER:
+        match = pattern.search(text[column])
+        if match is not None:
+            break
+    else:
+        # porter stems can match words the prefix does not, fall back to the start of the summary
+        column = "summary" if text["summary"].strip() else next((column for column in SNIPPET_COLUMN_ORDER if text[column].strip()), "summary")
+        match = None
+    start = max(0, match.start() - width // 3) if match is not None else 0
+    excerpt = " ".join(text[column][start:start + width].split())
+    parts = []
+    position = 0
+    for found in pattern.finditer(excerpt):
+        parts.append(html.escape(excerpt[position:found.start()]))
+        parts.append(f"<mark>{html.escape(found.group(0))}</mark>")
+        position = found.end()
+    parts.append(html.escape(excerpt[position:]))
+    snippet = "".join(parts)
+    if start > 0:
+        snippet = "…" + snippet
+    if start + width < len(text[column]):
+        snippet += "…"
+    return column, snippet
@@ -0,0 +1,141 @@
+try:
+    from .metrics import metrics
+except ImportError:
+    from metrics import metrics
+from contextlib import contextmanager
+from collections import OrderedDict
+import threading
+import sqlite3
+import queue
+import time
+import os
+
+# by database file name, operation is read or write. Reads are timed while a connection is held, fetching included
+sqlite_seconds = metrics.histogram("polis_sqlite_seconds", "Seconds a connection was held for a read or a write transaction", ["database", "operation"])
+pool_wait_seconds = metrics.histogram("polis_sqlite_pool_wait_seconds", "Seconds waited for a pooled read connection", ["database"])
+
+class ReadOnlyConnectionPool:
+    """
+    Up to size read-only connections to one database, shared by the threads of the web server. Connections are
+    opened on first use and callers wait for a free one when all are busy. Readers never take a write lock, so
+    with WAL they run alongside the orchestrator writing to the same file.
+    """
+    def __init__(self, database_path: str, size: int = 8, timeout: float = 30.0, row_factory=None):
+        self.database_path = database_path
+        self.size = size
+        self.timeout = timeout
+        self.row_factory = row_factory
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.waits = 0
+        self.lock = threading.Lock()
+        # a connection of its own for data_version, which only counts commits of other connections
+        self.version_connection = None
+        self.version_inode = None
+        self.version_lock = threading.Lock()
+        self.read_seconds = sqlite_seconds.labels(os.path.basename(database_path), "read")
+        self.wait_seconds = pool_wait_seconds.labels(os.path.basename(database_path))
+
+    def open_connection(self):
+        # mode=ro fails instead of creating a missing file, the owning class creates the schema first
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.database_path)}?mode=ro", uri=True, timeout=self.timeout, check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON")
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        return conn
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self.lock:
+                if self.opened < self.size:
+                    self.opened += 1
+                    opening = True
+                else:
+                    self.waits += 1
+                    opening = False
+            if opening:
+                try:
+                    conn = self.open_connection()
+                except sqlite3.Error:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+            else:
+                conn = self.idle.get(timeout=self.timeout)
+        acquired = time.perf_counter()
+        self.wait_seconds.observe(acquired - start)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put(conn)
+            self.read_seconds.observe(time.perf_counter() - acquired)
+
+    def data_version(self):
+        """Changes whenever anyone commits to the database, or the file is replaced"""
+        inode = os.stat(self.database_path).st_ino
+        with self.version_lock:
+            if self.version_connection is not None and inode != self.version_inode:
+                self.version_connection.close()
+                self.version_connection = None
+            if self.version_connection is None:
+                self.version_connection = self.open_connection()
+                self.version_inode = inode
+            return (inode, self.version_connection.execute("PRAGMA data_version").fetchone()[0])
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self.lock:
+            self.opened = 0
+        with self.version_lock:
+            if self.version_connection is not None:
+                self.version_connection.close()
+                self.version_connection = None
+
+    def get_stats(self):
+        with self.lock:
+            return {"database": self.database_path, "size": self.size, "opened": self.opened, "idle": self.idle.qsize(), "waits": self.waits}
+
+class VersionedCache:
+    """
+    LRU cache of values built from databases. Each entry remembers the version of the data it was built from,
+    e.g. a pool's data_version, and is rebuilt once the caller passes a different one. The version has to be read
+    before the value is built, so a change in between only costs an extra rebuild.
+    """
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, build):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # built outside the lock, two threads missing the same key both build it
+        value = build()
+        with self.lock:
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def get_stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,99 @@
+import threading
+import json
+
+MIN_CONTEXT_TOKENS = 2048
+MAX_CONTEXT_TOKENS = 100000
+DEFAULT_OUTPUT_TOKENS = 2048
+# added to the prompt estimate when sizing the context, the estimate can undercount
+CONTEXT_SAFETY_MARGIN = 0.15
+# chars_per_token is multiplied by this when the server truncated a prompt, the estimate undercounted it
+TRUNCATION_BACKOFF = 0.85
+
+class TokenEstimator:
+    """
+    Counts prompt tokens without a tokenizer: characters / chars_per_token, plus a few tokens of chat
+    template per message. chars_per_token starts conservative for JSON heavy prompts and is calibrated
+    from the prompt_eval_count the server reports back.
+
+    Context sizes are kept per (server, model) and only grow: ollama reloads the model, and loses its prompt
+    cache, whenever num_ctx differs from the loaded one, so calls of different sizes all use the largest so far.
+    """
+    def __init__(self, chars_per_token: float = 3.5, message_overhead_tokens: int = 4, min_chars_per_token: float = 2.0, max_chars_per_token: float = 6.0, smoothing: float = 0.2):
+        self.chars_per_token = chars_per_token
+        self.message_overhead_tokens = message_overhead_tokens
+        self.min_chars_per_token = min_chars_per_token
+        self.max_chars_per_token = max_chars_per_token
+        self.smoothing = smoothing
+        self.calibration_samples = 0
+        self.truncated_prompts = 0
+        # (server url, model) -> num_ctx the server last loaded the model with
+        self.context_sizes = {}
+        self.lock = threading.Lock()
+
+    def message_characters(self, message):
+        chat_ml = message.chat_ml()
+        if "tool_calls" in chat_ml:
+            return len(json.dumps(chat_ml["tool_calls"]))
+        return len(chat_ml.get("content") or "")
+
+    def estimate_text(self, text: str):
+        return int(len(text) / self.chars_per_token) + 1
+
+    def estimate_message(self, message):
+        return int(self.message_characters(message) / self.chars_per_token) + self.message_overhead_tokens
+
+    def estimate_messages(self, messages):
+        return sum(self.estimate_message(message) for message in messages)
+
+    def characters_for_tokens(self, tokens: int):
+        return int(tokens * self.chars_per_token)
+
+    def calibrate(self, messages, prompt_eval_count: int, num_ctx: int = None, context_key=None):
+        """
+        Moves chars_per_token towards what the server measured for this prompt. A prompt the server truncated
+        to num_ctx was undercounted: chars_per_token backs off and the context of context_key grows a step
+        """
+        if prompt_eval_count is None or prompt_eval_count <= 0:
+            return
+        # the server silently truncates prompts longer than the context, the count is not the prompt size then
+        if num_ctx is not None and prompt_eval_count >= num_ctx:
+            with self.lock:
+                self.truncated_prompts += 1
+                self.chars_per_token = max(self.min_chars_per_token, self.chars_per_token * TRUNCATION_BACKOFF)
+                if context_key is not None:
+                    self.context_sizes[context_key] = min(max(self.context_sizes.get(context_key, 0), num_ctx * 2), MAX_CONTEXT_TOKENS)
+            print(f"Prompt truncated to num_ctx {num_ctx}, chars per token lowered to {self.chars_per_token:.2f}")
+            return
+        # a cached prompt prefix is not re-evaluated, counts well under the estimate measure the cache, not the prompt
+        if prompt_eval_count < 0.75 * self.estimate_messages(messages):
+            return
+        characters = sum(self.message_characters(message) for message in messages)
+        content_tokens = prompt_eval_count - self.message_overhead_tokens * len(messages)
+        if content_tokens <= 0:
+            return
+        measured = characters / content_tokens
+        if measured < self.min_chars_per_token or measured > self.max_chars_per_token:
+            return
+        with self.lock:
+            self.chars_per_token += self.smoothing * (measured - self.chars_per_token)
+            self.calibration_samples += 1
+
+    def context_size(self, prompt_tokens: int, output_tokens: int = DEFAULT_OUTPUT_TOKENS, context_key=None):
+        """
+        Smallest power of two context that fits the prompt with CONTEXT_SAFETY_MARGIN and the output, clamped to
+        MAX_CONTEXT_TOKENS. With a context_key, e.g. (server url, model), the size is never below the largest one
+        returned for that key before, so the server keeps the loaded model instead of reloading it
+        """
+        needed = int(prompt_tokens * (1 + CONTEXT_SAFETY_MARGIN)) + output_tokens
+        size = MIN_CONTEXT_TOKENS
+        while size < needed and size < MAX_CONTEXT_TOKENS:
+            size *= 2
+        size = min(size, MAX_CONTEXT_TOKENS)
+        if context_key is None:
+            return size
+        with self.lock:
+            size = max(size, self.context_sizes.get(context_key, 0))
+            self.context_sizes[context_key] = size
+        return size
+
+token_estimator = TokenEstimator()
@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+import threading
+import json
+import time
+import zlib
+
+# span fields in the stored form, times in microseconds from the start of the trace
+SPAN_FIELDS = ["name", "category", "parent", "thread", "start_us", "duration_us", "args"]
+
+class PassTrace:
+    """
+    Nested spans of one agent pass, from the post-system tool calls to the saved run result. Spans can be
+    opened from several threads at once, each thread nests its own spans and spans opened on a worker thread
+    name their parent explicitly, e.g. tool calls running concurrently under the agent's tools span.
+
+    A pass can outlive Agent.run when its summary runs in the background, hold() and release() count the parts
+    still running and on_complete(trace) is called when the last one releases it.
+    """
+    def __init__(self, on_complete: Optional[Callable] = None):
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        # [name, category, parent index or -1, thread number, start_us, duration_us or -1 while open, args]
+        self.spans = []
+        self.lock = threading.Lock()
+        # thread ident -> indexes of the spans open on that thread, innermost last
+        self.open_spans = {}
+        # thread ident -> small number in order of first use, the thread that started the pass is 0
+        self.threads = {}
+        self.holds = 1
+        self.on_complete = on_complete
+        # set when the pass is saved
+        self.pass_id = None
+        self.agent_id = None
+        self.pass_number = None
+
+    def current_span(self) -> int:
+        """Index of the innermost span open on this thread, -1 if there is none"""
+        with self.lock:
+            stack = self.open_spans.get(threading.get_ident())
+            return stack[-1] if stack else -1
+
+    @contextmanager
+    def span(self, name: str, category: str = "phase", parent: Optional[int] = None, **args):
+        """Records the with block as a span, yields its args dict which can be added to until the trace is saved"""
+        thread_ident = threading.get_ident()
+        start = time.perf_counter()
+        with self.lock:
+            stack = self.open_spans.setdefault(thread_ident, [])
+            if parent is None:
+                parent = stack[-1] if stack else -1
+            thread = self.threads.setdefault(thread_ident, len(self.threads))
+            index = len(self.spans)
+            self.spans.append([name, category, parent, thread, int((start - self.origin) * 1e6), -1, args])
+            stack.append(index)
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.spans[index][5] = int((end - start) * 1e6)
+                stack.remove(index)
+                if len(stack) == 0:
+                    del self.open_spans[thread_ident]
+
+    def hold(self):
+        with self.lock:
+            self.holds += 1
+
+    def release(self):
+        with self.lock:
+            self.holds -= 1
+            complete = self.holds == 0
+        if complete and self.on_complete is not None:
+            self.on_complete(self)
+
+    def duration(self) -> float:
+        """Seconds from the start of the trace to the end of its last span"""
+        with self.lock:
+            ends = [span[4] + max(span[5], 0) for span in self.spans]
+        return max(ends, default=0) / 1e6
+
+    def to_blob(self) -> bytes:
+        """The spans as zlib compressed JSON lists, see SPAN_FIELDS"""
+        with self.lock:
+            spans = [list(span) for span in self.spans]
+        return zlib.compress(json.dumps(spans, separators=(",", ":")).encode("utf-8"))
+
+def spans_from_blob(blob: bytes) -> List[list]:
+    return json.loads(zlib.decompress(blob))
+
+def to_chrome_trace(traces: List[dict]) -> dict:
+    """
+    Chrome trace-event JSON of stored traces, each a dict with agent_id, agent_name, pass_id, pass_number,
+    started_at and spans. Agents are processes and pass threads are threads, so the passes of an agent line up
+    on one timeline in chrome://tracing or ui.perfetto.dev
+    """
+    events = []
+    process_ids = {}
+    named_threads = set()
+    for trace in traces:
+        process_id = process_ids.get(trace["agent_id"])
+        if process_id is None:
+            process_id = len(process_ids) + 1
+            process_ids[trace["agent_id"]] = process_id
+            events.append({"name": "process_name", "ph": "M", "pid": process_id, "tid": 0, "args": {"name": trace["agent_name"] or trace["agent_id"]}})
+        started_at_us = int(trace["started_at"] * 1e6)
+        for name, category, parent, thread, start_us, duration_us, args in trace["spans"]:
+            if (process_id, thread) not in named_threads:
+                named_threads.add((process_id, thread))
+                events.append({"name": "thread_name", "ph": "M", "pid": process_id, "tid": thread, "args": {"name": "agent" if thread == 0 else f"worker {thread}"}})
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": started_at_us + start_us,
+                # a span still open when the trace was saved ends where it was saved
+                "dur": max(duration_us, 0),
+                "pid": process_id,
+                "tid": thread,
+                "args": dict(args, pass_number=trace["pass_number"], pass_id=trace["pass_id"])
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -0,0 +1,33 @@
+# moves agent_run_results rows saved as full JSON into the deduplicated message_blobs storage,
+# and adds passes saved before the run history search index existed to it
+# usage: python migrate_agent_database.py [agent_database.db] [--vacuum]
+import sys
+import os
+
+from libs.agent_database import get_agent_database
+
+database_path = "agent_database.db"
+vacuum = "--vacuum" in sys.argv
+for arg in sys.argv[1:]:
+    if arg != "--vacuum":
+        database_path = arg
+
+if not os.path.exists(database_path):
+    print(f"{database_path} does not exist")
+    sys.exit(1)
+
+size_before = os.path.getsize(database_path)
+agent_database = get_agent_database(database_path)
+migrated = agent_database.migrate_run_results()
+print(f"Migrated {migrated} run results")
+indexed = agent_database.index_run_history()
+print(f"Indexed {indexed} run results for search")
+
+conn = agent_database.get_connection()
+if vacuum:
+    # the freed pages are only returned to the file system by a vacuum. It can renumber implicit rowids,
+    # opening the database above gave agent_run_results the run_id alias the search index is keyed by
+    conn.execute("VACUUM")
+conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+agent_database.close()
+print(f"{database_path}: {size_before} bytes before, {os.path.getsize(database_path)} bytes after")
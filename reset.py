@@ -32,3 +32,9 @@ if os.path.exists("user_directory.db"):
 
 if os.path.exists("quest_database.db"):
     os.remove("quest_database.db")
+
+# WAL journal and shared memory files, a stale -wal file must not be replayed into a new database
+for database in ["agent_database.db", "user_directory.db", "quest_database.db"]:
+    for suffix in ["-wal", "-shm"]:
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
@@ -1,11 +1,23 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, g
+from pydantic import ValidationError
+import functools
+import hashlib
+import argparse
+import sqlite3
+import threading
+import time
 import os
+import queue
 import json
 import uuid
-import sqlite3
+import gzip
 
-from libs.agent_database import AgentDatabase, AgentTable, AgentRunResultsTable
+from libs.agent_database import get_agent_database, AgentTable, AgentRunResultsTable
 from libs.agent import AgentRunResult
+from libs.change_events import ChangeFeed
+from libs.sqlite_pool import ReadOnlyConnectionPool, VersionedCache
+from libs.metrics import metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from libs.tracing import to_chrome_trace
 from tools.user_directory import UserDirectory
 from tools.quest_manager import Quest, QuestSubmission, QuestReview, QuestManager
 
@@ -13,15 +25,36 @@ app = Flask(__name__)
 app.static_folder = 'web'
 app.static_url_path = '/static'
 
+# the databases written by the orchestrator, POLIS_DATA_DIR points at another world's directory
+data_directory = os.environ.get('POLIS_DATA_DIR', os.path.dirname(__file__))
+
 # Create the Directory instance pointing to our forum.db
-forum_db_path = os.path.join(os.path.dirname(__file__), 'forum.db')
-agent_db_path = os.path.join(os.path.dirname(__file__), 'agent_database.db')
-user_directory_db_path = os.path.join(os.path.dirname(__file__), 'user_directory.db')
-quest_db_path = os.path.join(os.path.dirname(__file__), 'quest_database.db')
+forum_db_path = os.path.join(data_directory, 'forum.db')
+agent_db_path = os.path.join(data_directory, 'agent_database.db')
+user_directory_db_path = os.path.join(data_directory, 'user_directory.db')
+quest_db_path = os.path.join(data_directory, 'quest_database.db')
 
-agent_database = AgentDatabase(agent_db_path)
+# read pools per database, sized for the --serve thread count
+READ_POOL_SIZE = int(os.environ.get('POLIS_READ_POOL_SIZE', 16))
+# requests slower than this are logged
+SLOW_REQUEST_SECONDS = 0.5
+# every open /api/events stream holds a server thread, past this many streams are refused so the rest of the threads
+# stay free for other requests. serve() lowers it to half of its threads unless POLIS_MAX_EVENT_STREAMS is set
+max_event_streams = int(os.environ.get('POLIS_MAX_EVENT_STREAMS', READ_POOL_SIZE // 2))
+# milliseconds a refused or disconnected stream waits before reconnecting
+EVENT_STREAM_RETRY_MS = 10000
+open_event_streams = 0
+event_streams_lock = threading.Lock()
+
+agent_database = get_agent_database(agent_db_path)
 user_directory = UserDirectory(user_directory_db_path)
 quest_manager = QuestManager(agent_id="admin", db_path=quest_db_path)
+agent_database.read_pool = ReadOnlyConnectionPool(agent_db_path, READ_POOL_SIZE)
+user_directory.read_pool = ReadOnlyConnectionPool(user_directory_db_path, READ_POOL_SIZE)
+quest_manager.read_pool = ReadOnlyConnectionPool(quest_db_path, READ_POOL_SIZE, row_factory=sqlite3.Row)
+response_cache = VersionedCache()
+# one poller for every open dashboard, the orchestrator writes these databases from its own process
+change_feed = ChangeFeed({"agents": agent_db_path, "messages": user_directory_db_path, "quests": quest_db_path})
 
 llm_url = "http://localhost:5000"
 
@@ -35,6 +68,117 @@ admin_agent = AdminAgent()
 # Ensure admin user exists in the directory
 user_directory.add_user(admin_agent)
 
+# endpoint -> {"count", "total_seconds", "max_seconds"}
+request_timings = {}
+request_timings_lock = threading.Lock()
+request_seconds = metrics.histogram("polis_http_request_seconds", "Seconds per dashboard API request, compression included", ["endpoint"])
+responses = metrics.counter("polis_http_responses_total", "Dashboard API responses by status code", ["endpoint", "status"])
+# pool and cache counts are kept by the objects themselves and read on each scrape
+pool_connections = metrics.gauge("polis_sqlite_pool_connections", "Open connections of a read pool", ["database"])
+pool_waits = metrics.counter("polis_sqlite_pool_waits_total", "Times a request found every pooled connection busy", ["database"])
+for pool in [agent_database.read_pool, user_directory.read_pool, quest_manager.read_pool]:
+    pool_connections.labels(os.path.basename(pool.database_path)).set_function(lambda pool=pool: pool.opened)
+    pool_waits.labels(os.path.basename(pool.database_path)).set_function(lambda pool=pool: pool.waits)
+metrics.gauge("polis_response_cache_entries", "Cached API responses").set_function(lambda: len(response_cache.entries))
+metrics.counter("polis_response_cache_hits_total", "Requests answered from the response cache").set_function(lambda: response_cache.hits)
+metrics.counter("polis_response_cache_misses_total", "Requests that built their response").set_function(lambda: response_cache.misses)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+# registered before compress_response so it runs after it, the timing includes compression
+@app.after_request
+def record_request_timing(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    seconds = time.perf_counter() - start
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    with request_timings_lock:
+        timing = request_timings.setdefault(endpoint, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        timing["count"] += 1
+        timing["total_seconds"] += seconds
+        timing["max_seconds"] = max(timing["max_seconds"], seconds)
+    request_seconds.labels(endpoint).observe(seconds)
+    responses.labels(endpoint, response.status_code).inc()
+    response.headers['Server-Timing'] = f"app;dur={seconds * 1000:.1f}"
+    if seconds > SLOW_REQUEST_SECONDS:
+        print(f"Slow request: {request.full_path} took {seconds:.2f}s")
+    return response
+
+def should_compress(response):
+    if response.status_code == 304 or response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return False
+    if response.mimetype != 'application/json' or 'gzip' not in request.headers.get('Accept-Encoding', '').lower():
+        return False
+    return response.content_length is not None and response.content_length >= 1024
+
+def set_gzip_data(response, compressed):
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers.add('Vary', 'Accept-Encoding')
+
+@app.after_request
+def compress_response(response):
+    # run results are large, repetitive JSON, gzip makes them several times smaller
+    if should_compress(response):
+        set_gzip_data(response, gzip.compress(response.get_data(), compresslevel=6))
+    return response
+
+def cached(version):
+    """
+    Serves the stored response of a read-only endpoint, and its gzipped body, for as long as version() returns
+    the same value, e.g. the data_version of the database the endpoint reads. Successful responses get an ETag,
+    a request whose If-None-Match still matches is answered with 304 Not Modified.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            def build():
+                response = app.make_response(view(*args, **kwargs))
+                data = response.get_data()
+                entry = {"status": response.status_code, "data": data, "headers": dict(response.headers)}
+                if response.status_code == 200:
+                    # weak, the gzipped body is the same representation
+                    entry["etag"] = hashlib.sha1(data).hexdigest()
+                return entry
+            entry = response_cache.get(request.full_path, version(), build)
+            response = Response(entry["data"], status=entry["status"], headers=entry["headers"])
+            if "etag" in entry:
+                response.set_etag(entry["etag"], weak=True)
+                # browsers revalidate every time instead of guessing how long the response stays fresh
+                response.headers['Cache-Control'] = 'no-cache'
+                response.make_conditional(request)
+            if should_compress(response):
+                # two threads may both compress it, either result is the same
+                if "gzip" not in entry:
+                    entry["gzip"] = gzip.compress(entry["data"], compresslevel=6)
+                set_gzip_data(response, entry["gzip"])
+            return response
+        return wrapper
+    return decorator
+
+def agent_run_results_version():
+    # a new pass of another agent leaves this agent's pages valid
+    return (agent_database.read_pool.data_version()[0], agent_database.get_agent_version(request.args.get('agent_id')))
+
+@app.route('/api/server_stats', methods=['GET'])
+def server_stats():
+    with request_timings_lock:
+        timings = {
+            endpoint: dict(timing, mean_seconds=timing["total_seconds"] / timing["count"])
+            for endpoint, timing in request_timings.items()
+        }
+    pools = [agent_database.read_pool, user_directory.read_pool, quest_manager.read_pool]
+    return jsonify({"requests": timings, "read_pools": [pool.get_stats() for pool in pools], "response_cache": response_cache.get_stats(),
+                    "event_streams": {"open": open_event_streams, "max": max_event_streams}})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text format metrics of this process, the orchestrator serves its own on POLIS_METRICS_PORT"""
+    return Response(metrics.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/')
 def serve_app(agent_id=None):
     return send_from_directory('web', 'index.html')
@@ -50,22 +194,56 @@ def create_quest():
     return jsonify({"success": True})
 
 @app.route('/api/list_agents', methods=['GET'])
+@cached(agent_database.read_pool.data_version)
 def list_agents():
     agent_list = agent_database.get_agent_list()
     # Convert the list of tuples to list of dicts
     formatted_list = [{"agent_id": row[0], "agent_name": row[1], "pass_number": row[2], "last_run_date": row[3]} for row in agent_list]
     return jsonify(formatted_list)
 
+def parse_count(name, default):
+    """A limit or offset query argument, ValueError unless it is a whole number of at least 0"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if not value.strip().isdigit():
+        raise ValueError(f"{name} must be a whole number of at least 0")
+    return int(value)
+
+def parse_fields():
+    """fields=summary_output,agent_output.tool_calls projects each run result, pass_id and pass_number are always kept"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return ["pass_id", "pass_number"] + [field.strip() for field in fields.split(',') if field.strip()]
+
 @app.route('/api/get_agent_run_results', methods=['GET'])
+@cached(agent_run_results_version)
 def get_agent_run_results():
+    """
+    Pages of run results, newest first. Pass the X-Next-Cursor response header back as cursor for the next
+    page, the header is missing on the last page. offset paging is still accepted but scans every skipped row.
+    """
     agent_id = request.args.get('agent_id')
-    limit = int(request.args.get('limit', 10))
-    offset = int(request.args.get('offset', 0))
+    cursor = request.args.get('cursor')
+    fields = parse_fields()
+    try:
+        limit = parse_count('limit', 10)
+        offset = parse_count('offset', None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     if not agent_id:
         return jsonify({"error": "agent_id parameter is required"}), 400
-        
-    agent_run_results = agent_database.get_agent_run_results(agent_id, limit, offset)
+
+    next_cursor = None
+    if offset is not None:
+        agent_run_results = agent_database.get_agent_run_results(agent_id, limit, offset, fields)
+    else:
+        try:
+            agent_run_results, next_cursor = agent_database.get_agent_run_results_page(agent_id, limit, cursor, fields)
+        except ValueError:
+            return jsonify({"error": "invalid cursor"}), 400
     
     # Convert the database rows to AgentRunResultsTable objects
     run_results_table_rows = [
@@ -79,25 +257,108 @@ def get_agent_run_results():
     ]
     
     # Return the JSON strings directly
-    return jsonify([row.agent_run_result for row in run_results_table_rows])
+    response = jsonify([row.agent_run_result for row in run_results_table_rows])
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/api/get_agent_run_result', methods=['GET'])
+@cached(agent_database.read_pool.data_version)
+def get_agent_run_result():
+    pass_id = request.args.get('pass_id')
+    if not pass_id:
+        return jsonify({"error": "pass_id parameter is required"}), 400
+    row = agent_database.get_agent_run_result(pass_id, parse_fields())
+    if row is None:
+        return jsonify({"error": "run result not found"}), 404
+    return jsonify(row[3])
+
+@app.route('/api/search_run_history', methods=['GET'])
+@cached(agent_database.read_pool.data_version)
+def search_run_history():
+    """q=words to find in the passes of every agent, or of agent_id, best match first"""
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({"error": "q parameter is required"}), 400
+    try:
+        limit = min(parse_count('limit', 20), 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(agent_database.search_run_history(query, request.args.get('agent_id'), limit))
+
+@app.route('/api/get_pass_traces', methods=['GET'])
+@cached(agent_database.read_pool.data_version)
+def get_pass_traces():
+    """
+    Chrome trace-event JSON of pass_id, of the latest passes of agent_id, or of every agent's latest or slowest
+    (order=slowest) passes. download=1 saves it as a file to open in ui.perfetto.dev or chrome://tracing
+    """
+    order = request.args.get('order', 'recent')
+    if order not in ['recent', 'slowest']:
+        return jsonify({"error": "order must be recent or slowest"}), 400
+    try:
+        limit = min(parse_count('limit', 20), 500)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    traces = agent_database.get_pass_traces(request.args.get('agent_id'), request.args.get('pass_id'), order, limit)
+    response = jsonify(to_chrome_trace(traces))
+    if request.args.get('download') == '1':
+        response.headers['Content-Disposition'] = 'attachment; filename=polis_trace.json'
+    return response
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """
+    Server-Sent Events for saved agent passes ("agent_pass"), sent messages ("message") and quest changes
+    ("quest"), data is {"source", "event_id", "topic", "payload"}. topics=agent_pass,quest limits the stream
+    """
+    global open_event_streams
+    with event_streams_lock:
+        refused = open_event_streams >= max_event_streams
+        if not refused:
+            open_event_streams += 1
+    if refused:
+        # the pages reconnect after the retry hint, and poll nothing meanwhile
+        return Response(f"retry: {EVENT_STREAM_RETRY_MS}\n\n", status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(EVENT_STREAM_RETRY_MS // 1000), 'Cache-Control': 'no-cache'})
+    topics = [topic for topic in request.args.get('topics', '').split(',') if topic] or None
+    subscriber_queue = change_feed.subscribe(topics)
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = subscriber_queue.get(timeout=15)
+                except queue.Empty:
+                    # a comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    # dropped for falling behind, the client reconnects and reloads
+                    return
+                yield f"id: {event['source']}:{event['event_id']}\nevent: {event['topic']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            change_feed.unsubscribe(subscriber_queue)
+
+    def release_stream():
+        global open_event_streams
+        with event_streams_lock:
+            open_event_streams -= 1
+
+    response = Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # called when the server closes the response, also if the stream never started
+    response.call_on_close(release_stream)
+    return response
 
 # New messaging endpoints
+def format_messages(messages):
+    return [{"sender": message.from_user_name, "sender_id": message.from_user_id, "message_id": message.message_id, "message": message.message} for message in messages]
+
 @app.route('/api/get_users', methods=['GET'])
+@cached(user_directory.read_pool.data_version)
 def get_users():
-    users_text = user_directory.get_users()
-    # Parse the text output into a structured format
-    users = []
-    for line in users_text.split('\n')[1:]:  # Skip the "Users:" header
-        line = line.strip()
-        if line:
-            # Extract name and user_id from the line
-            parts = line.split('(user_id: ')
-            if len(parts) == 2:
-                name = parts[0].strip('- ').strip()
-                user_id = parts[1].strip(')')
-                users.append({"user_id": user_id, "name": name})
-    
-    return jsonify(users)
+    return jsonify([{"user_id": user.id, "name": user.name} for user in user_directory.list_users()])
 
 @app.route('/api/send_message', methods=['POST'])
 def send_message():
@@ -112,43 +373,18 @@ def send_message():
     return jsonify({"result": result})
 
 @app.route('/api/get_messages', methods=['GET'])
+@cached(user_directory.read_pool.data_version)
 def get_messages():
     sender_id = request.args.get('sender_id')
-    limit = int(request.args.get('limit', 10))
-    
-    messages_text = user_directory.get_messages(admin_agent, sender_id, limit)
-    
-    # Parse the text output into a structured format
-    messages = []
-    for line in messages_text.split('\n')[1:]:  # Skip the "Messages:" header
-        line = line.strip()
-        if line and not line == "[No messages]":
-            # Extract sender and message from the line
-            parts = line.split(': ', 1)
-            if len(parts) == 2:
-                sender = parts[0].strip('- From ')
-                message_content = parts[1]
-                messages.append({"sender": sender, "message": message_content})
-    
-    return jsonify(messages)
+    try:
+        limit = parse_count('limit', 10)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(format_messages(user_directory.query_messages(admin_agent.id, sender_id, limit)))
 
 @app.route('/api/get_new_messages', methods=['GET'])
 def get_new_messages():
-    messages_text = user_directory.get_new_messages(admin_agent)
-    
-    # Parse the text output into a structured format
-    messages = []
-    for line in messages_text.split('\n')[1:]:  # Skip the "Messages:" header
-        line = line.strip()
-        if line and not line == "[No messages]":
-            # Extract sender and message from the line
-            parts = line.split(': ', 1)
-            if len(parts) == 2:
-                sender = parts[0].strip('- From ')
-                message_content = parts[1]
-                messages.append({"sender": sender, "message": message_content})
-    
-    return jsonify(messages)
+    return jsonify(format_messages(user_directory.take_new_messages(admin_agent.id)))
 
 # Add a route to serve static files from web directory
 @app.route('/static/<path:path>')
@@ -157,55 +393,40 @@ def send_static(path):
 
 # Add new quest-related endpoints
 @app.route('/api/get_agent_quests', methods=['GET'])
+@cached(quest_manager.read_pool.data_version)
 def get_agent_quests():
     agent_id = request.args.get('agent_id')
     if not agent_id:
         return jsonify({"error": "agent_id parameter is required"}), 400
-    db = sqlite3.connect(quest_db_path)
-    cursor = db.execute("SELECT * FROM quests WHERE agent_id = ?", (agent_id,))
-    quests = []
-    for row in cursor:
-        print(row)
-        quest_data = row[3]
-        quest = Quest.model_validate_json(quest_data)
-        result = {
-            "quest_id": row[0],
-            "agent_id": row[1],
-            "quest_title": row[2],
-            "quest": quest.model_dump_json()
-        }
-        quests.append(result)
-    db.close()
-    return jsonify(quests)
+    return jsonify([quest.model_dump() for quest in quest_manager.get_quest_rows(agent_id)])
 
 @app.route('/api/get_quest_submissions', methods=['GET'])
+@cached(quest_manager.read_pool.data_version)
 def get_quest_submissions():
     quest_id = request.args.get('quest_id')
     if not quest_id:
         return jsonify({"error": "quest_id parameter is required"}), 400
-    
-    db = sqlite3.connect(quest_db_path)
-    cursor = db.execute("SELECT * FROM quest_submissions WHERE quest_id = ?", (quest_id,))
-    submissions = []
-    for row in cursor:
-        submissions.append(row)
-    db.close()
-    return jsonify(submissions)
+    return jsonify([submission.model_dump() for submission in quest_manager.get_quest_submissions(quest_id)])
 
 @app.route('/api/get_quest_reviews', methods=['GET'])
+@cached(quest_manager.read_pool.data_version)
 def get_quest_reviews():
     quest_id = request.args.get('quest_id')
     if not quest_id:
         return jsonify({"error": "quest_id parameter is required"}), 400
-    
-    db = sqlite3.connect(quest_db_path)
-    cursor = db.execute("SELECT * FROM quest_reviews WHERE quest_id = ?", (quest_id,))
-    reviews = []
-    for row in cursor:
-        reviews.append(row)
-    db.close()
-    
-    return jsonify(reviews)
+    return jsonify([review.model_dump() for review in quest_manager.get_quest_reviews(quest_id)])
+
+@app.route('/api/quest_bundle', methods=['GET'])
+@cached(quest_manager.read_pool.data_version)
+def quest_bundle():
+    """A quest with its submissions and reviews, the quest JSON is sent as stored"""
+    quest_id = request.args.get('quest_id')
+    if not quest_id:
+        return jsonify({"error": "quest_id parameter is required"}), 400
+    bundle = quest_manager.get_quest_bundle_json(quest_id)
+    if bundle is None:
+        return jsonify({"error": "quest not found"}), 404
+    return Response(bundle, mimetype='application/json')
 
 @app.route('/api/submit_quest_review', methods=['POST'])
 def submit_quest_review():
@@ -218,9 +439,12 @@ def submit_quest_review():
     review_id = str(uuid.uuid4())
     review_date = datetime.datetime.now().isoformat()
     
-    quest_manager.submit_quest_review(review_id, data['quest_id'], data['submission_id'], 'admin', 
-          data['quest_title'], data['review_notes'], data['accepted'], 
-          data['exp_awarded'], review_date)
+    try:
+        quest_manager.submit_quest_review(review_id, data['quest_id'], data['submission_id'], 'admin', 
+              data.get('quest_title', ''), data['review_notes'], data['accepted'], 
+              data['exp_awarded'], review_date)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
    
     return jsonify({"success": True, "review_id": review_id})
 
@@ -228,6 +452,33 @@ def submit_quest_review():
 def serve_quests():
     return send_from_directory('web', 'quests.html')
 
+def serve(host, port, threads):
+    """Multi-threaded serving for many open dashboards, waitress if it is installed, werkzeug's threaded server if not"""
+    global max_event_streams
+    if 'POLIS_MAX_EVENT_STREAMS' not in os.environ:
+        max_event_streams = max(1, threads // 2)
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        waitress_serve = None
+    if waitress_serve is not None:
+        print(f"Serving on http://{host}:{port} with waitress, {threads} threads, at most {max_event_streams} event streams")
+        # every open /api/events stream holds a thread
+        waitress_serve(app, host=host, port=port, threads=threads)
+    else:
+        from werkzeug.serving import run_simple
+        print(f"Serving on http://{host}:{port} with a thread per request, pip install waitress for a fixed thread pool")
+        run_simple(host, port, app, threaded=True)
+
 if __name__ == '__main__':
-    # Run Flask in debug mode for local development
-    app.run(debug=True, port=5001)
+    parser = argparse.ArgumentParser(description="polis dashboard server")
+    parser.add_argument("--serve", action="store_true", help="multi-threaded serving instead of the debug server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--threads", type=int, default=READ_POOL_SIZE, help="waitress worker threads")
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.host, args.port, args.threads)
+    else:
+        # Run Flask in debug mode for local development
+        app.run(debug=True, host=args.host, port=args.port)
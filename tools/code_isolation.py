@@ -1,7 +1,6 @@
 import os
 import sys
-from io import StringIO
-from contextlib import contextmanager, redirect_stdout, redirect_stderr
+from contextlib import contextmanager
 import ast
 import builtins
 import importlib
@@ -12,8 +11,12 @@ from pydantic import BaseModel
 from libs.get_directory_structure import get_directory_structure
 from datetime import datetime
 from typing import Optional
-from libs.common import ToolSchema, ToolCall, ToolsetDetails
+from libs.common import ToolSchema, ToolCall, ToolsetDetails, capture_thread_output
 from libs.agent import Agent
+from libs.metrics import metrics
+import time
+
+code_execution_seconds = metrics.histogram("polis_code_execution_seconds", "Seconds to compile and run agent code, outcome is success or error", ["outcome"])
 
 class CodeFile(BaseModel):
     filename: str
@@ -244,10 +247,8 @@ class SafeCodeExecutor:
         
     @contextmanager
     def capture_output(self):
-        """Capture stdout and stderr"""
-        stdout = StringIO()
-        stderr = StringIO()
-        with redirect_stdout(stdout), redirect_stderr(stderr):
+        """Capture stdout and stderr of this thread, agents printing on other threads still reach the real streams"""
+        with capture_thread_output() as (stdout, stderr):
             yield stdout, stderr
 
     def execute(self, code_string, code_intent):
@@ -277,11 +278,13 @@ class SafeCodeExecutor:
         # sha256 hash of code
         code_hash = hashlib.sha256(code_string.encode()).hexdigest()
 
+        start = time.perf_counter()
         try:
             with self.capture_output() as (stdout, stderr):
                 # Compile and execute the code
                 code = compile(code_string, '<string>', 'exec')
                 exec(code, self.safe_globals, {})
+                code_execution_seconds.labels("success").observe(time.perf_counter() - start)
 
                 code_execution_result = CodeExecutionResult(success=True, 
                                                             code_hash=code_hash,
@@ -307,6 +310,7 @@ class SafeCodeExecutor:
                 print(f"Error: {e}")
             print(f"Error: {e}")
             error_msg = f"{str(e)}"
+            code_execution_seconds.labels("error").observe(time.perf_counter() - start)
 
         return CodeExecutionResult(success=False, 
                                     stdout="", 
@@ -552,6 +556,9 @@ class SafeCodeExecutor:
     def get_tool_schemas(self):
         return [tool_schema.model_dump_json() for tool_schema in self.tool_schemas]
     
+    def get_read_only_tools(self):
+        return ["get_environment", "get_file", "get_pinned_files"]
+    
     def agent_tool_callback(self, agent: Agent, tool_call: ToolCall):
         if tool_call.toolset_id != "code_runner":
             return "Toolset not found"
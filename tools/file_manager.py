@@ -221,6 +221,9 @@ class FileManager:
     def get_tool_schemas(self):
         return [tool_schema.model_dump_json() for tool_schema in self.tool_schemas]
     
+    def get_read_only_tools(self):
+        return ["read_file", "list_files"]
+    
     def agent_tool_callback(self, agent: Agent, tool_call: ToolCall):
         if tool_call.toolset_id != "file_manager":
             return f"Toolset {tool_call.toolset_id} not found"
@@ -1,16 +1,29 @@
 
 from libs.common import ToolCall, ToolSchema, ToolsetDetails
 from libs.agent import Agent
+from libs.sqlite_pool import sqlite_seconds
+from libs.run_history_search import parse_search_terms, quote_terms
 
 from pydantic import BaseModel
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Optional
+import threading
 import random
+import os
 
 import uuid
 import sqlite3
 import json
 
+# bm25 weighs each word of a search by the number of posts containing it and counts them to do so, reading every
+# post of a common word. search_posts ranks while the words are in at most this many posts together, estimated
+# from the newest SEARCH_SAMPLE_POSTS, and returns the newest matches of commoner words instead
+MAX_RANKED_POSTINGS = 100000
+SEARCH_SAMPLE_POSTS = 2000
+# bm25 also costs microseconds per ranked post, searches rank the newest this many matches
+MAX_RANKED_POSTS = 1000
+
 class ForumUser(BaseModel):
     user_id: str
     name: str
@@ -31,6 +44,14 @@ class ForumPost(BaseModel):
     files: List[str]
     flags: List[str]
 
+class ForumPostSearchResult(BaseModel):
+    post_id: str
+    forum_id: str
+    author_id: str
+    title: Optional[str] = None
+    created_at: datetime
+    snippet: str # the best matching part of the post, matches in [brackets]
+
 class Forum(BaseModel):
     forum_id: str
     creator_id: str
@@ -39,11 +60,157 @@ class Forum(BaseModel):
     flags: List[str]
     posts: List[ForumPost]
 
+def add_feed_indexes(conn):
+    # posts of a forum or an author in time order, the index serves ORDER BY created_at in either direction
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_forum_created ON posts (forum_id, created_at DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_author_created ON posts (author_id, created_at DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users (name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_forums_title ON forums (title)")
+
+def add_forum_links(conn):
+    # which forums each user subscribes to and is active in, replacing the JSON arrays in users. The primary keys
+    # serve a user's forums and feeds, the forum_id indexes serve deleting a forum
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS forum_subscriptions (
+            user_id TEXT NOT NULL,
+            forum_id TEXT NOT NULL,
+            subscribed_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (user_id, forum_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS forum_memberships (
+            user_id TEXT NOT NULL,
+            forum_id TEXT NOT NULL,
+            joined_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (user_id, forum_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_forum_subscriptions_forum ON forum_subscriptions (forum_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_forum_memberships_forum ON forum_memberships (forum_id)")
+    for table, time_column, json_column in [("forum_subscriptions", "subscribed_at", "subscribed_forums"), ("forum_memberships", "joined_at", "current_forums")]:
+        # ids of forums that no longer exist are dropped, the time of the link is not known so the user's is used
+        conn.execute(f"""
+            INSERT OR IGNORE INTO {table} (user_id, forum_id, {time_column})
+            SELECT users.user_id, forums.forum_id, users.created_at
+            FROM users, json_each(CASE WHEN json_valid(users.{json_column}) THEN users.{json_column} ELSE '[]' END) AS listed
+            JOIN forums ON forums.forum_id = listed.value
+        """)
+        # the arrays are no longer read or kept up to date, emptied so they cannot be mistaken for the links
+        conn.execute(f"UPDATE users SET {json_column} = '[]'")
+
+def create_search_index(conn, table: str, columns: List[str], options: str = "", rowid_column: str = "rowid"):
+    """
+    An FTS5 index of columns of table, read from the table itself (external content) and kept in sync by triggers.
+    The index is keyed by rowid_column, which has to be an INTEGER PRIMARY KEY for the keys to survive a VACUUM
+    """
+    index = f"{table}_fts"
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({column_list}, content='{table}', content_rowid='{rowid_column}', tokenize='porter unicode61'{options})")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {index} (rowid, {column_list}) VALUES (new.{rowid_column}, {new_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {index} ({index}, rowid, {column_list}) VALUES ('delete', old.{rowid_column}, {old_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {column_list} ON {table} BEGIN
+            INSERT INTO {index} ({index}, rowid, {column_list}) VALUES ('delete', old.{rowid_column}, {old_values});
+            INSERT INTO {index} (rowid, {column_list}) VALUES (new.{rowid_column}, {new_values});
+        END
+    """)
+    conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+
+def add_search_indexes(conn, rowid_column: str = "rowid"):
+    create_search_index(conn, "forums", ["title", "description"], ", prefix='2 3'", rowid_column)
+    create_search_index(conn, "users", ["name", "persona"], ", prefix='2 3'", rowid_column)
+    # forum_id is indexed so a search of one forum intersects doclists instead of ranking every forum's matches
+    create_search_index(conn, "posts", ["forum_id", "title", "content"], ", prefix='2 3'", rowid_column)
+
+# the tables with search indexes as add_row_ids leaves them. row_id is last so SELECT * keeps its column positions
+# and the ids stay unique without being the primary key
+ROW_ID_TABLES = {
+    "users": """
+        user_id TEXT NOT NULL UNIQUE,
+        name TEXT NOT NULL,
+        persona TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        -- replaced by forum_subscriptions and forum_memberships, always '[]'
+        subscribed_forums TEXT NOT NULL,
+        current_forums TEXT NOT NULL,
+        row_id INTEGER PRIMARY KEY
+    """,
+    "forums": """
+        forum_id TEXT NOT NULL UNIQUE,
+        creator_id TEXT NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        flags TEXT NOT NULL,
+        row_id INTEGER PRIMARY KEY,
+        FOREIGN KEY (creator_id) REFERENCES users (user_id)
+    """,
+    "posts": """
+        post_id TEXT NOT NULL UNIQUE,
+        forum_id TEXT NOT NULL,
+        author_id TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        title TEXT,
+        parent_id TEXT,
+        files TEXT NOT NULL,
+        flags TEXT NOT NULL,
+        row_id INTEGER PRIMARY KEY,
+        FOREIGN KEY (forum_id) REFERENCES forums (forum_id),
+        FOREIGN KEY (author_id) REFERENCES users (user_id),
+        FOREIGN KEY (parent_id) REFERENCES posts (post_id)
+    """,
+}
+
+def add_row_ids(conn):
+    # the search indexes were keyed by implicit rowids, which a VACUUM may renumber once posts have been deleted.
+    # Each table is copied with its current rowids as row_id, an INTEGER PRIMARY KEY that a VACUUM keeps, and its
+    # index is recreated on row_id. Dropping a table drops its triggers and indexes, they are recreated as well
+    for table, columns in ROW_ID_TABLES.items():
+        conn.execute(f"DROP TABLE IF EXISTS {table}_fts")
+        conn.execute(f"CREATE TABLE {table}_with_row_id ({columns})")
+        column_names = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        conn.execute(f"INSERT INTO {table}_with_row_id (row_id, {', '.join(column_names)}) SELECT rowid, {', '.join(column_names)} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_with_row_id RENAME TO {table}")
+    add_feed_indexes(conn)
+    add_search_indexes(conn, "row_id")
+
+# schema changes to forum.db after the tables _init_db creates, in order. PRAGMA user_version holds how many the
+# file has had, append new migrations instead of editing ones that have shipped
+MIGRATIONS = [
+    add_feed_indexes,
+    add_forum_links,
+    add_search_indexes,
+    add_row_ids,
+]
+
 class Directory:
-    """This is the directory of forums"""
+    """
+    This is the directory of forums. Each thread gets its own WAL-journaled connection, kept for the life of
+    the thread, so statements stay prepared in its cache between tool calls.
+    """
     def __init__(self, db_path: str):
         self.db_path = db_path
         self.tool_schemas = []
+        self.local = threading.local()
+        # thread ident -> connection, so connections of finished threads can be closed
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+        self.read_seconds = sqlite_seconds.labels(os.path.basename(db_path), "read")
+        self.write_seconds = sqlite_seconds.labels(os.path.basename(db_path), "write")
+        # ids of users known to be committed, saves a query on every tool call
+        self.known_user_ids = set()
         self._init_db()
         
         names_of_tools_to_expose = [
@@ -55,6 +222,7 @@ class Directory:
             "create_forum",
             "delete_forum",
             "search_forums",
+            "search_posts",
             "get_forum_by_id",
             "get_forum_by_title",
             "get_random_forum",
@@ -83,13 +251,16 @@ class Directory:
 
     def _init_db(self):
         """Initialize the SQLite database with required tables"""
-        with sqlite3.connect(self.db_path) as conn:
+        # agents post while others read, with WAL readers do not wait on writers. The setting is stored in the file
+        self.get_connection().execute("PRAGMA journal_mode=WAL")
+        with self._transaction() as conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     user_id TEXT PRIMARY KEY,
                     name TEXT NOT NULL,
                     persona TEXT NOT NULL,
                     created_at TIMESTAMP NOT NULL,
+                    -- replaced by forum_subscriptions and forum_memberships, always '[]'
                     subscribed_forums TEXT NOT NULL,
                     current_forums TEXT NOT NULL
                 )
@@ -122,6 +293,88 @@ class Directory:
                     FOREIGN KEY (parent_id) REFERENCES posts (post_id)
                 )
             """)
+        self._migrate()
+
+    def _migrate(self):
+        """Upgrades the file in place with the MIGRATIONS it has not had, each in its own transaction"""
+        conn = self.get_connection()
+        applied = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, migration in enumerate(MIGRATIONS[applied:], start=applied + 1):
+            with self._transaction() as conn:
+                # checked again under the write lock, another process may have migrated the file meanwhile
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    continue
+                print(f"Migrating {self.db_path} to version {version}: {migration.__name__}")
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+
+    def get_connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "connection", None)
+        if conn is not None:
+            return conn
+        # autocommit, writes open their transactions in _transaction rather than sqlite3 opening one implicitly.
+        # check_same_thread is off so close() can close it from another thread
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False, cached_statements=256)
+        # with WAL, NORMAL only syncs at checkpoints, a power loss can lose the last posts but not corrupt the file
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self.local.connection = conn
+        self.local.depth = 0
+        with self.connections_lock:
+            live_threads = {thread.ident for thread in threading.enumerate()}
+            for thread_ident in [ident for ident in self.connections if ident not in live_threads]:
+                self.connections.pop(thread_ident).close()
+            self.connections[threading.get_ident()] = conn
+        return conn
+
+    @contextmanager
+    def _read(self):
+        with self.read_seconds.time():
+            yield self.get_connection()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        The thread's connection in a write transaction, committed when the with block ends and rolled back if it
+        raises. Calls nested in another method's transaction become savepoints of it.
+        """
+        conn = self.get_connection()
+        depth = self.local.depth
+        if depth > 0:
+            savepoint = f"forum_{depth}"
+            conn.execute(f"SAVEPOINT {savepoint}")
+            self.local.depth = depth + 1
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+                raise
+            else:
+                conn.execute(f"RELEASE {savepoint}")
+            finally:
+                self.local.depth = depth
+            return
+        with self.write_seconds.time():
+            # IMMEDIATE takes the write lock up front, a read upgraded to a write later can fail with
+            # "database is locked" without waiting on the busy timeout
+            conn.execute("BEGIN IMMEDIATE")
+            self.local.depth = 1
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+            finally:
+                self.local.depth = 0
+
+    def close(self):
+        with self.connections_lock:
+            for conn in self.connections.values():
+                conn.close()
+            self.connections = {}
+        self.local = threading.local()
 
     def _list_to_json(self, lst: List) -> str:
         """Convert a list to JSON string for storage"""
@@ -131,6 +384,53 @@ class Directory:
         """Convert a JSON string back to list"""
         return json.loads(json_str)
 
+    def _row_to_forum(self, row, posts: Optional[List[ForumPost]] = None) -> Forum:
+        return Forum(
+            forum_id=row[0],
+            creator_id=row[1],
+            title=row[2],
+            description=row[3],
+            flags=self._json_to_list(row[4]),
+            posts=posts if posts is not None else []
+        )
+
+    def _rows_to_users(self, conn, rows) -> List[ForumUser]:
+        """ForumUsers of users rows with the forums they subscribe to and are active in, two queries for all of them"""
+        if not rows:
+            return []
+        user_ids = [row[0] for row in rows]
+        placeholders = ",".join("?" * len(user_ids))
+        forum_ids = {}
+        for table, time_column in [("forum_subscriptions", "subscribed_at"), ("forum_memberships", "joined_at")]:
+            forum_ids[table] = {user_id: [] for user_id in user_ids}
+            cursor = conn.execute(f"SELECT user_id, forum_id FROM {table} WHERE user_id IN ({placeholders}) ORDER BY {time_column}", user_ids)
+            for user_id, forum_id in cursor:
+                forum_ids[table][user_id].append(forum_id)
+        return [
+            ForumUser(
+                user_id=row[0],
+                name=row[1],
+                persona=row[2],
+                created_at=datetime.fromisoformat(row[3]),
+                subscribed_forums=forum_ids["forum_subscriptions"][row[0]],
+                current_forums=forum_ids["forum_memberships"][row[0]]
+            )
+            for row in rows
+        ]
+
+    def _row_to_post(self, row) -> ForumPost:
+        return ForumPost(
+            forum_id=row[1],
+            post_id=row[0],
+            content=row[3],
+            author_id=row[2],
+            created_at=datetime.fromisoformat(row[4]),
+            title=row[5],
+            parent_id=row[6],
+            files=self._json_to_list(row[7]),
+            flags=self._json_to_list(row[8])
+        )
+
     ############### USER FUNCTIONS ###############
 
     def get_user_by_id(self, user_id: str) -> Optional[ForumUser]:
@@ -146,7 +446,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute(
                 "SELECT * FROM users WHERE user_id = ?", 
                 (user_id,)
@@ -154,14 +454,7 @@ class Directory:
             row = cursor.fetchone()
             if row is None:
                 return None
-            return ForumUser(
-                user_id=row[0],
-                name=row[1],
-                persona=row[2],
-                created_at=datetime.fromisoformat(row[3]),
-                subscribed_forums=self._json_to_list(row[4]),
-                current_forums=self._json_to_list(row[5])
-            )
+            return self._rows_to_users(conn, [row])[0]
     
     def get_user_by_name(self, name: str) -> Optional[ForumUser]:
         """
@@ -176,7 +469,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute(
                 "SELECT * FROM users WHERE name = ?",
                 (name,)
@@ -184,14 +477,7 @@ class Directory:
             row = cursor.fetchone()
             if row is None:
                 return None
-            return ForumUser(
-                user_id=row[0],
-                name=row[1],
-                persona=row[2],
-                created_at=datetime.fromisoformat(row[3]),
-                subscribed_forums=self._json_to_list(row[4]),
-                current_forums=self._json_to_list(row[5])
-            )
+            return self._rows_to_users(conn, [row])[0]
     
     def get_users(self, limit: int = 10, offset: int = 0) -> List[ForumUser]:
         """
@@ -210,22 +496,12 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute(
                 "SELECT * FROM users LIMIT ? OFFSET ?",
                 (limit, offset)
             )
-            return [
-                ForumUser(
-                    user_id=row[0],
-                    name=row[1],
-                    persona=row[2],
-                    created_at=datetime.fromisoformat(row[3]),
-                    subscribed_forums=self._json_to_list(row[4]),
-                    current_forums=self._json_to_list(row[5])
-                )
-                for row in cursor.fetchall()
-            ]
+            return self._rows_to_users(conn, cursor.fetchall())
     
     def get_user_count(self) -> int:
         """
@@ -236,7 +512,7 @@ class Directory:
             "arguments": []
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute("SELECT COUNT(*) FROM users")
             return cursor.fetchone()[0]
     
@@ -245,11 +521,11 @@ class Directory:
         {
             "toolset_id": "forum_toolset",
             "name": "search_users",
-            "description": "Searches for users",
+            "description": "Searches users by the words of their names and personas, best match first",
             "arguments": [{
                 "name": "query",
                 "type": "str",
-                "description": "The query to search for"
+                "description": "The words to search for"
             }, {
                 "name": "limit",
                 "type": "int",
@@ -257,25 +533,19 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        terms = parse_search_terms(query)
+        if len(terms) == 0:
+            return []
+        with self._read() as conn:
+            # every word is a prefix, a search for part of a name still finds it
             cursor = conn.execute(
-                "SELECT * FROM users WHERE name LIKE ? LIMIT ?",
-                (f"%{query}%", limit)
+                "SELECT users.* FROM users_fts JOIN users ON users.rowid = users_fts.rowid WHERE users_fts MATCH ? ORDER BY bm25(users_fts, 2.0, 1.0) LIMIT ?",
+                (quote_terms(terms, prefix=True), limit)
             )
-            return [
-                ForumUser(
-                    user_id=row[0],
-                    name=row[1],
-                    persona=row[2],
-                    created_at=datetime.fromisoformat(row[3]),
-                    subscribed_forums=self._json_to_list(row[4]),
-                    current_forums=self._json_to_list(row[5])
-                )
-                for row in cursor.fetchall()
-            ]
+            return self._rows_to_users(conn, cursor.fetchall())
 
     def create_user(self, user_id: str, name: str, persona: str) -> ForumUser:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
             now = datetime.now()
             conn.execute(
                 """
@@ -285,12 +555,33 @@ class Directory:
                 (user_id, name, persona, now.isoformat(), "[]", "[]")
             )
             return self.get_user_by_id(user_id)
+
+    def provision_users(self, users: List[tuple]):
+        """Creates the users of (user_id, name) pairs that do not exist yet, in one transaction"""
+        now = datetime.now().isoformat()
+        with self._transaction() as conn:
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO users (user_id, name, persona, created_at, subscribed_forums, current_forums)
+                VALUES (?, ?, '', ?, '[]', '[]')
+                """,
+                [(user_id, name, now) for user_id, name in users]
+            )
+        self.known_user_ids.update(user_id for user_id, name in users)
+
+    def ensure_user(self, user_id: str, name: str):
+        """Creates the user if it does not exist, without a query once the user is known"""
+        if user_id not in self.known_user_ids:
+            self.provision_users([(user_id, name)])
     
     def delete_user(self, user_id: str) -> str:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
             conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
             conn.execute("DELETE FROM posts WHERE author_id = ?", (user_id,))
-            return "User deleted"
+            conn.execute("DELETE FROM forum_subscriptions WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM forum_memberships WHERE user_id = ?", (user_id,))
+        self.known_user_ids.discard(user_id)
+        return "User deleted"
 
     ############### FORUM FUNCTIONS ###############
 
@@ -311,7 +602,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
             forum_id = str(uuid.uuid4())
             conn.execute(
                 """
@@ -320,7 +611,6 @@ class Directory:
                 """,
                 (forum_id, creator_id, title, description, self._list_to_json(flags))
             )
-            conn.commit()
             
             return Forum(
                 forum_id=forum_id,
@@ -344,38 +634,37 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("DELETE FROM forums WHERE forum_id = ? AND creator_id = ?", (forum_id, agent_id))
+        with self._transaction() as conn:
+            deleted = conn.execute("DELETE FROM forums WHERE forum_id = ? AND creator_id = ?", (forum_id, agent_id)).rowcount
             conn.execute("DELETE FROM posts WHERE forum_id = ?", (forum_id,))
+            if deleted:
+                conn.execute("DELETE FROM forum_subscriptions WHERE forum_id = ?", (forum_id,))
+                conn.execute("DELETE FROM forum_memberships WHERE forum_id = ?", (forum_id,))
         return "Forum deleted"
 
-    def search_forums(self, query: str):
+    def search_forums(self, query: str, limit: int = 20):
         """
         {
             "toolset_id": "forum_toolset",
             "name": "search_forums",
-            "description": "Searches for forums",
+            "description": "Searches forums by the words of their titles and descriptions, best match first",
             "arguments": [{
                 "name": "query",
                 "type": "str",
-                "description": "The query to search for"
+                "description": "The words to search for"
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        terms = parse_search_terms(query)
+        if len(terms) == 0:
+            return []
+        with self._read() as conn:
             cursor = conn.execute(
-                "SELECT * FROM forums WHERE title LIKE ?",
-                (f"%{query}%",)
+                "SELECT forums.* FROM forums_fts JOIN forums ON forums.rowid = forums_fts.rowid WHERE forums_fts MATCH ? ORDER BY bm25(forums_fts, 2.0, 1.0) LIMIT ?",
+                (quote_terms(terms, prefix=True), limit)
             )
             return [
-                Forum(
-                    forum_id=row[0],
-                    creator_id=row[1],
-                    title=row[2],
-                    description=row[3],
-                    flags=self._json_to_list(row[4]),
-                    posts=[]
-                )
+                self._row_to_forum(row)
                 for row in cursor.fetchall()
             ]
 
@@ -388,28 +677,52 @@ class Directory:
             "arguments": []
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute("SELECT COUNT(*) FROM forums")
             return cursor.fetchone()[0]
 
     def get_forum_objects(self, limit: int = 10, offset: int = 0):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute(
                 "SELECT * FROM forums LIMIT ? OFFSET ?",
                 (limit, offset)
             )
             forums = [
-                Forum(
-                    forum_id=row[0],
-                    creator_id=row[1],
-                    title=row[2],
-                    description=row[3],
-                    flags=self._json_to_list(row[4]),
-                    posts=[]
-                )
+                self._row_to_forum(row)
                 for row in cursor.fetchall()
             ]
             return forums
+
+    def get_forum_objects_by_ids(self, forum_ids: List[str]) -> List[Forum]:
+        """The forums of the given ids, without posts, in one query"""
+        if not forum_ids:
+            return []
+        with self._read() as conn:
+            placeholders = ','.join('?' * len(forum_ids))
+            cursor = conn.execute(
+                f"SELECT * FROM forums WHERE forum_id IN ({placeholders})",
+                forum_ids
+            )
+            return [self._row_to_forum(row) for row in cursor.fetchall()]
+
+    def _linked_forum_objects(self, table: str, time_column: str, user_id: str) -> Optional[List[Forum]]:
+        with self._read() as conn:
+            if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is None:
+                return None
+            cursor = conn.execute(
+                f"SELECT forums.* FROM {table} JOIN forums ON forums.forum_id = {table}.forum_id WHERE {table}.user_id = ? ORDER BY {table}.{time_column}",
+                (user_id,)
+            )
+            return [self._row_to_forum(row) for row in cursor.fetchall()]
+
+    def get_subscribed_forum_objects(self, user_id: str) -> Optional[List[Forum]]:
+        """The forums a user is subscribed to, None if the user does not exist"""
+        return self._linked_forum_objects("forum_subscriptions", "subscribed_at", user_id)
+
+    def get_current_forum_objects(self, user_id: str) -> Optional[List[Forum]]:
+        """The forums a user is currently active in, None if the user does not exist"""
+        return self._linked_forum_objects("forum_memberships", "joined_at", user_id)
+
     def get_forums(self, limit: int = 10, offset: int = 0):
         """
         {
@@ -427,26 +740,11 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT * FROM forums LIMIT ? OFFSET ?",
-                (limit, offset)
-            )
-            forums = [
-                Forum(
-                    forum_id=row[0],
-                    creator_id=row[1],
-                    title=row[2],
-                    description=row[3],
-                    flags=self._json_to_list(row[4]),
-                    posts=[]
-                )
-                for row in cursor.fetchall()
-            ]
-            result = "Available forums:\n"
-            for forum in forums:
-                result += f"- {forum.title} (id: {forum.forum_id})\n"
-            return result
+        forums = self.get_forum_objects(limit, offset)
+        result = "Available forums:\n"
+        for forum in forums:
+            result += f"- {forum.title} (id: {forum.forum_id})\n"
+        return result
      
     def get_forum_by_title(self, title: str):
         """
@@ -461,7 +759,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute(
                 "SELECT * FROM forums WHERE title = ?",
                 (title,)
@@ -469,16 +767,9 @@ class Directory:
             row = cursor.fetchone()
             if row is None:
                 return None
-            return Forum(
-                forum_id=row[0],
-                creator_id=row[1],
-                title=row[2],
-                description=row[3],
-                flags=self._json_to_list(row[4]),
-                posts=[]
-            )
+            return self._row_to_forum(row)
     
-    def get_forum_by_id(self, forum_id: str) -> Optional[Forum]:
+    def get_forum_by_id(self, forum_id: str, include_posts: bool = True) -> Optional[Forum]:
         """
         {
             "toolset_id": "forum_toolset",
@@ -491,7 +782,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             # First get the forum
             cursor = conn.execute(
                 "SELECT * FROM forums WHERE forum_id = ?",
@@ -500,6 +791,8 @@ class Directory:
             row = cursor.fetchone()
             if row is None:
                 return None
+            if not include_posts:
+                return self._row_to_forum(row)
                 
             # Then get all posts for this forum
             posts_cursor = conn.execute(
@@ -507,28 +800,11 @@ class Directory:
                 (forum_id,)
             )
             posts = [
-                ForumPost(
-                    forum_id=post_row[1],
-                    post_id=post_row[0],
-                    content=post_row[3],
-                    author_id=post_row[2],
-                    created_at=datetime.fromisoformat(post_row[4]),
-                    title=post_row[5],
-                    parent_id=post_row[6],
-                    files=self._json_to_list(post_row[7]),
-                    flags=self._json_to_list(post_row[8])
-                )
+                self._row_to_post(post_row)
                 for post_row in posts_cursor.fetchall()
             ]
             
-            return Forum(
-                forum_id=row[0],
-                creator_id=row[1],
-                title=row[2],
-                description=row[3],
-                flags=self._json_to_list(row[4]),
-                posts=posts
-            )
+            return self._row_to_forum(row, posts)
     
     def get_random_forum(self):
         """
@@ -539,19 +815,12 @@ class Directory:
             "arguments": []
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute("SELECT * FROM forums ORDER BY RANDOM() LIMIT 1")
             row = cursor.fetchone()
             if row is None:
                 return None
-            return Forum(
-                forum_id=row[0],
-                creator_id=row[1],
-                title=row[2],
-                description=row[3],
-                flags=self._json_to_list(row[4]),
-                posts=[]
-            )
+            return self._row_to_forum(row)
     
     def get_subscribed_forums(self, user_id: str):
         """
@@ -566,45 +835,16 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-            # First get the user's subscribed forums list
-            cursor = conn.execute(
-                "SELECT subscribed_forums FROM users WHERE user_id = ?",
-                (user_id,)
-            )
-            row = cursor.fetchone()
-            if row is None:
-                return "User not found"
-            
-            # Get the list of forum IDs
-            forum_ids = self._json_to_list(row[0])
-            if not forum_ids:
-                return "Subscribed forums:\n- No subscribed forums"
-            
-            # Now get the forums
-            placeholders = ','.join('?' * len(forum_ids))
-            cursor = conn.execute(
-                f"SELECT * FROM forums WHERE forum_id IN ({placeholders})",
-                forum_ids
-            )
-            forum_list = [
-                Forum(
-                    forum_id=row[0],
-                    creator_id=row[1],
-                    title=row[2],
-                    description=row[3],
-                    flags=self._json_to_list(row[4]),
-                    posts=[]
-                )
-                for row in cursor.fetchall()
-            ]
-            result = "Subscribed forums:\n"
-            if len(forum_list) == 0:
-                result += "- No subscribed forums"
-            else:
-                for forum in forum_list:
-                    result += f"- {forum.title} (id: {forum.forum_id})\n"
-            return result
+        forum_list = self.get_subscribed_forum_objects(user_id)
+        if forum_list is None:
+            return "User not found"
+        result = "Subscribed forums:\n"
+        if len(forum_list) == 0:
+            result += "- No subscribed forums"
+        else:
+            for forum in forum_list:
+                result += f"- {forum.title} (id: {forum.forum_id})\n"
+        return result
     
     def get_current_forums(self, user_id: str):
         """
@@ -615,45 +855,16 @@ class Directory:
             "arguments": []
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-            # First get the user's current forums list
-            cursor = conn.execute(
-                "SELECT current_forums FROM users WHERE user_id = ?",
-                (user_id,)
-            )
-            row = cursor.fetchone()
-            if row is None:
-                return "User not found"
-            
-            # Get the list of forum IDs
-            forum_ids = self._json_to_list(row[0])
-            if not forum_ids:
-                return "Current forums:\n- No current forums"
-            
-            # Now get the forums
-            placeholders = ','.join('?' * len(forum_ids))
-            cursor = conn.execute(
-                f"SELECT * FROM forums WHERE forum_id IN ({placeholders})",
-                forum_ids
-            )
-            forum_list = [
-                Forum(
-                    forum_id=row[0],
-                    creator_id=row[1],
-                    title=row[2],
-                    description=row[3],
-                    flags=self._json_to_list(row[4]),
-                    posts=[]
-                )
-                for row in cursor.fetchall()
-            ]
-            result = "Current forums:\n"
-            if len(forum_list) == 0:
-                result += "- No current forums"
-            else:
-                for forum in forum_list:
-                    result += f"- {forum.title} (id: {forum.forum_id})\n"
-            return result
+        forum_list = self.get_current_forum_objects(user_id)
+        if forum_list is None:
+            return "User not found"
+        result = "Current forums:\n"
+        if len(forum_list) == 0:
+            result += "- No current forums"
+        else:
+            for forum in forum_list:
+                result += f"- {forum.title} (id: {forum.forum_id})\n"
+        return result
     
     def subscribe_to_forum(self, user_id: str, forum_id: str):
         """
@@ -668,35 +879,17 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-            # First get current subscribed forums
-            cursor = conn.execute(
-                "SELECT subscribed_forums FROM users WHERE user_id = ?",
-                (user_id,)
-            )
-            row = cursor.fetchone()
-            if row is None:
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is None:
                 return "User not found"
-            
-            # check that forum exists
-            cursor = conn.execute(
-                "SELECT * FROM forums WHERE forum_id = ?",
-                (forum_id,)
-            )
-            row = cursor.fetchone()
-            if row is None:
+            forum = conn.execute("SELECT title FROM forums WHERE forum_id = ?", (forum_id,)).fetchone()
+            if forum is None:
                 return "Forum not found"
-            # Update the list
-            current_forums = self._json_to_list(row[0])
-            if forum_id not in current_forums:
-                current_forums.append(forum_id)
-            
-            # Save back to database
             conn.execute(
-                "UPDATE users SET subscribed_forums = ? WHERE user_id = ?",
-                (self._list_to_json(current_forums), user_id)
+                "INSERT OR IGNORE INTO forum_subscriptions (user_id, forum_id, subscribed_at) VALUES (?, ?, ?)",
+                (user_id, forum_id, datetime.now().isoformat())
             )
-            return f"Subscribed to forum {forum_id}: {self.get_forum_by_id(forum_id).title}"
+            return f"Subscribed to forum {forum_id}: {forum[0]}"
     
     def unsubscribe_from_forum(self, user_id: str, forum_id: str):
         """
@@ -711,27 +904,14 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-            # First get current subscribed forums
-            cursor = conn.execute(
-                "SELECT subscribed_forums FROM users WHERE user_id = ?",
-                (user_id,)
-            )
-            row = cursor.fetchone()
-            if row is None:
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is None:
                 return "User not found"
-            
-            # Update the list
-            current_forums = self._json_to_list(row[0])
-            if forum_id in current_forums:
-                current_forums.remove(forum_id)
-            
-            # Save back to database
-            conn.execute(
-                "UPDATE users SET subscribed_forums = ? WHERE user_id = ?",
-                (self._list_to_json(current_forums), user_id)
-            )
-            return f"Unsubscribed from forum {forum_id}: {self.get_forum_by_id(forum_id).title}"
+            conn.execute("DELETE FROM forum_subscriptions WHERE user_id = ? AND forum_id = ?", (user_id, forum_id))
+            forum = conn.execute("SELECT title FROM forums WHERE forum_id = ?", (forum_id,)).fetchone()
+            if forum is None:
+                return f"Unsubscribed from forum {forum_id}"
+            return f"Unsubscribed from forum {forum_id}: {forum[0]}"
 
     def join_forum(self, user_id: str, forum_id: str):
         """
@@ -746,36 +926,17 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-
-            # check that forum exists
-            cursor = conn.execute(
-                "SELECT * FROM forums WHERE forum_id = ?",
-                (forum_id,)
-            )
-            row = cursor.fetchone()
-            if row is None:
+        with self._transaction() as conn:
+            forum = conn.execute("SELECT title FROM forums WHERE forum_id = ?", (forum_id,)).fetchone()
+            if forum is None:
                 return "Forum not found"
-            # First get current forums
-            cursor = conn.execute(
-                "SELECT current_forums FROM users WHERE user_id = ?",
-                (user_id,)
-            )
-            row = cursor.fetchone()
-            if row is None:
+            if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is None:
                 return "User not found"
-            
-            # Update the list
-            current_forums = self._json_to_list(row[0])
-            if forum_id not in current_forums:
-                current_forums.append(forum_id)
-            
-            # Save back to database
             conn.execute(
-                "UPDATE users SET current_forums = ? WHERE user_id = ?",
-                (self._list_to_json(current_forums), user_id)
+                "INSERT OR IGNORE INTO forum_memberships (user_id, forum_id, joined_at) VALUES (?, ?, ?)",
+                (user_id, forum_id, datetime.now().isoformat())
             )
-            return f"Joined forum {forum_id}: {self.get_forum_by_id(forum_id).title}"
+            return f"Joined forum {forum_id}: {forum[0]}"
         
     def leave_forum(self, user_id: str, forum_id: str):
         """
@@ -790,27 +951,14 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-            # First get current forums
-            cursor = conn.execute(
-                "SELECT current_forums FROM users WHERE user_id = ?",
-                (user_id,)
-            )
-            row = cursor.fetchone()
-            if row is None:
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is None:
                 return "User not found"
-            
-            # Update the list
-            current_forums = self._json_to_list(row[0])
-            if forum_id in current_forums:
-                current_forums.remove(forum_id)
-            
-            # Save back to database
-            conn.execute(
-                "UPDATE users SET current_forums = ? WHERE user_id = ?",
-                (self._list_to_json(current_forums), user_id)
-            )
-            return f"Left forum {forum_id}: {self.get_forum_by_id(forum_id).title}"
+            conn.execute("DELETE FROM forum_memberships WHERE user_id = ? AND forum_id = ?", (user_id, forum_id))
+            forum = conn.execute("SELECT title FROM forums WHERE forum_id = ?", (forum_id,)).fetchone()
+            if forum is None:
+                return f"Left forum {forum_id}"
+            return f"Left forum {forum_id}: {forum[0]}"
     
     ############### Post Functions ###############
     
@@ -836,7 +984,7 @@ class Directory:
         }
         """
         post_id = str(uuid.uuid4())
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
             conn.execute(
                 "INSERT INTO posts (post_id, forum_id, author_id, content, created_at, title, parent_id, files, flags) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
                 (post_id, forum_id, author_id, content, datetime.now().isoformat(), title, parent_id, self._list_to_json(files), self._list_to_json(flags))
@@ -857,7 +1005,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
             conn.execute("DELETE FROM posts WHERE post_id = ? AND author_id = ?", (post_id, agent_id))
         return "Post deleted"
     
@@ -874,7 +1022,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute(
                 "SELECT * FROM posts WHERE post_id = ?",
                 (post_id,)
@@ -882,17 +1030,7 @@ class Directory:
             row = cursor.fetchone()
             if row is None:
                 return None
-            return ForumPost(
-                forum_id=row[1],
-                post_id=row[0],
-                content=row[3],
-                author_id=row[2],
-                created_at=datetime.fromisoformat(row[4]),
-                title=row[5],
-                parent_id=row[6],
-                files=self._json_to_list(row[7]),
-                flags=self._json_to_list(row[8])
-            )
+            return self._row_to_post(row)
      
     def get_posts_by_author(self, author_id: str, limit: int = 10, offset: int = 0):
         """
@@ -915,7 +1053,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute(
                 "SELECT * FROM posts WHERE author_id = ? ORDER BY created_at LIMIT ? OFFSET ?",
                 (author_id, limit, offset)
@@ -924,17 +1062,7 @@ class Directory:
             if rows is None:
                 return []
             return [
-                ForumPost(
-                    forum_id=row[1],
-                    post_id=row[0],
-                    content=row[3],
-                    author_id=row[2],
-                    created_at=datetime.fromisoformat(row[4]),
-                    title=row[5],
-                    parent_id=row[6],
-                    files=self._json_to_list(row[7]),
-                    flags=self._json_to_list(row[8])
-                )
+                self._row_to_post(row)
                 for row in rows
             ]
     
@@ -959,7 +1087,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._read() as conn:
             cursor = conn.execute(
                 "SELECT * FROM posts WHERE forum_id = ? ORDER BY created_at LIMIT ? OFFSET ?",
                 (forum_id, limit, offset)
@@ -968,20 +1096,25 @@ class Directory:
             if rows is None:
                 return []
             return [
-                ForumPost(
-                    forum_id=row[1],
-                    post_id=row[0],
-                    content=row[3],
-                    author_id=row[2],
-                    created_at=datetime.fromisoformat(row[4]),
-                    title=row[5],
-                    parent_id=row[6],
-                    files=self._json_to_list(row[7]),
-                    flags=self._json_to_list(row[8])
-                )
+                self._row_to_post(row)
                 for row in rows
             ]
 
+    def _linked_posts(self, table: str, user_id: str, limit: int, offset: int) -> List[ForumPost]:
+        with self._read() as conn:
+            # each forum's posts come newest first from idx_posts_forum_created, SQLite stops reading a forum once
+            # its posts are older than the limit + offset newest so far, so many forums per user stay cheap
+            cursor = conn.execute(
+                f"""
+                SELECT posts.* FROM {table}
+                JOIN posts ON posts.forum_id = {table}.forum_id
+                WHERE {table}.user_id = ?
+                ORDER BY posts.created_at DESC LIMIT ? OFFSET ?
+                """,
+                (user_id, limit, offset)
+            )
+            return [self._row_to_post(row) for row in cursor.fetchall()]
+
     def get_subscribed_posts(self, user_id: str, limit: int = 10, offset: int = 0):
         """
         {
@@ -999,28 +1132,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT * FROM posts WHERE forum_id IN (SELECT forum_id FROM users WHERE user_id = ? AND ? IN (SELECT * FROM json_each(subscribed_forums))) ORDER BY created_at DESC LIMIT ? OFFSET ?",
-                (user_id, user_id, limit, offset)
-            )
-            rows = cursor.fetchall()
-            if rows is None:
-                return []
-            return [
-                ForumPost(
-                    forum_id=row[1],
-                    post_id=row[0],
-                    content=row[3],
-                    author_id=row[2],
-                    created_at=datetime.fromisoformat(row[4]),
-                    title=row[5],
-                    parent_id=row[6],
-                    files=self._json_to_list(row[7]),
-                    flags=self._json_to_list(row[8])
-                )
-                for row in rows
-            ]
+        return self._linked_posts("forum_subscriptions", user_id, limit, offset)
         
     def get_current_posts(self, user_id: str, limit: int = 10, offset: int = 0):
         """
@@ -1039,37 +1151,89 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                """
-                SELECT * FROM posts 
-                WHERE forum_id IN (
-                    SELECT json_each.value 
-                    FROM users, json_each(users.current_forums) 
-                    WHERE users.user_id = ?
-                )
-                ORDER BY created_at DESC LIMIT ? OFFSET ?
-                """,
-                (user_id, limit, offset)
-            )
-            rows = cursor.fetchall()
-            if rows is None:
-                return []
-            return [
-                ForumPost(
-                    forum_id=row[1],
+        return self._linked_posts("forum_memberships", user_id, limit, offset)
+        
+    def search_posts(self, query: str, forum_id: Optional[str] = None, limit: int = 10) -> List[ForumPostSearchResult]:
+        """
+        {
+            "toolset_id": "forum_toolset",
+            "name": "search_posts",
+            "description": "Searches posts by the words of their titles and content, best match first, or newest first for words most posts contain. A word ending in * matches words starting with it",
+            "arguments": [{
+                "name": "query",
+                "type": "str",
+                "description": "The words to search for"
+            }, {
+                "name": "forum_id",
+                "type": "str",
+                "description": "Only search the posts of this forum (optional)"
+            }, {
+                "name": "limit",
+                "type": "int",
+                "description": "The number of posts to return"
+            }]
+        }
+        """
+        terms = parse_search_terms(query)
+        if len(terms) == 0:
+            return []
+        phrases = ["{title content} : " + quote_terms([term]) for term in terms]
+        forum_filter = ""
+        params = []
+        if forum_id is not None:
+            # the index matches forum ids as token phrases, the exact id is checked on the post
+            phrases.insert(0, f'forum_id : "{forum_id.replace(chr(34), chr(34) * 2)}"')
+            forum_filter = " AND posts.forum_id = ?"
+            params = [forum_id]
+        match_query = " AND ".join(phrases)
+        with self._read() as conn:
+            newest = conn.execute("SELECT max(rowid) FROM posts").fetchone()[0] or 0
+            sample = min(SEARCH_SAMPLE_POSTS, newest)
+            postings = 0
+            for phrase in phrases:
+                in_sample = conn.execute("SELECT count(*) FROM posts_fts WHERE posts_fts MATCH ? AND rowid > ?", (phrase, newest - sample)).fetchone()[0]
+                postings += in_sample * newest / max(sample, 1)
+            if postings > MAX_RANKED_POSTINGS:
+                ranked = conn.execute(f"""
+                    SELECT posts_fts.rowid FROM posts_fts JOIN posts ON posts.rowid = posts_fts.rowid
+                    WHERE posts_fts MATCH ?{forum_filter}
+                    ORDER BY posts_fts.rowid DESC LIMIT ?
+                    """, [match_query] + params + [limit]
+                ).fetchall()
+            else:
+                # the oldest post ranked, found by walking the matches newest first
+                oldest_candidate = conn.execute(
+                    "SELECT rowid FROM posts_fts WHERE posts_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                    (match_query, MAX_RANKED_POSTS - 1)
+                ).fetchone()
+                ranked = conn.execute(f"""
+                    SELECT posts_fts.rowid FROM posts_fts JOIN posts ON posts.rowid = posts_fts.rowid
+                    WHERE posts_fts MATCH ? AND posts_fts.rowid >= ?{forum_filter}
+                    ORDER BY bm25(posts_fts, 0.0, 2.0, 1.0) LIMIT ?
+                    """, [match_query, oldest_candidate[0] if oldest_candidate is not None else 0] + params + [limit]
+                ).fetchall()
+            # snippets are cut for the returned posts only, cutting them while ranking would read every candidate
+            results = []
+            for (rowid,) in ranked:
+                row = conn.execute(
+                    """
+                    SELECT posts.post_id, posts.forum_id, posts.author_id, posts.title, posts.created_at,
+                        snippet(posts_fts, 2, '[', ']', '...', 24)
+                    FROM posts_fts JOIN posts ON posts.rowid = posts_fts.rowid
+                    WHERE posts_fts MATCH ? AND posts_fts.rowid = ?
+                    """,
+                    (match_query, rowid)
+                ).fetchone()
+                results.append(ForumPostSearchResult(
                     post_id=row[0],
-                    content=row[3],
+                    forum_id=row[1],
                     author_id=row[2],
+                    title=row[3],
                     created_at=datetime.fromisoformat(row[4]),
-                    title=row[5],
-                    parent_id=row[6],
-                    files=self._json_to_list(row[7]),
-                    flags=self._json_to_list(row[8])
-                )
-                for row in rows
-            ]
-        
+                    snippet=row[5]
+                ))
+            return results
+
     def reply_to_post(self, user_id: str, post_id: str, content: str):
         """
         {
@@ -1087,7 +1251,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
             cursor = conn.execute(
                 "SELECT * FROM posts WHERE post_id = ?",
                 (post_id,)
@@ -1112,7 +1276,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
             conn.execute(
                 "UPDATE users SET name = ? WHERE user_id = ?",
                 (name, user_id)
@@ -1132,7 +1296,7 @@ class Directory:
             }]
         }
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
             conn.execute(
                 "UPDATE users SET persona = ? WHERE user_id = ?",
                 (persona, user_id)
@@ -1150,14 +1314,37 @@ class Directory:
     def get_tool_schemas(self):
         return [tool_schema.model_dump_json() for tool_schema in self.tool_schemas]
     
+    def get_read_only_tools(self):
+        return [
+            "get_user_by_id",
+            "get_user_by_name",
+            "get_users",
+            "get_user_count",
+            "search_users",
+            "search_forums",
+            "search_posts",
+            "get_forum_count",
+            "get_forums",
+            "get_forum_by_title",
+            "get_forum_by_id",
+            "get_random_forum",
+            "get_post_by_id",
+            "get_posts_by_forum",
+            "get_posts_by_author",
+            "get_subscribed_posts",
+            "get_current_posts",
+            "get_subscribed_forums",
+            "get_current_forums"
+        ]
+    
     def agent_tool_callback(self, agent: Agent, tool_call: ToolCall):
         if tool_call.toolset_id != "forum_toolset":
             raise ValueError(f"Toolset {tool_call.toolset_id} not found")
         
-        # check that agent has a user, otherwise create one (they share ids)
-        agent_user = next((user for user in self.get_users() if user.user_id == agent.id), None)
-        if agent_user is None:
-            agent_user = self.create_user(agent.id, agent.name, "")
+        # agents and their forum users share ids, build_world provisions them up front. Only writes need the user,
+        # read-only calls run concurrently and must not write, a read by an agent without a user finds nothing of its own
+        if tool_call.name not in self.get_read_only_tools():
+            self.ensure_user(agent.id, agent.name)
 
         if tool_call.name == "get_user_by_id":
             return self.get_user_by_id(tool_call.arguments["user_id"]).model_dump_json()
@@ -1182,6 +1369,10 @@ class Directory:
             return self.delete_forum(agent.id, tool_call.arguments["forum_id"])
         elif tool_call.name == "search_forums":
             return [forum.model_dump_json() for forum in self.search_forums(tool_call.arguments["query"])]
+        elif tool_call.name == "search_posts":
+            limit = tool_call.arguments["limit"] if "limit" in tool_call.arguments else 10
+            forum_id = tool_call.arguments["forum_id"] if tool_call.arguments.get("forum_id") else None
+            return [result.model_dump_json() for result in self.search_posts(tool_call.arguments["query"], forum_id, limit)]
         elif tool_call.name == "get_forum_count":
             return self.get_forum_count()
         elif tool_call.name == "get_forums":
@@ -1215,7 +1406,9 @@ class Directory:
         elif tool_call.name == "get_posts_by_author":
             return [post.model_dump_json() for post in self.get_posts_by_author(tool_call.arguments["author_id"], tool_call.arguments["limit"], tool_call.arguments["offset"])]
         elif tool_call.name == "get_subscribed_posts":
-            return [post.model_dump_json() for post in self.get_subscribed_posts(tool_call.arguments["user_id"], tool_call.arguments["limit"], tool_call.arguments["offset"])]
+            limit = tool_call.arguments["limit"] if "limit" in tool_call.arguments else 10
+            offset = tool_call.arguments["offset"] if "offset" in tool_call.arguments else 0
+            return [post.model_dump_json() for post in self.get_subscribed_posts(agent.id, limit, offset)]
         elif tool_call.name == "get_current_posts":
             limit = tool_call.arguments["limit"] if "limit" in tool_call.arguments else 10
             offset = tool_call.arguments["offset"] if "offset" in tool_call.arguments else 0
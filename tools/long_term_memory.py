@@ -7,9 +7,6 @@ from chromadb.config import Settings
 
 from libs.common import convert_file, chunk_text, embed_with_ollama
 
-import warnings
-warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
-
 
 class MemoryRetrievalPassResult(BaseModel):
     memories: List[str]
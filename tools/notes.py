@@ -75,6 +75,9 @@ class NotesManager:
     def get_tool_schemas(self):
         return [tool_schema.model_dump_json() for tool_schema in self.tool_schemas]
     
+    def get_read_only_tools(self):
+        return ["get_notes"]
+    
     def agent_tool_callback(self, agent: Agent, tool_call: ToolCall):
         if tool_call.toolset_id != "notes_manager":
             raise ValueError(f"Toolset {tool_call.toolset_id} not found")
@@ -75,7 +75,7 @@ Respond in the following JSON format:
             Message(role="system", content=persona_creation_system_prompt),
             Message(role="user", content=persona_creation_user_prompt)
         ]
-        persona_output = call_ollama_chat(llm_url, model, messages, json_schema=Persona.model_json_schema())
+        persona_output = call_ollama_chat(llm_url, model, messages, json_schema=Persona.model_json_schema(), call_site="persona_creation")
         persona = Persona.model_validate_json(persona_output)
         self.personas[name] = persona
         return f"Persona {name} created: \n{persona}"
@@ -164,6 +164,9 @@ Respond in the following JSON format:
     def get_tool_schemas(self):
         return [tool_schema.model_dump_json() for tool_schema in self.tool_schemas]
     
+    def get_read_only_tools(self):
+        return ["get_persona_list", "get_persona_by_index", "get_current_persona"]
+    
     def agent_tool_callback(self, agent: Agent, tool_call: ToolCall):
         if tool_call.toolset_id != "persona":
             raise ValueError(f"Toolset {tool_call.toolset_id} not found")
@@ -1,13 +1,13 @@
 from pydantic import BaseModel, Field
-from typing import Dict, List
+from typing import Dict, List, Optional
+from contextlib import contextmanager
 
 from libs.common import call_ollama_chat, Message, apply_unified_diff, ToolSchema, ToolCall, ToolsetDetails
 from libs.agent import Agent
+from libs.change_events import create_change_events_table, record_change_event
+import threading
 import sqlite3
 
-# TODO: figure out why these keep happening, looks like it's the new version of ollama
-import warnings
-warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
 
 class QuestStep(BaseModel):
     title: str = Field(description="The title of the step.")
@@ -77,15 +77,23 @@ class QuestManager:
         self.quest_submissions = []
         self.agent_id = agent_id
         self.db_path = db_path
-        self.db = sqlite3.connect(self.db_path)
-        self.db.row_factory = sqlite3.Row
-        self.db.execute("""CREATE TABLE IF NOT EXISTS quests (
+        # ReadOnlyConnectionPool for the queries, set by the web server
+        self.read_pool = None
+        # passes of the owning agent run on different orchestrator worker threads and read-only tool calls run
+        # at once, so each thread gets its own connection rather than sharing one whose transactions interleave
+        self.local = threading.local()
+        # thread ident -> connection, so connections of finished threads can be closed
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+        conn = self.get_connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS quests (
             quest_id TEXT PRIMARY KEY,
             agent_id TEXT,
             quest_title TEXT,
             quest TEXT
         )""")
-        self.db.execute("""CREATE TABLE IF NOT EXISTS quest_submissions (
+        conn.execute("""CREATE TABLE IF NOT EXISTS quest_submissions (
             submission_id TEXT PRIMARY KEY,
             quest_id TEXT,
             submitter_id TEXT,
@@ -93,7 +101,7 @@ class QuestManager:
             submission_notes TEXT,
             submission_date TEXT
         )""")
-        self.db.execute("""CREATE TABLE IF NOT EXISTS quest_reviews (
+        conn.execute("""CREATE TABLE IF NOT EXISTS quest_reviews (
             review_id TEXT PRIMARY KEY,
             quest_id TEXT,
             quest_submission_id TEXT,
@@ -104,6 +112,12 @@ class QuestManager:
             exp_awarded INTEGER,
             review_date TEXT
         )""")
+        # quest details are looked up by quest_id, the quest list by agent_id
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_quests_agent_id ON quests (agent_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_quest_submissions_quest_id ON quest_submissions (quest_id, submission_date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_quest_reviews_quest_id ON quest_reviews (quest_id, review_date)")
+        create_change_events_table(conn)
+        conn.commit()
         
         # Load quests from database
         self._load_quests_from_db()
@@ -133,9 +147,32 @@ class QuestManager:
             tool_schema = ToolSchema.model_validate_json(docstring)
             self.tool_schemas.append(tool_schema)
 
+    def get_connection(self):
+        conn = getattr(self.local, "connection", None)
+        if conn is not None:
+            return conn
+        # only ever used by this thread, check_same_thread is off so close() can close it from another thread,
+        # writers from other threads or processes are waited for up to 30s rather than the default 5s
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        self.local.connection = conn
+        with self.connections_lock:
+            live_threads = {thread.ident for thread in threading.enumerate()}
+            for thread_ident in [ident for ident in self.connections if ident not in live_threads]:
+                self.connections.pop(thread_ident).close()
+            self.connections[threading.get_ident()] = conn
+        return conn
+
+    def close(self):
+        with self.connections_lock:
+            for conn in self.connections.values():
+                conn.close()
+            self.connections = {}
+        self.local = threading.local()
+
     def _load_quests_from_db(self):
         """Load quests from the database for this agent"""
-        cursor = self.db.execute("SELECT * FROM quests WHERE agent_id = ?", (self.agent_id,))
+        cursor = self.get_connection().execute("SELECT * FROM quests WHERE agent_id = ?", (self.agent_id,))
         rows = cursor.fetchall()
         for row in rows:
             quest_data = row['quest']
@@ -149,23 +186,23 @@ class QuestManager:
         
         if agent_id is None:
             agent_id = self.agent_id
-        curr = sqlite3.connect(self.db_path)
-        # Check if quest already exists
-        cursor = curr.execute("SELECT quest_id FROM quests WHERE agent_id = ? AND quest_title = ?", 
-                               (agent_id, quest.title))
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Update existing quest
-            curr.execute("UPDATE quests SET quest = ? WHERE quest_id = ?", 
-                          (quest.model_dump_json(), existing['quest_id']))
-        else:
-            # Insert new quest
-            curr.execute("INSERT INTO quests (quest_id, agent_id, quest_title, quest) VALUES (?, ?, ?, ?)",
-                          (quest_id, agent_id, quest.title, quest.model_dump_json()))
-        
-        curr.commit()
-        curr.close()
+        conn = self.get_connection()
+        with conn:
+            # Check if quest already exists
+            cursor = conn.execute("SELECT quest_id FROM quests WHERE agent_id = ? AND quest_title = ?", 
+                                   (agent_id, quest.title))
+            existing = cursor.fetchone()
+            
+            if existing:
+                # Update existing quest
+                quest_id = existing['quest_id']
+                conn.execute("UPDATE quests SET quest = ? WHERE quest_id = ?", 
+                              (quest.model_dump_json(), quest_id))
+            else:
+                # Insert new quest
+                conn.execute("INSERT INTO quests (quest_id, agent_id, quest_title, quest) VALUES (?, ?, ?, ?)",
+                              (quest_id, agent_id, quest.title, quest.model_dump_json()))
+            record_change_event(conn, "quest", {"quest_id": quest_id, "agent_id": agent_id, "quest_title": quest.title, "status": quest.status})
         
     def _save_quest_submission_to_db(self, submission: QuestSubmission, quest_id: str):
         """Save a quest submission to the database"""
@@ -175,14 +212,13 @@ class QuestManager:
         submission_id = str(uuid.uuid4())
         submission_date = datetime.datetime.now().isoformat()
         
-        self.db.execute("""
-            INSERT INTO quest_submissions 
-            (submission_id, quest_id, submitter_id, quest_title, submission_notes, submission_date) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (submission_id, quest_id, self.agent_id, submission.quest_title, 
-              submission.submission_notes, submission_date))
-        
-        self.db.commit()
+        with self.get_connection() as conn:
+            conn.execute("""
+                INSERT INTO quest_submissions 
+                (submission_id, quest_id, submitter_id, quest_title, submission_notes, submission_date) 
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (submission_id, quest_id, self.agent_id, submission.quest_title, 
+                  submission.submission_notes, submission_date))
         return submission_id
 
     def _create_quest_for_agent(self, llm_url: str, agent_id: str, overall_goal: str, details: str, context: str):
@@ -206,7 +242,7 @@ Please respond with JSON in the following format:
         messages = [Message(role="system", content=quest_system_prompt)]
         messages.append(Message(role="user", content=user_prompt))
 
-        response = call_ollama_chat(llm_url, "a_model", messages, json_schema=QuestGenerationOutput.model_json_schema())
+        response = call_ollama_chat(llm_url, None, messages, json_schema=QuestGenerationOutput.model_json_schema(), call_site="quest_generation")
         quest_generation_output = QuestGenerationOutput.model_validate_json(response)
 
         quest = Quest(
@@ -307,7 +343,7 @@ Please respond with JSON in the following format:
             messages.append(Message(role="user", content=summary_string))
         messages.append(Message(role="user", content=user_prompt))
 
-        response = call_ollama_chat(llm_url, "a_model", messages, json_schema=QuestGenerationOutput.model_json_schema())
+        response = call_ollama_chat(llm_url, agent.model, messages, json_schema=QuestGenerationOutput.model_json_schema(), call_site="quest_generation", sticky_key=agent.id)
         quest_generation_output = QuestGenerationOutput.model_validate_json(response)
 
         # TODO: stash generation output to a file for debugging
@@ -679,7 +715,7 @@ Please respond with JSON in the following format:
         self.quest_submissions.append(quest_submission)
         
         # Get quest_id from database
-        cursor = self.db.execute("SELECT quest_id FROM quests WHERE agent_id = ? AND quest_title = ?", 
+        cursor = self.get_connection().execute("SELECT quest_id FROM quests WHERE agent_id = ? AND quest_title = ?", 
                                (self.agent_id, quest_title))
         row = cursor.fetchone()
         if row:
@@ -713,6 +749,101 @@ Please respond with JSON in the following format:
         self._save_quest_to_db(quest)
         return f"Quest {quest_title} abandoned"
     
+    ############### Queries ###############
+    # typed rows for callers such as server.py, any agent's quests can be read
+
+    @contextmanager
+    def _read_connection(self):
+        if self.read_pool is not None:
+            with self.read_pool.connection() as conn:
+                yield conn
+        else:
+            yield self.get_connection()
+
+    def get_quest_rows(self, agent_id: str) -> List[QuestDBObject]:
+        """The quests of an agent, the quest JSON is returned as stored"""
+        with self._read_connection() as conn:
+            rows = conn.execute("SELECT quest_id, agent_id, quest_title, quest FROM quests WHERE agent_id = ?", (agent_id,)).fetchall()
+        return [QuestDBObject(**dict(row)) for row in rows]
+
+    def get_quest_submissions(self, quest_id: str) -> List[QuestSubmissionDBObject]:
+        with self._read_connection() as conn:
+            rows = conn.execute("SELECT * FROM quest_submissions WHERE quest_id = ? ORDER BY submission_date", (quest_id,)).fetchall()
+        return [QuestSubmissionDBObject(**dict(row)) for row in rows]
+
+    def get_quest_reviews(self, quest_id: str) -> List[QuestReviewDBObject]:
+        with self._read_connection() as conn:
+            rows = conn.execute("SELECT * FROM quest_reviews WHERE quest_id = ? ORDER BY review_date", (quest_id,)).fetchall()
+        return [QuestReviewDBObject(**dict(row)) for row in rows]
+
+    def get_quest_bundle_json(self, quest_id: str) -> Optional[str]:
+        """
+        The quest row, its submissions and its reviews as one JSON object, None if there is no such quest.
+        Built by a single statement, so it is a consistent snapshot, and the stored quest JSON is embedded as is
+        """
+        with self._read_connection() as conn:
+            row = conn.execute("""
+                SELECT json_object(
+                    'quest_id', quests.quest_id,
+                    'agent_id', quests.agent_id,
+                    'quest_title', quests.quest_title,
+                    'quest', json(quests.quest),
+                    'submissions', (
+                        SELECT json_group_array(json_object(
+                            'submission_id', submission_id, 'quest_id', quest_id, 'submitter_id', submitter_id,
+                            'quest_title', quest_title, 'submission_notes', submission_notes, 'submission_date', submission_date
+                        ))
+                        FROM (SELECT * FROM quest_submissions WHERE quest_id = quests.quest_id ORDER BY submission_date)
+                    ),
+                    'reviews', (
+                        SELECT json_group_array(json_object(
+                            'review_id', review_id, 'quest_id', quest_id, 'quest_submission_id', quest_submission_id,
+                            'reviewer_id', reviewer_id, 'quest_title', quest_title, 'review_notes', review_notes,
+                            'accepted', json(CASE WHEN accepted THEN 'true' ELSE 'false' END),
+                            'exp_awarded', exp_awarded, 'review_date', review_date
+                        ))
+                        FROM (SELECT * FROM quest_reviews WHERE quest_id = quests.quest_id ORDER BY review_date)
+                    )
+                )
+                FROM quests WHERE quest_id = ?
+            """, (quest_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def submit_quest_review(self, review_id: str, quest_id: str, quest_submission_id: str, reviewer_id: str, quest_title: str, review_notes: str, accepted: bool, exp_awarded: int, review_date: str) -> QuestReviewDBObject:
+        """Saves a review of a submission and sets the quest to "completed" if accepted, back to "active" if not"""
+        conn = self.get_connection()
+        # request threads of the threaded server review at once, the quest JSON is read and rewritten under one
+        # write lock so a concurrent review cannot overwrite this one's status and note with a stale copy
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            row = conn.execute("SELECT agent_id, quest_title, quest FROM quests WHERE quest_id = ?", (quest_id,)).fetchone()
+            if not quest_title and row is not None:
+                quest_title = row['quest_title']
+            review = QuestReviewDBObject(
+                review_id=review_id,
+                quest_id=quest_id,
+                quest_submission_id=quest_submission_id,
+                reviewer_id=reviewer_id,
+                quest_title=quest_title,
+                review_notes=review_notes,
+                accepted=accepted,
+                exp_awarded=exp_awarded,
+                review_date=review_date
+            )
+            conn.execute("""
+                INSERT INTO quest_reviews
+                (review_id, quest_id, quest_submission_id, reviewer_id, quest_title, review_notes, accepted, exp_awarded, review_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (review.review_id, review.quest_id, review.quest_submission_id, review.reviewer_id, review.quest_title,
+                  review.review_notes, review.accepted, review.exp_awarded, review.review_date))
+            if row is not None:
+                quest = Quest.model_validate_json(row['quest'])
+                quest.status = "completed" if accepted else "active"
+                quest.notes.append(f"Review note: {review_notes}")
+                conn.execute("UPDATE quests SET quest = ? WHERE quest_id = ?", (quest.model_dump_json(), quest_id))
+                record_change_event(conn, "quest", {"quest_id": quest_id, "agent_id": row['agent_id'], "quest_title": quest.title, "status": quest.status})
+        return review
+
     ############### Agent Interface ###############
     def get_toolset_details(self):
         return ToolsetDetails(
@@ -724,6 +855,9 @@ Please respond with JSON in the following format:
     def get_tool_schemas(self):
         return [tool_schema.model_dump_json() for tool_schema in self.tool_schemas]
     
+    def get_read_only_tools(self):
+        return ["get_quest_list", "get_quest", "get_quest_step", "get_current_quest", "get_current_quest_step"]
+    
     def agent_tool_callback(self, agent: Agent, tool_call: ToolCall):
         if tool_call.toolset_id != "quest_manager":
             raise ValueError(f"Toolset {tool_call.toolset_id} not found")
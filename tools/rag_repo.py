@@ -6,9 +6,6 @@ from chromadb.config import Settings
 
 from libs.common import convert_file, chunk_text, embed_with_ollama
 
-import warnings
-warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
-
 
 class RagRepo:
     def __init__(self, repo_path, llm_server, embedding_model):
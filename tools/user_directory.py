@@ -1,7 +1,9 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
+from contextlib import contextmanager
 from libs.agent import Agent
 from libs.common import ToolsetDetails, ToolCall, ToolSchema
+from libs.change_events import create_change_events_table, record_change_event
 import uuid
 import sqlite3
 import json
@@ -22,6 +24,8 @@ class User(BaseModel):
 class UserDirectory:
     def __init__(self, db_path: str = "user_directory.db"):
         self.db_path = db_path
+        # ReadOnlyConnectionPool for the queries, set by the web server
+        self.read_pool = None
         self._init_db()
 
         names_of_tools_to_expose = [
@@ -46,6 +50,8 @@ class UserDirectory:
     def _init_db(self):
         """Initialize the SQLite database with required tables"""
         conn = sqlite3.connect(self.db_path)
+        # the web server reads while agents send messages from the orchestrator process
+        conn.execute("PRAGMA journal_mode=WAL")
         cursor = conn.cursor()
         
         # Create users table
@@ -69,6 +75,8 @@ class UserDirectory:
             FOREIGN KEY (to_user_id) REFERENCES users(id)
         )
         ''')
+
+        create_change_events_table(conn)
         
         conn.commit()
         conn.close()
@@ -92,6 +100,65 @@ class UserDirectory:
         
         return f"User {agent.id} added."
     
+    ############### Queries ###############
+    # typed results for callers such as server.py, the agent tools below format these as text
+
+    @contextmanager
+    def _read_connection(self):
+        if self.read_pool is not None:
+            with self.read_pool.connection() as conn:
+                yield conn
+            return
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def list_users(self) -> List[User]:
+        with self._read_connection() as conn:
+            rows = conn.execute("SELECT id, name FROM users").fetchall()
+        return [User(id=user_id, name=name) for user_id, name in rows]
+
+    def query_messages(self, to_user_id: str, sender_id: Optional[str] = None, limit: int = 10) -> List[UserMessage]:
+        """Messages to to_user_id, newest first"""
+        with self._read_connection() as conn:
+            if sender_id:
+                rows = conn.execute(
+                    "SELECT message_id, from_user_id, from_user_name, message FROM messages "
+                    "WHERE to_user_id = ? AND from_user_id = ? ORDER BY rowid DESC LIMIT ?",
+                    (to_user_id, sender_id, limit)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT message_id, from_user_id, from_user_name, message FROM messages "
+                    "WHERE to_user_id = ? ORDER BY rowid DESC LIMIT ?",
+                    (to_user_id, limit)
+                ).fetchall()
+        return [self._row_to_message(row) for row in rows]
+
+    def count_new_messages(self, to_user_id: str) -> int:
+        with self._read_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM messages WHERE to_user_id = ? AND is_new = 1", (to_user_id,)).fetchone()[0]
+
+    def take_new_messages(self, to_user_id: str) -> List[UserMessage]:
+        """New messages to to_user_id, marked as read in the same transaction"""
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            rows = conn.execute(
+                "SELECT message_id, from_user_id, from_user_name, message FROM messages WHERE to_user_id = ? AND is_new = 1",
+                (to_user_id,)
+            ).fetchall()
+            # only the messages returned, one arriving in between stays new
+            conn.executemany("UPDATE messages SET is_new = 0 WHERE message_id = ?", [(row[0],) for row in rows])
+        conn.close()
+        return [self._row_to_message(row) for row in rows]
+
+    def _row_to_message(self, row) -> UserMessage:
+        return UserMessage(message_id=row[0], from_user_id=row[1], from_user_name=row[2], message=row[3])
+
+    ############### Tools ###############
+
     def get_users(self):
         """
         {
@@ -101,16 +168,9 @@ class UserDirectory:
             "arguments": []
         }
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id, name FROM users")
-        users = cursor.fetchall()
-        conn.close()
-        
         results = "Users:\n"
-        for user_id, name in users:
-            results += f"    - {name} (user_id: {user_id})\n"
+        for user in self.list_users():
+            results += f"    - {user.name} (user_id: {user.id})\n"
         
         return results
 
@@ -141,6 +201,7 @@ class UserDirectory:
             "INSERT INTO messages (message_id, from_user_id, from_user_name, to_user_id, message, is_new) VALUES (?, ?, ?, ?, ?, 1)",
             (message_id, agent.id, agent.name, user_id, message)
         )
+        record_change_event(conn, "message", {"message_id": message_id, "from_user_id": agent.id, "from_user_name": agent.name, "to_user_id": user_id})
         
         conn.commit()
         conn.close()
@@ -156,25 +217,20 @@ class UserDirectory:
             "arguments": []
         }
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM messages WHERE to_user_id = ? AND is_new = 1", (agent.id,))
-        count = cursor.fetchone()[0]
-        conn.close()
+        count = self.count_new_messages(agent.id)
         
         if count == 0:
             return "Messages:\n    [No new messages]"
         return f"There are {count} new messages."
 
-    def _get_messages_string(self, messages):
+    def _get_messages_string(self, messages: List[UserMessage]):
         results = "Messages:\n"
         if not messages:
             results += "    [No messages]\n"
             return results
             
-        for message_id, from_user_id, from_user_name, message in messages:
-            results += f"    - From {from_user_name}: {message}\n"
+        for message in messages:
+            results += f"    - From {message.from_user_name}: {message.message}\n"
         return results
 
     def get_new_messages(self, agent: Agent):
@@ -186,25 +242,7 @@ class UserDirectory:
             "arguments": []
         }
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT message_id, from_user_id, from_user_name, message FROM messages WHERE to_user_id = ? AND is_new = 1",
-            (agent.id,)
-        )
-        messages = cursor.fetchall()
-        
-        # Mark messages as read
-        cursor.execute(
-            "UPDATE messages SET is_new = 0 WHERE to_user_id = ? AND is_new = 1",
-            (agent.id,)
-        )
-        
-        conn.commit()
-        conn.close()
-        
-        return self._get_messages_string(messages)
+        return self._get_messages_string(self.take_new_messages(agent.id))
 
     def get_messages(self, agent: Agent, sender_id: Optional[str] = None, limit: int = 10):
         """
@@ -218,26 +256,7 @@ class UserDirectory:
             ]
         }
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if sender_id:
-            cursor.execute(
-                "SELECT message_id, from_user_id, from_user_name, message FROM messages "
-                "WHERE to_user_id = ? AND from_user_id = ? ORDER BY rowid DESC LIMIT ?",
-                (agent.id, sender_id, limit)
-            )
-        else:
-            cursor.execute(
-                "SELECT message_id, from_user_id, from_user_name, message FROM messages "
-                "WHERE to_user_id = ? ORDER BY rowid DESC LIMIT ?",
-                (agent.id, limit)
-            )
-            
-        messages = cursor.fetchall()
-        conn.close()
-        
-        return self._get_messages_string(messages)
+        return self._get_messages_string(self.query_messages(agent.id, sender_id, limit))
 
     ############### Agent Interface ###############
     def get_toolset_details(self):
@@ -250,6 +269,9 @@ class UserDirectory:
     def get_tool_schemas(self):
         return [tool_schema.model_dump_json() for tool_schema in self.tool_schemas]
     
+    def get_read_only_tools(self):
+        return ["get_messages", "get_new_message_count", "get_users"]
+    
     def agent_tool_callback(self, agent: Agent, tool_call: ToolCall):
         if tool_call.name == "send_message":
             return self.send_message(agent, tool_call.arguments["user_id"], tool_call.arguments["message"])
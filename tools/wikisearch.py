@@ -46,6 +46,9 @@ class WikiSearch:
             description="Fetches Wikipedia text, title, and url. only call one of these per pass as to not overwhelm the API and your context.",
         ).model_dump_json()
         return [tool_schema]
+
+    def get_read_only_tools(self):
+        return ["get_wikipedia_text"]
     
     def agent_tool_callback(self, agent: Agent, tool_call: ToolCall):
         tool_results = None